@@ -11,16 +11,34 @@ We harden against that here by:
   * skipping obviously-malformed embed URLs that point back at the source,
   * if the user's chosen stream type has no working server, falling back
     to other available types so we always return something usable.
+
+Episode lists are kept in a persistent per-series index (EpisodeIndex,
+stored through cache.py) with O(1) lookup by episode number; we only go
+back to AnimeKAI when the index is stale or the wanted episode is missing.
+
+Servers (and fallback stream types) are tried in order of expected
+time-to-success from a persisted health scoreboard (ServerHealth), and
+servers that keep failing are benched for a while.
+
+Servers for a stream type are raced on a small thread pool by default
+(first server to produce valid variants wins, the rest are told to stop),
+so one slow decoder no longer holds up the whole resolution. Set
+ANIMEKAI_RACE_WORKERS=1 to get the old one-server-at-a-time behaviour.
 """
 from __future__ import annotations
 
 import asyncio
 import logging
+import os
+import threading
 import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from dataclasses import dataclass, field
 from typing import Dict, List, Optional, Tuple
 from urllib.parse import urlparse
 
+import cache
+import metrics
 from animekai_tmux.api import AnimeKAIClient  # type: ignore
 from animekai_tmux.utils.constants import ALT_URLS, BASE_URL  # type: ignore
 from animekai_tmux.utils.network import get_working_domain  # type: ignore
@@ -31,6 +49,16 @@ log = logging.getLogger(__name__)
 # returns one of these, the decode result is junk and we must skip it.
 _SOURCE_HOSTS = {urlparse(u).netloc for u in ([BASE_URL] + list(ALT_URLS))}
 
+# How many servers of one stream type to resolve at the same time.
+RACE_WORKERS = max(1, int(os.getenv("ANIMEKAI_RACE_WORKERS", "4") or 4))
+
+# Episode index: re-list a series at most this often (seconds) unless the
+# episode we need isn't in the index yet.
+EPISODE_INDEX_TTL = int(os.getenv("ANIMEKAI_EPISODE_TTL", "21600") or 21600)
+# Don't hammer AnimeKAI for an episode that simply isn't out yet.
+_EPISODE_MISS_REFRESH = 60.0
+_episode_store = cache.TTLCache("kai-episodes", max_entries=1000)
+
 # Lazy domain resolution: pick a reachable AnimeKAI mirror once, then reuse.
 _client: Optional[AnimeKAIClient] = None
 _client_lock = asyncio.Lock()
@@ -67,6 +95,62 @@ class EpisodeResult:
     token: str
 
 
+def _episode_key(number: str) -> str:
+    """Normalize "01" / "1.0" / "1" to one key; keep "1.5" as is."""
+    n = str(number).strip()
+    try:
+        f = float(n)
+    except ValueError:
+        return n
+    return str(int(f)) if f.is_integer() else str(f)
+
+
+class EpisodeIndex:
+    """Episodes of one series keyed by normalized episode number."""
+
+    def __init__(self, path: str, episodes: Optional[List[EpisodeResult]] = None,
+                 fetched_at: float = 0.0):
+        self.path = path
+        self.fetched_at = fetched_at
+        self._by_number: Dict[str, EpisodeResult] = {}
+        self.merge(episodes or [])
+
+    def __len__(self) -> int:
+        return len(self._by_number)
+
+    def get(self, number: str) -> Optional[EpisodeResult]:
+        return self._by_number.get(_episode_key(number))
+
+    @property
+    def episodes(self) -> List[EpisodeResult]:
+        return list(self._by_number.values())
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.fetched_at
+
+    def merge(self, episodes: List[EpisodeResult]) -> int:
+        """Add episodes we haven't seen yet; returns how many were new."""
+        added = 0
+        for ep in episodes:
+            key = _episode_key(ep.number)
+            if key not in self._by_number:
+                added += 1
+            self._by_number[key] = ep
+        return added
+
+    def to_json(self) -> dict:
+        return {
+            "fetched_at": self.fetched_at,
+            "episodes": [[e.number, e.title, e.token] for e in self._by_number.values()],
+        }
+
+    @classmethod
+    def from_json(cls, path: str, data: dict) -> "EpisodeIndex":
+        eps = [EpisodeResult(number=n, title=t, token=tok) for n, t, tok in data.get("episodes") or []]
+        return cls(path, eps, float(data.get("fetched_at") or 0.0))
+
+
 @dataclass
 class StreamVariant:
     quality: str
@@ -130,18 +214,143 @@ def _is_valid_embed(embed_url: str) -> bool:
     return True
 
 
+class ServerHealth:
+    """Per-server-name scoreboard used to order (and temporarily skip) servers.
+
+    Tracks an EWMA of success rate and time-to-result per server name, plus
+    invalid-embed counts. Servers are tried in order of expected
+    time-to-success (latency / success rate); a server that failed
+    SKIP_AFTER times in a row is benched for a while, doubling each time it
+    fails again. The table is kept in memory and written to cache.py at most
+    every SAVE_INTERVAL seconds so it survives restarts.
+    """
+
+    ALPHA = 0.3
+    SKIP_AFTER = 3
+    SKIP_BASE = 120.0
+    SKIP_MAX = 3600.0
+    SAVE_INTERVAL = 60.0
+    _DEFAULT_LATENCY = 10.0
+
+    def __init__(self, store: Optional[cache.TTLCache] = None):
+        self._store = store
+        self._lock = threading.Lock()
+        self._last_save = 0.0
+        self._stats: Dict[str, Dict[str, float]] = {}
+        if store is not None:
+            self._stats = store.get("servers") or {}
+
+    def _entry(self, name: str) -> Dict[str, float]:
+        return self._stats.setdefault(name, {
+            "success_rate": 0.5, "latency": self._DEFAULT_LATENCY,
+            "attempts": 0, "successes": 0, "invalid_embeds": 0,
+            "fail_streak": 0, "skip_until": 0.0,
+        })
+
+    def record(self, name: str, ok: bool, latency: float, invalid_embed: bool = False) -> None:
+        now = time.time()
+        with self._lock:
+            e = self._entry(name)
+            a = self.ALPHA
+            e["attempts"] += 1
+            e["success_rate"] = (1 - a) * e["success_rate"] + a * (1.0 if ok else 0.0)
+            e["latency"] = (1 - a) * e["latency"] + a * latency
+            if invalid_embed:
+                e["invalid_embeds"] += 1
+            if ok:
+                e["successes"] += 1
+                e["fail_streak"] = 0
+                e["skip_until"] = 0.0
+            else:
+                e["fail_streak"] += 1
+                if e["fail_streak"] >= self.SKIP_AFTER:
+                    backoff = self.SKIP_BASE * 2 ** (e["fail_streak"] - self.SKIP_AFTER)
+                    e["skip_until"] = now + min(backoff, self.SKIP_MAX)
+                    log.info(
+                        "AnimeKAI server %s benched for %.0fs after %d failures",
+                        name, e["skip_until"] - now, e["fail_streak"],
+                    )
+            if self._store is not None and now - self._last_save >= self.SAVE_INTERVAL:
+                self._last_save = now
+                self._store.set("servers", self._stats, ttl=30 * 24 * 3600)
+
+    def expected_cost(self, name: str) -> float:
+        """Expected seconds until this server yields variants."""
+        e = self._stats.get(name)
+        if e is None:
+            return self._DEFAULT_LATENCY / 0.5
+        return e["latency"] / max(e["success_rate"], 0.05)
+
+    def is_benched(self, name: str) -> bool:
+        e = self._stats.get(name)
+        return bool(e) and e["skip_until"] > time.time()
+
+    def order(self, servers: List[Dict]) -> List[Dict]:
+        """Healthy servers sorted by expected cost; benched ones are dropped
+        unless that would leave nothing to try."""
+        names = [str(s.get("name") or "server") for s in servers]
+        with self._lock:
+            ranked = sorted(
+                zip(names, servers), key=lambda p: self.expected_cost(p[0])
+            )
+            healthy = [s for n, s in ranked if not self.is_benched(n)]
+        if len(healthy) < len(servers):
+            log.info(
+                "AnimeKAI: skipping %d benched server(s)", len(servers) - len(healthy)
+            )
+        return healthy or [s for _, s in ranked]
+
+    def type_cost(self, servers: List[Dict]) -> float:
+        """Cost of a stream type = its best server's expected cost."""
+        with self._lock:
+            costs = [
+                self.expected_cost(str(s.get("name") or "server"))
+                for s in servers if not self.is_benched(str(s.get("name") or "server"))
+            ]
+        return min(costs) if costs else float("inf")
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {k: dict(v) for k, v in self._stats.items()}
+
+    def save(self) -> None:
+        if self._store is not None:
+            with self._lock:
+                self._store.set("servers", self._stats, ttl=30 * 24 * 3600)
+
+
+health = ServerHealth(cache.TTLCache("kai-health", max_entries=10))
+
+
+def _backoff(stop: Optional[threading.Event], attempt: int) -> None:
+    """Sleep between decoder retries, waking early if the race was decided."""
+    delay = 0.7 * attempt
+    if stop is None:
+        time.sleep(delay)
+    else:
+        stop.wait(delay)
+
+
 def _resolve_one_server(
     client: AnimeKAIClient, path: str, srv: Dict, stream_type: str,
-    decoder_attempts: int = 3,
+    decoder_attempts: int = 3, stop: Optional[threading.Event] = None,
 ) -> List["StreamVariant"]:
-    """Try one server with retries on the flaky decoder. Returns variants or []."""
+    """Try one server with retries on the flaky decoder. Returns variants or [].
+
+    If `stop` gets set (another server already won), give up at the next
+    retry boundary instead of burning more decoder calls.
+    """
     lid = srv.get("lid") or ""
     name = str(srv.get("name") or "server")
     if not lid:
         return []
 
+    started = time.monotonic()
+    invalid_embed = False
     last_error: Optional[Exception] = None
     for attempt in range(1, decoder_attempts + 1):
+        if stop is not None and stop.is_set():
+            return []
         try:
             source = client.get_source(lid, path) or {}
             embed_url = (source.get("url") or "").strip()
@@ -150,8 +359,9 @@ def _resolve_one_server(
                     "AnimeKAI server %s returned invalid embed (attempt %d/%d): %r",
                     name, attempt, decoder_attempts, embed_url,
                 )
+                invalid_embed = True
                 last_error = RuntimeError(f"invalid embed: {embed_url!r}")
-                time.sleep(0.7 * attempt)
+                _backoff(stop, attempt)
                 continue
             variants = client.get_m3u8_variants(embed_url) or []
             if not variants:
@@ -160,7 +370,7 @@ def _resolve_one_server(
                     name, attempt, decoder_attempts, embed_url,
                 )
                 last_error = RuntimeError("no variants")
-                time.sleep(0.7 * attempt)
+                _backoff(stop, attempt)
                 continue
             out: List[StreamVariant] = []
             for v in variants:
@@ -179,6 +389,7 @@ def _resolve_one_server(
                     digits = "".join(ch for ch in s.quality if ch.isdigit())
                     return int(digits) if digits else 0
                 out.sort(key=_qkey, reverse=True)
+                health.record(name, True, time.monotonic() - started)
                 return out
         except Exception as e:
             last_error = e
@@ -186,18 +397,60 @@ def _resolve_one_server(
                 "AnimeKAI server %s failed (attempt %d/%d): %s",
                 name, attempt, decoder_attempts, e,
             )
-            time.sleep(0.7 * attempt)
+            _backoff(stop, attempt)
             continue
 
     if last_error:
         log.info("Server %s exhausted retries: %s", name, last_error)
+    # A server that lost a race didn't fail; only count genuine exhaustion.
+    if stop is None or not stop.is_set():
+        health.record(name, False, time.monotonic() - started, invalid_embed=invalid_embed)
     return []
 
 
+def _race_servers(
+    client: AnimeKAIClient, path: str, servers: List[Dict], stream_type: str,
+    workers: int,
+) -> List[StreamVariant]:
+    """Resolve `servers` concurrently and return the first non-empty result.
+
+    Threads can't be killed mid-request, so "cancel" means: pending servers
+    never start, and running ones bail out at their next retry boundary.
+    """
+    stop = threading.Event()
+    pool = ThreadPoolExecutor(
+        max_workers=min(workers, len(servers)), thread_name_prefix="kai-race",
+    )
+    try:
+        pending = {
+            pool.submit(_resolve_one_server, client, path, srv, stream_type, 3, stop)
+            for srv in servers
+        }
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                try:
+                    variants = fut.result()
+                except Exception as e:
+                    log.warning("AnimeKAI race worker crashed: %s", e)
+                    continue
+                if variants:
+                    return variants
+        return []
+    finally:
+        stop.set()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
 def _list_variants_sync(
     client: AnimeKAIClient, path: str, token: str, stream_type: str,
+    race: bool = True,
 ) -> List[StreamVariant]:
-    """Walk every server for the chosen type, then fall back to other types."""
+    """Walk every server for the chosen type, then fall back to other types.
+
+    With `race`, the servers of each type are resolved concurrently; the type
+    fallback order is the same either way.
+    """
     servers_by_type: Dict[str, list] = client.get_servers(token, path) or {}
     if not servers_by_type:
         log.info("AnimeKAI returned no servers at all for token=%s", token)
@@ -213,20 +466,31 @@ def _list_variants_sync(
     for t in servers_by_type.keys():
         if t not in type_order:
             type_order.append(t)
+    # The requested type always goes first; fallbacks go fastest-expected
+    # first (sorted() is stable, so unknown servers keep the default order).
+    type_order = type_order[:1] + sorted(
+        type_order[1:], key=lambda t: health.type_cost(servers_by_type.get(t) or []),
+    )
 
     for t in type_order:
-        servers = servers_by_type.get(t) or []
+        servers = health.order(servers_by_type.get(t) or [])
         if not servers:
             continue
-        for srv in servers:  # try every server, not just first 3
-            variants = _resolve_one_server(client, path, srv, t)
-            if variants:
-                if t != stream_type:
-                    log.info(
-                        "AnimeKAI: requested type=%s had no working server; "
-                        "served from fallback type=%s", stream_type, t,
-                    )
-                return variants
+        if race and RACE_WORKERS > 1 and len(servers) > 1:
+            variants = _race_servers(client, path, servers, t, RACE_WORKERS)
+        else:
+            variants = []
+            for srv in servers:  # try every server, not just first 3
+                variants = _resolve_one_server(client, path, srv, t)
+                if variants:
+                    break
+        if variants:
+            if t != stream_type:
+                log.info(
+                    "AnimeKAI: requested type=%s had no working server; "
+                    "served from fallback type=%s", stream_type, t,
+                )
+            return variants
 
     log.info("All AnimeKAI servers failed for token=%s type=%s", token, stream_type)
     return []
@@ -237,33 +501,122 @@ def _list_variants_sync(
 
 async def search(query: str, limit: int = 10, timeout: float = 30.0) -> List[AnimeResult]:
     client = await _get_client()
-    return await asyncio.wait_for(
-        asyncio.to_thread(_search_sync, client, query, limit), timeout=timeout
-    )
+    with metrics.timer("animekai_seconds", op="search"):
+        return await asyncio.wait_for(
+            asyncio.to_thread(_search_sync, client, query, limit), timeout=timeout
+        )
 
 
-async def list_episodes(path: str, timeout: float = 45.0) -> List[EpisodeResult]:
+async def episode_index(
+    path: str, want: Optional[str] = None, timeout: float = 45.0,
+) -> EpisodeIndex:
+    """Return the persisted episode index for `path`, refreshing it when it is
+    older than EPISODE_INDEX_TTL or (rate-limited) when `want` is missing."""
+    cached = _episode_store.get(path)
+    index = EpisodeIndex.from_json(path, cached) if cached else EpisodeIndex(path)
+
+    stale = not cached or index.age > EPISODE_INDEX_TTL
+    missing = want is not None and index.get(want) is None and index.age > _EPISODE_MISS_REFRESH
+    if not (stale or missing):
+        return index
+
     client = await _get_client()
-    return await asyncio.wait_for(
-        asyncio.to_thread(_episodes_sync, client, path), timeout=timeout
-    )
+    with metrics.timer("animekai_seconds", op="episodes"):
+        fresh = await asyncio.wait_for(
+            asyncio.to_thread(_episodes_sync, client, path), timeout=timeout
+        )
+    if fresh:
+        added = index.merge(fresh)
+        index.fetched_at = time.time()
+        _episode_store.set(path, index.to_json(), ttl=30 * 24 * 3600)
+        if cached and added:
+            log.info("AnimeKAI episode index %s: +%d new episode(s)", path, added)
+    return index
+
+
+async def list_episodes(path: str, timeout: float = 45.0) -> List[EpisodeResult]:
+    return (await episode_index(path, timeout=timeout)).episodes
 
 
 async def list_stream_types(
     path: str, token: str, timeout: float = 30.0,
 ) -> List[str]:
     client = await _get_client()
-    return await asyncio.wait_for(
-        asyncio.to_thread(_list_stream_types_sync, client, path, token),
-        timeout=timeout,
-    )
+    with metrics.timer("animekai_seconds", op="stream_types"):
+        return await asyncio.wait_for(
+            asyncio.to_thread(_list_stream_types_sync, client, path, token),
+            timeout=timeout,
+        )
 
 
 async def list_variants(
     path: str, token: str, stream_type: str, timeout: float = 180.0,
+    race: bool = True,
 ) -> List[StreamVariant]:
     client = await _get_client()
-    return await asyncio.wait_for(
-        asyncio.to_thread(_list_variants_sync, client, path, token, stream_type),
-        timeout=timeout,
-    )
+    with metrics.timer("animekai_seconds", op="variants"):
+        variants = await asyncio.wait_for(
+            asyncio.to_thread(_list_variants_sync, client, path, token, stream_type, race),
+            timeout=timeout,
+        )
+    if not variants:
+        metrics.error("animekai.variants")
+    return variants
+
+
+class ResolveContext:
+    """Per-job memo of AnimeKAI lookups.
+
+    One /anime job asks AnimeKAI the same questions several times (caption
+    stream links, then the download fallback once per resolution). Create
+    one context per job and pass it through; every distinct call is made at
+    most once, and concurrent callers share the in-flight request. Failed
+    calls are not memoized so a later caller can retry.
+    """
+
+    def __init__(self) -> None:
+        self._calls: Dict[Tuple, asyncio.Future] = {}
+
+    async def _memo(self, key: Tuple, make):
+        fut = self._calls.get(key)
+        if fut is None:
+            fut = self._calls[key] = asyncio.ensure_future(make())
+        try:
+            # shield: one caller timing out / being cancelled must not kill
+            # the shared request for everyone else.
+            return await asyncio.shield(fut)
+        except Exception:
+            if self._calls.get(key) is fut and fut.done():
+                del self._calls[key]
+            raise
+
+    async def search(self, query: str, limit: int = 10, timeout: float = 30.0) -> List[AnimeResult]:
+        return await self._memo(
+            ("search", query, limit), lambda: search(query, limit, timeout)
+        )
+
+    async def list_episodes(self, path: str, timeout: float = 45.0) -> List[EpisodeResult]:
+        return await self._memo(
+            ("episodes", path), lambda: list_episodes(path, timeout)
+        )
+
+    async def episode_index(
+        self, path: str, want: Optional[str] = None, timeout: float = 45.0,
+    ) -> EpisodeIndex:
+        return await self._memo(
+            ("episode_index", path, _episode_key(want) if want else None),
+            lambda: episode_index(path, want, timeout),
+        )
+
+    async def list_stream_types(self, path: str, token: str, timeout: float = 30.0) -> List[str]:
+        return await self._memo(
+            ("types", path, token), lambda: list_stream_types(path, token, timeout)
+        )
+
+    async def list_variants(
+        self, path: str, token: str, stream_type: str, timeout: float = 180.0,
+    ) -> List[StreamVariant]:
+        return await self._memo(
+            ("variants", path, token, stream_type),
+            lambda: list_variants(path, token, stream_type, timeout),
+        )
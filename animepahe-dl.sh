@@ -35,13 +35,17 @@ set_var() {
 
     _SCRIPT_PATH=$(dirname "$(realpath "$0")")
     _ANIME_LIST_FILE="$_SCRIPT_PATH/anime.list"
-    _SOURCE_FILE=".source.json"
+    _SOURCE_DIR="$_SCRIPT_PATH/.sources"
+    # Reuse a series' episode manifest for this long (seconds)
+    _SOURCE_TTL="${ANIMEPAHE_DL_SOURCE_TTL:-21600}"
+    # Release pages fetched at the same time
+    _SOURCE_JOBS="${ANIMEPAHE_DL_SOURCE_JOBS:-4}"
 }
 
 set_args() {
     expr "$*" : ".*--help" > /dev/null && usage
     _PARALLEL_JOBS=1
-    while getopts ":hlda:s:e:r:t:o:" opt; do
+    while getopts ":hlda:s:e:r:t:o:O:" opt; do
         case $opt in
             a) _INPUT_ANIME_NAME="$OPTARG" ;;
             s) _ANIME_SLUG="$OPTARG" ;;
@@ -54,6 +58,7 @@ set_args() {
                fi
                ;;
             o) _ANIME_AUDIO="$OPTARG" ;;
+            O) _OUTPUT_FILE="$OPTARG" ;;
             d) _DEBUG_MODE=true; set -x ;;
             h) usage ;;
             \?) print_error "Invalid option: -$OPTARG" ;;
@@ -88,29 +93,126 @@ search_anime_by_name() {
     fi
 }
 
-get_episode_list() { get "${_API_URL}?m=release&id=${1}&sort=episode_asc&page=${2}"; }
+get_episode_list() {
+    # -f: an HTTP error page must fail here, not end up in the manifest
+    curl_req -fsS -L "${_API_URL}?m=release&id=${1}&sort=episode_asc&page=${2}" -H "cookie: $_COOKIE" --compressed
+}
+
+source_has_episodes() {
+    # True if every episode named in spec $1 ("5", "1-12", "1,3", "*") is in the manifest
+    local spec="$1" eps i
+    eps="$("$_JQ" -r '.data[].episode | tonumber' "$_SOURCE_PATH")"
+    [[ -z "$eps" ]] && return 1
+    IFS="," read -ra ADDR <<< "$spec"
+    for i in "${ADDR[@]}"; do
+        [[ "$i" == *"*"* ]] && continue
+        # For a range, its last episode is the one most likely to be missing
+        i="${i##*-}"
+        grep -qx "$(awk '{print $1 + 0}' <<< "$i")" <<< "$eps" || return 1
+    done
+}
 
 download_source() {
-    local d p n
-    mkdir -p "$_SCRIPT_PATH/$_ANIME_NAME"
-    d="$(get_episode_list "$_ANIME_SLUG" "1")"
-    p="$("$_JQ" -r '.last_page' <<< "$d")"
-    if [[ "$p" -gt "1" ]]; then
-        for i in $(seq 2 "$p"); do
-            n="$(get_episode_list "$_ANIME_SLUG" "$i")"
-            d="$(echo "$d $n" | "$_JQ" -s '.[0].data + .[1].data | {data: .}')"
-        done
+    # Per-slug episode manifest ({data, total, last_page, fetched_at}) under
+    # .sources/. It is reused as is while younger than _SOURCE_TTL and it has
+    # the requested episode(s); otherwise page 1 is fetched, and the pages we
+    # don't have yet are fetched _SOURCE_JOBS at a time and merged in one jq pass.
+    # The new manifest is written to a private temp file next to it and moved
+    # into place, so parallel runs for the same slug never see a partial one.
+    local d p t f new tmpd="" now start=2 old_t old_p old_f old=""
+    f="$_SOURCE_PATH"
+    mkdir -p "$(dirname "$f")"
+    now="$(date +%s)"
+
+    if [[ -s "$f" ]]; then
+        old_f="$("$_JQ" -r '.fetched_at // 0' "$f" 2>/dev/null || echo 0)"
+        if (( now - ${old_f%.*} < _SOURCE_TTL )) \
+            && { [[ -z "${_ANIME_EPISODE:-}" ]] || source_has_episodes "$_ANIME_EPISODE"; }; then
+            print_info "Using cached episode index ($(( now - ${old_f%.*} ))s old)"
+            return
+        fi
+    fi
+
+    d="$(get_episode_list "$_ANIME_SLUG" "1")" || print_error "Failed to fetch episode list"
+    p="$("$_JQ" -r '.last_page' <<< "$d")" || print_error "Bad episode list response"
+    t="$("$_JQ" -r '.total' <<< "$d")"
+
+    new="$(mktemp "$f.XXXXXX")"
+    # Removed however we leave (set -e included); after the mv it's already gone.
+    trap 'rm -rf "$new" ${tmpd:+"$tmpd"}' EXIT
+
+    if [[ -s "$f" ]]; then
+        old_t="$("$_JQ" -r '.total // empty' "$f" 2>/dev/null || true)"
+        old_p="$("$_JQ" -r '.last_page // empty' "$f" 2>/dev/null || true)"
+        if [[ -n "$old_t" && "$old_t" == "$t" ]]; then
+            print_info "Episode index up to date ($t episodes)"
+            "$_JQ" --argjson now "$now" '.fetched_at = $now' "$f" > "$new" && mv "$new" "$f"
+            rm -f "$new"
+            trap - EXIT
+            return
+        fi
+        if [[ -n "$old_p" && "$old_p" -ge 1 ]]; then
+            start="$old_p"
+            old="$f"
+            print_info "Episode index: $old_t -> $t episodes, refreshing from page $start"
+        fi
     fi
-    echo "$d" > "$_SCRIPT_PATH/$_ANIME_NAME/$_SOURCE_FILE"
+
+    tmpd="$(mktemp -d)"
+    echo "$d" > "$tmpd/page-1.json"
+    if [[ "$p" -ge "$start" ]]; then
+        export _CURL_CMD _USER_AGENT _COOKIE _API_URL _ANIME_SLUG tmpd
+        export -f curl_req get get_episode_list
+        seq "$start" "$p" | grep -vx 1 \
+            | xargs -I {} -P "$_SOURCE_JOBS" bash -c 'get_episode_list "$_ANIME_SLUG" {} > "$tmpd/page-{}.json"' \
+            || print_error "Failed to fetch episode list pages"
+    fi
+    # shellcheck disable=SC2086
+    "$_JQ" -s --argjson total "$t" --argjson last "$p" --argjson now "$now" \
+        '{data: ([.[].data // [] | .[]] | unique_by(.session) | sort_by(.episode | tonumber)),
+          total: $total, last_page: $last, fetched_at: $now}' $old "$tmpd"/page-*.json > "$new" \
+        || print_error "Bad episode list response"
+    mv "$new" "$f"
+    rm -rf "$tmpd"
+    trap - EXIT
 }
 
-get_episode_link() {
-    local s o l r="" size_str=""
-    s=$("$_JQ" -r '.data[] | select((.episode | tonumber) == ($num | tonumber)) | .session' --arg num "$1" < "$_SCRIPT_PATH/$_ANIME_NAME/$_SOURCE_FILE")
+get_play_buttons() {
+    # Kwik buttons of an episode's play page, one per line (non-AV1 only)
+    local s o
+    s=$("$_JQ" -r '.data[] | select((.episode | tonumber) == ($num | tonumber)) | .session' --arg num "$1" < "$_SOURCE_PATH")
     [[ "$s" == "" ]] && print_warn "Episode $1 not found!" && return
-    
+
     o="$(curl_req --compressed -sSL -H "cookie: $_COOKIE" "${_HOST}/play/${_ANIME_SLUG}/${s}")"
-    l="$(grep \<button <<< "$o" | grep data-src | sed -E 's/data-src="/\n/g' | grep 'data-av1="0"')"
+    grep \<button <<< "$o" | grep data-src | sed -E 's/data-src="/\n/g' | grep 'data-av1="0"'
+}
+
+over_size_limit() {
+    # True if a button's size, e.g. (150MB) or (1.2GB), is over _MAX_SIZE_MB
+    local size_val size_unit
+    [[ "$1" =~ \(([0-9.]+)(MB|GB)\) ]] || return 1
+    size_val=${BASH_REMATCH[1]}
+    size_unit=${BASH_REMATCH[2]}
+
+    # Convert float to integer for safe comparison
+    size_val=$(printf "%.0f" "$size_val")
+
+    if [[ "$size_unit" == "GB" ]]; then
+        # Any GB is definitely > 350MB
+        print_warn "⚠️ SKIPPING: File size is in GB ($size_val GB). Limit $_MAX_SIZE_MB MB."
+        return 0
+    elif [[ "$size_val" -gt "$_MAX_SIZE_MB" ]]; then
+        print_warn "⚠️ SKIPPING: File size $size_val MB is larger than limit $_MAX_SIZE_MB MB."
+        return 0
+    fi
+    print_info "✅ File size check passed: $size_val MB"
+    return 1
+}
+
+get_episode_link() {
+    local l r=""
+    l="$(get_play_buttons "$1")"
+    [[ "$l" == "" ]] && return
 
     if [[ -n "${_ANIME_AUDIO:-}" ]]; then
         print_info "Select audio language: $_ANIME_AUDIO"
@@ -133,28 +235,7 @@ get_episode_link() {
     fi
 
     # --- SIZE CHECK GUARD ---
-    # Extract size string e.g., (150MB) or (1.2GB)
-    if [[ "$final_line" =~ \(([0-9.]+)(MB|GB)\) ]]; then
-        local size_val=${BASH_REMATCH[1]}
-        local size_unit=${BASH_REMATCH[2]}
-        
-        # Convert float to integer for safe comparison
-        size_val=$(printf "%.0f" "$size_val")
-
-        if [[ "$size_unit" == "GB" ]]; then
-            # Any GB is definitely > 350MB
-            print_warn "⚠️ SKIPPING: File size is in GB ($size_val GB). Limit $_MAX_SIZE_MB MB."
-            exit 2
-        elif [[ "$size_unit" == "MB" ]]; then
-            if [[ "$size_val" -gt "$_MAX_SIZE_MB" ]]; then
-                print_warn "⚠️ SKIPPING: File size $size_val MB is larger than limit $_MAX_SIZE_MB MB."
-                exit 2
-            else
-                print_info "✅ File size check passed: $size_val MB"
-            fi
-        fi
-    fi
-    # ------------------------
+    if over_size_limit "$final_line"; then exit 2; fi
 
     # Return URL
     if [[ -z "${r:-}" ]]; then
@@ -164,6 +245,33 @@ get_episode_link() {
     fi
 }
 
+list_all_links() {
+    # -l -r all: resolve the play page once and print "<resolution> <m3u8>"
+    # for every resolution ("<resolution> skip" if over the size limit)
+    local l r line res
+    local -A by_res=()
+    l="$(get_play_buttons "$1" || true)"
+    [[ "$l" == "" ]] && return
+
+    r="$l"
+    if [[ -n "${_ANIME_AUDIO:-}" ]]; then
+        r="$(grep 'data-audio="'"$_ANIME_AUDIO"'"' <<< "$l" || true)"
+        [[ -z "${r:-}" ]] && r="$l"
+    fi
+
+    # Last button per resolution wins, like the single-resolution pick
+    while IFS= read -r line; do
+        [[ "$line" =~ data-resolution=\"([0-9]+)\" ]] || continue
+        by_res[${BASH_REMATCH[1]}]="$line"
+    done < <(grep kwik <<< "$r")
+
+    for res in $(printf '%s\n' "${!by_res[@]}" | sort -n); do
+        line="${by_res[$res]}"
+        if over_size_limit "$line"; then echo "$res skip"; continue; fi
+        echo "$res $(get_playlist_link "$(awk -F '"' '{print $1}' <<< "$line")")"
+    done
+}
+
 get_playlist_link() {
     local s l
     s="$(curl_req --compressed -sS -H "Referer: $_REFERER_URL" -H "cookie: $_COOKIE" "$1" \
@@ -214,8 +322,15 @@ decrypt_segments() {
 }
 
 download_episode() {
-    local num="$1" l pl v erropt='' extpicky=''
-    v="$_SCRIPT_PATH/${_ANIME_NAME}/${num}.mp4"
+    local num="$1" l pl v erropt='' extpicky='' progopt=''
+    # -O <file>: write exactly there (one episode per run) instead of the series folder
+    v="${_OUTPUT_FILE:-$_SCRIPT_PATH/${_ANIME_NAME}/${num}.mp4}"
+    [[ "$v" != /* ]] && v="$(pwd)/$v"
+
+    if [[ -n ${_LIST_LINK_ONLY:-} && "${_ANIME_RESOLUTION:-}" == "all" ]]; then
+        list_all_links "$num"
+        return
+    fi
 
     l=$(get_episode_link "$num")
     # Capture exit code 2 (Size Limit)
@@ -227,7 +342,10 @@ download_episode() {
 
     if [[ -z ${_LIST_LINK_ONLY:-} ]]; then
         print_info "Downloading Episode $1..."
+        mkdir -p "$(dirname "$v")"
         [[ -z "${_DEBUG_MODE:-}" ]] && erropt="-v error"
+        # ANIMEPAHE_DL_PROGRESS=1: ffmpeg's key=value progress on stderr, for the bot
+        [[ -n "${ANIMEPAHE_DL_PROGRESS:-}" ]] && progopt="-progress pipe:2 -nostats"
         
         # FFmpeg options
         if ffmpeg -h full 2>/dev/null| grep extension_picky >/dev/null; then
@@ -240,6 +358,7 @@ download_episode() {
             fname="file.list"
             cpath="$(pwd)"
             opath="$_SCRIPT_PATH/$_ANIME_NAME/${num}"
+            [[ -n "${_OUTPUT_FILE:-}" ]] && opath="${v%.*}.parts"
             plist="${opath}/playlist.m3u8"
             rm -rf "$opath"; mkdir -p "$opath"
 
@@ -250,21 +369,23 @@ download_episode() {
             generate_filelist "$plist" "${opath}/$fname"
 
             ! cd "$opath" && print_warn "Cannot change directory to $opath" && return
-            "$_FFMPEG" -f concat -safe 0 -i "$fname" -c copy $erropt -y "$v"
+            "$_FFMPEG" -f concat -safe 0 -i "$fname" -c copy $erropt $progopt -y "$v"
             ! cd "$cpath" && print_warn "Cannot change directory to $cpath" && return
-            [[ -z "${_DEBUG_MODE:-}" ]] && rm -rf "$opath" || return 0
+            [[ -z "${_DEBUG_MODE:-}" ]] && rm -rf "$opath"
         else
             # Direct Stream Mode (Single Thread - Standard for Koyeb)
-            "$_FFMPEG" $extpicky -headers "Referer: $_REFERER_URL" -i "$pl" -c copy $erropt -y "$v"
+            "$_FFMPEG" $extpicky -headers "Referer: $_REFERER_URL" -i "$pl" -c copy $erropt $progopt -y "$v"
         fi
+        # Report where the file went (stdout carries only this / the -l links)
+        echo "$v"
     else
         echo "$pl"
     fi
 }
 
 select_episodes_to_download() {
-    [[ "$(grep 'data' -c "$_SCRIPT_PATH/$_ANIME_NAME/$_SOURCE_FILE")" -eq "0" ]] && print_error "No episode available!"
-    "$_JQ" -r '.data[] | "[\(.episode | tonumber)] E\(.episode | tonumber) \(.created_at)"' "$_SCRIPT_PATH/$_ANIME_NAME/$_SOURCE_FILE" >&2
+    [[ "$(grep 'data' -c "$_SOURCE_PATH")" -eq "0" ]] && print_error "No episode available!"
+    "$_JQ" -r '.data[] | "[\(.episode | tonumber)] E\(.episode | tonumber) \(.created_at)"' "$_SOURCE_PATH" >&2
     echo -n "Which episode(s) to download: " >&2; read -r s; echo "$s"
 }
 
@@ -283,7 +404,7 @@ download_episodes() {
     for i in "${origel[@]}"; do
         if [[ "$i" == *"*"* ]]; then
             local eps fst lst
-            eps="$("$_JQ" -r '.data[].episode' "$_SCRIPT_PATH/$_ANIME_NAME/$_SOURCE_FILE" | sort -nu)"
+            eps="$("$_JQ" -r '.data[].episode' "$_SOURCE_PATH" | sort -nu)"
             fst="$(head -1 <<< "$eps")"; lst="$(tail -1 <<< "$eps")"; i="${fst}-${lst}"
         fi
         if [[ "$i" == *"-"* ]]; then
@@ -298,11 +419,15 @@ download_episodes() {
 main() {
     set_args "$@"
     set_var; set_cookie
-    if [[ -n "${_INPUT_ANIME_NAME:-}" ]]; then
+    if [[ -n "${_ANIME_SLUG:-}" ]] && grep -q "^\[$_ANIME_SLUG\]" "$_ANIME_LIST_FILE" 2>/dev/null; then
+        # Slug already known from an earlier search: no lookup needed
+        :
+    elif [[ -n "${_INPUT_ANIME_NAME:-}" ]]; then
         # Use head -n 1 as non-interactive fallback for fzf
         _ANIME_NAME=$(search_anime_by_name "$_INPUT_ANIME_NAME" | head -n 1)
-        _ANIME_SLUG="$(get_slug_from_name "$_ANIME_NAME")"
-    else 
+        # An explicit -s wins over the first search hit
+        _ANIME_SLUG="${_ANIME_SLUG:-$(get_slug_from_name "$_ANIME_NAME")}"
+    else
         download_anime_list
         if [[ -z "${_ANIME_SLUG:-}" ]]; then
              _ANIME_NAME=$(remove_slug < "$_ANIME_LIST_FILE" | head -n 1)
@@ -314,6 +439,7 @@ main() {
     _ANIME_NAME="$(grep "$_ANIME_SLUG" "$_ANIME_LIST_FILE" | tail -1 | remove_slug | sed -E 's/[[:space:]]+$//' | sed -E 's/[^[:alnum:] ,\+\-\)\(]/_/g')"
     if [[ "$_ANIME_NAME" == "" ]]; then print_warn "Anime name not found!"; exit 1; fi
 
+    _SOURCE_PATH="$_SOURCE_DIR/${_ANIME_SLUG}.json"
     download_source
     [[ -z "${_ANIME_EPISODE:-}" ]] && _ANIME_EPISODE=$(select_episodes_to_download)
     download_episodes "$_ANIME_EPISODE"
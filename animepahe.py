@@ -0,0 +1,306 @@
+"""Async AnimePahe client.
+
+Same shape as the animekai wrapper (search, list_episodes, list_variants),
+but talking to AnimePahe directly through the pooled HTTP session instead
+of running animepahe-dl.sh. The script spawns curl / jq / grep / sed / awk
+for every step of every episode; here the API JSON and the play page HTML
+are parsed in-process:
+
+    results = await animepahe.search("frieren")
+    episodes = await animepahe.list_episodes(results[0].session)
+    variants = await animepahe.list_variants(results[0].session, episodes[0].session)
+    m3u8 = await animepahe.playlist_url(variants[-1].kwik_url)
+
+Release pages 2..N of an episode list are fetched concurrently
+(PAHE_RELEASE_CONCURRENCY at a time) once page 1 tells us how many there
+are. The merged list is kept per series as a manifest in the shared TTL
+cache and reused until it is stale or lacks the episode asked for.
+
+The kwik embed still needs its packed JavaScript evaluated to reveal the
+m3u8 URL; playlist_url() hands it to the long-lived Node worker in kwik.py
+and remembers the result per kwik URL, so "-r all" and retries don't
+decode the same embed twice.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import re
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+from urllib.parse import quote
+
+import aiohttp
+
+import cache
+import httppool
+import kwik
+import metrics
+
+log = logging.getLogger(__name__)
+
+HOST = "https://animepahe.pw"
+KWIK_REFERER = "https://kwik.cx/"
+HEADERS = {
+    "User-Agent": (
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+        "AppleWebKit/537.36 (KHTML, like Gecko) "
+        "Chrome/120.0.0.0 Safari/537.36"
+    ),
+    "cookie": "__ddg2_=replitbot",
+}
+
+# Same limit as _MAX_SIZE_MB in animepahe-dl.sh.
+MAX_SIZE_MB = int(os.getenv("PAHE_MAX_SIZE_MB", "350") or 350)
+RELEASE_CONCURRENCY = max(1, int(os.getenv("PAHE_RELEASE_CONCURRENCY", "4") or 4))
+# Episode manifest: re-list a series at most this often (seconds) unless
+# the episode we need isn't in it yet.
+EPISODE_TTL = int(os.getenv("PAHE_EPISODE_TTL", "21600") or 21600)
+_EPISODE_MISS_REFRESH = 60.0
+# How long a decoded kwik -> m3u8 link is reused (seconds).
+KWIK_LINK_TTL = int(os.getenv("KWIK_LINK_TTL", "3600") or 3600)
+
+_BUTTON = re.compile(r"<button\b([^>]*)>(.*?)</button>", re.S | re.I)
+_ATTR = re.compile(r'data-([\w-]+)="([^"]*)"')
+_SIZE = re.compile(r"\(([0-9.]+)\s*(MB|GB)\)", re.I)
+_PACKED = re.compile(r"<script>(eval\(.*?)(?:</script>|$)", re.S | re.M)
+_SOURCE = re.compile(r"source='([^']+\.m3u8)")
+
+_episode_store = cache.TTLCache("pahe-episodes", max_entries=1000)
+_kwik_links = cache.TTLCache("kwik-links", max_entries=2000)
+_kwik_inflight: Dict[str, asyncio.Future] = {}
+
+
+@dataclass
+class AnimeResult:
+    title: str
+    session: str         # AnimePahe's series slug (the script's -s)
+    episodes: int = 0
+    poster: Optional[str] = None
+
+
+@dataclass
+class EpisodeResult:
+    number: str          # AnimePahe numbers episodes across seasons
+    session: str         # play page id
+    title: str = ""
+
+
+@dataclass
+class StreamVariant:
+    resolution: str
+    audio: str           # jpn / eng / ...
+    fansub: str
+    kwik_url: str
+    size_mb: Optional[float] = None
+    av1: bool = False
+
+    @property
+    def over_size_limit(self) -> bool:
+        return self.size_mb is not None and round(self.size_mb) > MAX_SIZE_MB
+
+
+def _episode_key(number: str) -> str:
+    """Normalize "01" / "1.0" / "1" to one key; keep "1.5" as is."""
+    n = str(number).strip()
+    try:
+        f = float(n)
+    except ValueError:
+        return n
+    return str(int(f)) if f.is_integer() else str(f)
+
+
+async def _get_json(url: str, timeout: float) -> dict:
+    async with httppool.session().get(
+        url, headers=HEADERS, timeout=aiohttp.ClientTimeout(total=timeout),
+    ) as r:
+        r.raise_for_status()
+        return await r.json(content_type=None) or {}
+
+
+async def _get_text(url: str, timeout: float, headers: Optional[Dict[str, str]] = None) -> str:
+    async with httppool.session().get(
+        url, headers={**HEADERS, **(headers or {})}, timeout=aiohttp.ClientTimeout(total=timeout),
+    ) as r:
+        r.raise_for_status()
+        return await r.text(errors="replace")
+
+
+def _parse_episodes(pages: List[dict], known: Optional[List[EpisodeResult]] = None) -> List[EpisodeResult]:
+    out: Dict[str, EpisodeResult] = {e.session: e for e in known or []}
+    for page in pages:
+        for ep in page.get("data") or []:
+            num, session = ep.get("episode"), ep.get("session")
+            if num is None or not session:
+                continue
+            out[str(session)] = EpisodeResult(
+                number=_episode_key(str(num)),
+                session=str(session),
+                title=str(ep.get("title") or ""),
+            )
+    return sorted(out.values(), key=_episode_order)
+
+
+def _episode_order(ep: EpisodeResult) -> float:
+    try:
+        return float(ep.number)
+    except ValueError:
+        return 0.0
+
+
+def parse_play_page(html: str) -> List[StreamVariant]:
+    """Kwik buttons of a play page, in page order (AV1 encodes included)."""
+    out: List[StreamVariant] = []
+    for attrs, text in _BUTTON.findall(html):
+        data = dict(_ATTR.findall(attrs))
+        src = data.get("src", "")
+        if "kwik" not in src:
+            continue
+        size = _SIZE.search(text)
+        size_mb = None
+        if size:
+            size_mb = float(size.group(1)) * (1024 if size.group(2).upper() == "GB" else 1)
+        out.append(StreamVariant(
+            resolution=data.get("resolution", ""),
+            audio=data.get("audio", ""),
+            fansub=data.get("fansub", ""),
+            kwik_url=src,
+            size_mb=size_mb,
+            av1=data.get("av1", "0") != "0",
+        ))
+    return out
+
+
+def _unpacker_script(html: str) -> Optional[str]:
+    """The kwik page's packed script, rewritten to print instead of eval."""
+    m = _PACKED.search(html)
+    if not m:
+        return None
+    return (
+        m.group(1)
+        .replace("document", "process")
+        .replace("querySelector", "exit")
+        .replace("eval(", "console.log(")
+    )
+
+
+# ---- public async API -----------------------------------------------------
+
+
+async def search(query: str, limit: int = 10, timeout: float = 15.0) -> List[AnimeResult]:
+    with metrics.timer("animepahe_seconds", op="search"):
+        data = await _get_json(f"{HOST}/api?m=search&q={quote(query)}", timeout)
+    out: List[AnimeResult] = []
+    for r in (data.get("data") or [])[:limit]:
+        session = r.get("session") or r.get("slug")
+        if not r.get("title") or not session:
+            continue
+        out.append(AnimeResult(
+            title=str(r["title"]),
+            session=str(session),
+            episodes=int(r.get("episodes") or 0),
+            poster=r.get("poster") or None,
+        ))
+    return out
+
+
+async def list_episodes(
+    session: str, want: Optional[str] = None, timeout: float = 30.0,
+) -> List[EpisodeResult]:
+    """
+    Every episode of a series, oldest first, from the persisted manifest.
+
+    The manifest is refreshed when it is older than EPISODE_TTL or (at most
+    once a minute) when episode `want` isn't in it. A refresh reads page 1;
+    if the total changed, pages from the last one we had up to the new last
+    page are fetched concurrently and merged into what we already know.
+    """
+    cached = _episode_store.get(session)
+    episodes = [EpisodeResult(n, s, t) for n, s, t in (cached or {}).get("episodes") or []]
+    age = time.time() - float((cached or {}).get("fetched_at") or 0.0)
+    stale = not cached or age > EPISODE_TTL
+    missing = want is not None and find_episode(episodes, want) is None and age > _EPISODE_MISS_REFRESH
+    if not (stale or missing):
+        return episodes
+
+    url = f"{HOST}/api?m=release&id={session}&sort=episode_asc&page="
+    with metrics.timer("animepahe_seconds", op="episodes"):
+        first = await _get_json(url + "1", timeout)
+        total = int(first.get("total") or 0)
+        last_page = int(first.get("last_page") or 1)
+        if cached and total == cached.get("total"):
+            pages = [first]
+        else:
+            start = max(2, int(cached.get("last_page") or 2)) if cached else 2
+            sem = asyncio.Semaphore(RELEASE_CONCURRENCY)
+
+            async def _page(n: int) -> dict:
+                async with sem:
+                    return await _get_json(url + str(n), timeout)
+
+            pages = [first, *await asyncio.gather(*(_page(n) for n in range(start, last_page + 1)))]
+    fresh = _parse_episodes(pages, episodes)
+    if cached and len(fresh) > len(episodes):
+        log.info("AnimePahe episode manifest %s: +%d new episode(s)", session, len(fresh) - len(episodes))
+    _episode_store.set(session, {
+        "fetched_at": time.time(),
+        "total": total,
+        "last_page": last_page,
+        "episodes": [[e.number, e.session, e.title] for e in fresh],
+    }, ttl=30 * 24 * 3600)
+    return fresh
+
+
+async def list_variants(session: str, episode_session: str, timeout: float = 30.0) -> List[StreamVariant]:
+    """Kwik variants of one episode (non-AV1, like the script), in page order."""
+    with metrics.timer("animepahe_seconds", op="variants"):
+        html = await _get_text(f"{HOST}/play/{session}/{episode_session}", timeout)
+    variants = [v for v in parse_play_page(html) if not v.av1]
+    if not variants:
+        metrics.error("animepahe.variants")
+    return variants
+
+
+async def _decode_kwik(kwik_url: str, timeout: float) -> Optional[str]:
+    with metrics.timer("animepahe_seconds", op="kwik"):
+        html = await _get_text(kwik_url, timeout, headers={"Referer": KWIK_REFERER})
+        script = _unpacker_script(html)
+        if not script:
+            log.warning("kwik page without a packed script: %s", kwik_url)
+            return None
+        out = await kwik.unpack(script)
+    m = _SOURCE.search(out)
+    return m.group(1) if m else None
+
+
+async def playlist_url(kwik_url: str, timeout: float = 30.0) -> Optional[str]:
+    """
+    m3u8 URL behind a kwik embed, or None if it couldn't be decoded.
+    Decoded URLs are kept for KWIK_LINK_TTL, and concurrent callers for the
+    same embed share one decode; failures are not remembered.
+    """
+    hit = _kwik_links.get(kwik_url)
+    if hit:
+        metrics.inc("kwik_memo_hits_total")
+        return hit
+    fut = _kwik_inflight.get(kwik_url)
+    if fut is None:
+        fut = _kwik_inflight[kwik_url] = asyncio.ensure_future(_decode_kwik(kwik_url, timeout))
+        fut.add_done_callback(lambda _: _kwik_inflight.pop(kwik_url, None))
+    # shield: one caller giving up must not cancel the decode for the others.
+    url = await asyncio.shield(fut)
+    if url:
+        _kwik_links.set(kwik_url, url, ttl=KWIK_LINK_TTL)
+    return url
+
+
+def find_episode(episodes: List[EpisodeResult], number: str) -> Optional[EpisodeResult]:
+    key = _episode_key(number)
+    return next((e for e in episodes if e.number == key), None)
+
+
+def pick_by_resolution(variants: List[StreamVariant]) -> Dict[str, StreamVariant]:
+    """One variant per resolution; the last button wins, as in the script."""
+    return {v.resolution: v for v in variants if v.resolution}
@@ -0,0 +1,144 @@
+"""Micro-benchmark: matching.TitleMatcher vs. the old per-call scorers.
+
+Replays the ranking work bot.py does per /anime request — three metadata
+sources (Jikan's 8 results with up to ~8 title variants each, AniList and
+Kitsu's 5), the AnimeKAI search (10 results, ranked twice: caption links
+and download fallback) and the AnimePahe search — with the old
+sorted(key=score)-then-rescore-the-winner pattern and with TitleMatcher.
+
+    python benchmarks/title_matching.py [rounds]
+
+The speedup depends on the machine and Python build: 3.1-3.3x over four
+runs on one core of an Intel Xeon VM with CPython 3.11.7, and 2.33x on
+another machine. Quote the number you get, with the hardware.
+"""
+from __future__ import annotations
+
+import os
+import re
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="bench-"))
+
+import matching  # noqa: E402
+
+
+# --- the scorers as they were in bot.py ---------------------------------
+
+def _legacy_normalize(s: str) -> str:
+    return re.sub(r"[^a-z0-9]+", " ", s.lower()).strip()
+
+
+def legacy_title_score(query: str, candidate: str) -> float:
+    q = _legacy_normalize(query)
+    c = _legacy_normalize(candidate)
+    if not q or not c:
+        return 0.0
+    q_tokens = set(q.split())
+    c_tokens = set(c.split())
+    if not q_tokens:
+        return 0.0
+    score = len(q_tokens & c_tokens) / len(q_tokens)
+    if q == c:
+        score += 1.0
+    elif c.startswith(q):
+        score += 0.5
+    for marker in matching.SPINOFF_MARKERS:
+        if marker in c and marker not in q:
+            score -= 0.4
+            break
+    score -= 0.05 * max(0, len(c_tokens - q_tokens) - 2)
+    return score
+
+
+def legacy_best_title_score(query: str, candidate_titles: list) -> float:
+    def _score(q: str, c: str) -> float:
+        qn = _legacy_normalize(q)
+        cn = _legacy_normalize(c)
+        if not qn or not cn:
+            return 0.0
+        qt = set(qn.split())
+        ct = set(cn.split())
+        if not qt:
+            return 0.0
+        score = len(qt & ct) / len(qt)
+        if qn == cn:
+            score += 1.0
+        elif cn.startswith(qn):
+            score += 0.5
+        score -= 0.05 * max(0, len(ct - qt) - 2)
+        return score
+
+    best = 0.0
+    for t in candidate_titles:
+        if t:
+            best = max(best, _score(query, t))
+    return best
+
+
+# --- realistic candidate lists ------------------------------------------
+
+QUERY = "My Hero Academia Season 2"
+
+JIKAN = [
+    [f"My Hero Academia {s}", f"Boku no Hero Academia {s}", f"僕のヒーローアカデミア {s}",
+     f"Boku no Hero Academia {s}", f"My Hero Academia {s}", "Hero Aca", f"BNHA {s}", f"MHA {s}"]
+    for s in ("", "Season 2", "Season 3", "Season 4", "Movie 1: Two Heroes",
+              "OVA", "Heroes Rising", "Vigilantes")
+]
+ANILIST = [[f"My Hero Academia {s}", f"Boku no Hero Academia {s}", f"僕のヒーローアカデミア {s}"]
+           for s in ("Season 2", "", "Season 3", "The Movie: World Heroes' Mission", "Vigilantes")]
+KITSU = [[f"My Hero Academia {s}", f"Boku no Hero Academia {s}", f"僕のヒーローアカデミア {s}",
+          f"Boku no Hero Academia {s}"] for s in ("2", "", "3", "4", "Memories")]
+KAI = [f"My Hero Academia {s}" for s in (
+    "Season 2", "", "Season 3", "Season 4", "Season 5", "Season 6", "Season 7",
+    "Vigilantes", "Memories", "Two Heroes Movie")]
+PAHE = [f"Boku no Hero Academia {s}" for s in (
+    "2nd Season", "", "3rd Season", "4th Season", "5th Season", "6th Season", "7th Season")]
+
+
+def legacy_request() -> None:
+    for titles in (JIKAN, ANILIST, KITSU):
+        scored = sorted(titles, key=lambda t: legacy_best_title_score(QUERY, t), reverse=True)
+        legacy_best_title_score(QUERY, scored[0])
+    for _ in range(2):  # caption links + download fallback
+        scored = sorted(KAI, key=lambda t: legacy_title_score(QUERY, t), reverse=True)
+        [(t, legacy_title_score(QUERY, t)) for t in scored[:5]]
+    sorted(PAHE, key=lambda t: legacy_title_score(QUERY, t), reverse=True)
+
+
+def matcher_request() -> None:
+    meta = matching.TitleMatcher(QUERY, spinoff_penalty=False)
+    for titles in (JIKAN, ANILIST, KITSU):
+        meta.rank(titles, lambda t: t)
+    streams = matching.TitleMatcher(QUERY)
+    for _ in range(2):
+        streams.rank(KAI, lambda t: [t])
+    streams.rank(PAHE, lambda t: [t])
+
+
+def _check() -> None:
+    m = matching.TitleMatcher(QUERY)
+    for t in KAI + PAHE:
+        assert abs(m.score(t) - legacy_title_score(QUERY, t)) < 1e-9, t
+    m = matching.TitleMatcher(QUERY, spinoff_penalty=False)
+    for titles in JIKAN + ANILIST + KITSU:
+        assert abs(max(m.best_score(titles), 0.0) - legacy_best_title_score(QUERY, titles)) < 1e-9, titles
+
+
+def main() -> None:
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    _check()
+    legacy = min(timeit.repeat(legacy_request, number=rounds, repeat=5))
+    new = min(timeit.repeat(matcher_request, number=rounds, repeat=5))
+    print(f"{rounds} simulated requests")
+    print(f"  legacy scorers : {legacy * 1e6 / rounds:8.1f} µs/request")
+    print(f"  TitleMatcher   : {new * 1e6 / rounds:8.1f} µs/request")
+    print(f"  speedup        : {legacy / new:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,14 @@
 import os
-import glob
 import asyncio
+import contextlib
 import logging
 import sys
 import stat
-import io
+import time
 import aiohttp
 import re
+import shlex
 import urllib.parse
-from PIL import Image
 from pyrogram import Client, filters
 from pyrogram.types import Message
 from dotenv import load_dotenv
@@ -16,6 +16,21 @@ from aiohttp import web
 from pyrogram import idle
 
 import animekai
+import animepahe
+import cache
+import episodespec
+import hls
+import httppool
+import images
+import jobs
+import kwik
+import matching
+import metrics
+import posters
+import progress
+import scratch
+import uploadpool
+import uploads
 
 load_dotenv()
 
@@ -42,6 +57,53 @@ MAIN_CHANNEL = get_env_int("MAIN_CHANNEL")
 DB_CHANNEL = get_env_int("DB_CHANNEL")
 STICKER_ID = "CAACAgUAAxkBAAEQJ6hpV0JDpDDOI68yH7lV879XbIWiFwACGAADQ3PJEs4sW1y9vZX3OAQ"
 
+# Metadata cache (seconds). Airing shows refresh sooner so the Status line
+# in the caption doesn't go stale; finished shows practically never change.
+INFO_CACHE_TTL_AIRING = get_env_int("INFO_CACHE_TTL_AIRING", 6 * 3600)
+INFO_CACHE_TTL_FINISHED = get_env_int("INFO_CACHE_TTL_FINISHED", 14 * 24 * 3600)
+INFO_CACHE_MAX = get_env_int("INFO_CACHE_MAX", 2000)
+
+# Metadata lookup latency. Sources are asked in parallel; a result scoring
+# METADATA_GOOD_SCORE (exact title match) ends the lookup early, and after
+# METADATA_BUDGET seconds the best result so far is used. Each source's
+# timeout adapts to its recent latency within [MIN, METADATA_SOURCE_TIMEOUT].
+METADATA_GOOD_SCORE = 2.0
+METADATA_BUDGET = float(os.getenv("METADATA_BUDGET", "8") or 8)
+METADATA_SOURCE_TIMEOUT = float(os.getenv("METADATA_SOURCE_TIMEOUT", "10") or 10)
+METADATA_SOURCE_TIMEOUT_MIN = float(os.getenv("METADATA_SOURCE_TIMEOUT_MIN", "3") or 3)
+
+# Fetch HLS segments in-process (hls.py) instead of via ffmpeg / the
+# script's curl pipeline. NATIVE_HLS=0 restores the old behaviour.
+NATIVE_HLS = os.getenv("NATIVE_HLS", "1") != "0"
+PAHE_HLS_HEADERS = {"Referer": "https://kwik.cx/"}
+KAI_HLS_HEADERS = {"Referer": "https://anikai.to/"}
+# Attempts per HLS download; a failed attempt that got somewhere resumes
+# from its checkpoint instead of starting over.
+HLS_ATTEMPTS = max(1, get_env_int("HLS_ATTEMPTS", 3))
+
+# /anime jobs run on this many workers (see jobs.py; per-stage limits are
+# configured with JOB_STAGE_LIMITS).
+JOB_WORKERS = get_env_int("JOB_WORKERS", 2)
+
+# Overlap uploads with the next download. Finished files waiting for upload
+# may use up to PIPELINE_DISK_BUDGET_MB (plus the file in flight).
+PIPELINE_UPLOADS = os.getenv("PIPELINE_UPLOADS", "1") != "0"
+PIPELINE_DISK_BUDGET_MB = get_env_int("PIPELINE_DISK_BUDGET_MB", 1024)
+# Optional pause (seconds) between a job's uploads, for flood control.
+# Downloads are never delayed by it.
+UPLOAD_DELAY = float(os.getenv("UPLOAD_DELAY", "0") or 0)
+
+# How long an AnimePahe title → series slug lookup is reused.
+PAHE_SERIES_TTL = get_env_int("PAHE_SERIES_TTL", 24 * 3600)
+
+# Optionally post a Wallhaven fanart instead of the metadata poster. The
+# search runs alongside the metadata lookup; if it hasn't answered within
+# BANNER_BUDGET seconds of the job starting, the poster is used.
+WALLHAVEN_BANNER = os.getenv("WALLHAVEN_BANNER", "0") == "1"
+BANNER_BUDGET = float(os.getenv("BANNER_BUDGET", "5") or 5)
+WALLHAVEN_CACHE_TTL = get_env_int("WALLHAVEN_CACHE_TTL", 7 * 24 * 3600)
+WALLHAVEN_MISS_TTL = get_env_int("WALLHAVEN_MISS_TTL", 6 * 3600)
+
 
 # Setup Logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s', handlers=[logging.StreamHandler(sys.stdout)])
@@ -49,6 +111,12 @@ logger = logging.getLogger(__name__)
 
 app = Client("anime_bot", api_id=API_ID, api_hash=API_HASH, bot_token=BOT_TOKEN)
 
+_info_cache = cache.TTLCache("anime-info", max_entries=INFO_CACHE_MAX)
+job_queue = jobs.JobQueue(jobs.JobStore(), workers=JOB_WORKERS)
+upload_index = uploads.UploadIndex()
+_wallhaven_cache = cache.TTLCache("wallhaven")
+_pahe_series_cache = cache.TTLCache("pahe-series")
+
 async def is_admin(message: Message):
     if not ADMIN_IDS: return True
     if message.from_user.id not in ADMIN_IDS: return False
@@ -63,62 +131,27 @@ async def _mirror_to_db(sent_message):
     """
     Copy a message we just sent to MAIN_CHANNEL into DB_CHANNEL so the DB
     channel always has a clean mirror (without the "Forwarded from" header).
-    Failures are logged but never break the main flow.
+    Returns the DB_CHANNEL copy, or None. Failures are logged but never
+    break the main flow.
     """
     if not DB_CHANNEL or not sent_message:
-        return
+        return None
     try:
         # If the channels are the same we'd just be duplicating, so skip.
         if MAIN_CHANNEL == DB_CHANNEL:
-            return
-        await app.copy_message(
+            return None
+        return await app.copy_message(
             chat_id=DB_CHANNEL,
             from_chat_id=MAIN_CHANNEL,
             message_id=sent_message.id,
         )
     except Exception as e:
         logger.warning(f"DB_CHANNEL mirror failed for msg {getattr(sent_message, 'id', '?')}: {e}")
-
-
-def _best_title_score(query: str, candidate_titles: list[str]) -> float:
-    """
-    Return the highest _title_score across all available title variants
-    for a candidate (english, romaji, japanese, synonyms).
-    Defined here so it can be used by all three info sources below.
-    """
-    import re as _re
-
-    def _norm(s: str) -> str:
-        return _re.sub(r"[^a-z0-9]+", " ", s.lower()).strip()
-
-    def _score(q: str, c: str) -> float:
-        qn = _norm(q)
-        cn = _norm(c)
-        if not qn or not cn:
-            return 0.0
-        qt = set(qn.split())
-        ct = set(cn.split())
-        if not qt:
-            return 0.0
-        overlap = len(qt & ct) / len(qt)
-        score = overlap
-        if qn == cn:
-            score += 1.0
-        elif cn.startswith(qn):
-            score += 0.5
-        extra = ct - qt
-        score -= 0.05 * max(0, len(extra) - 2)
-        return score
-
-    best = 0.0
-    for t in candidate_titles:
-        if t:
-            best = max(best, _score(query, t))
-    return best
+        return None
 
 
 async def _get_from_jikan(session: aiohttp.ClientSession, anime_name: str):
-    """Jikan (MyAnimeList) — fetches top 8, picks best title match. Returns (caption, image_url, score)."""
+    """Jikan (MyAnimeList) — fetches top 8, picks best title match. Returns (caption, image_url, score, status)."""
     try:
         url = f"https://api.jikan.moe/v4/anime?q={anime_name}&limit=8"
         async with session.get(url, timeout=aiohttp.ClientTimeout(total=10)) as resp:
@@ -126,7 +159,7 @@ async def _get_from_jikan(session: aiohttp.ClientSession, anime_name: str):
                 data = await resp.json()
                 results = data.get('data') or []
                 if not results:
-                    return None, None, 0.0
+                    return None, None, 0.0, None
 
                 def _candidate_titles(a: dict) -> list[str]:
                     titles = [
@@ -138,13 +171,10 @@ async def _get_from_jikan(session: aiohttp.ClientSession, anime_name: str):
                     titles += a.get('title_synonyms') or []
                     return [t for t in titles if t]
 
-                scored = sorted(
-                    results,
-                    key=lambda a: _best_title_score(anime_name, _candidate_titles(a)),
-                    reverse=True,
-                )
-                best = scored[0]
-                score = _best_title_score(anime_name, _candidate_titles(best))
+                matcher = matching.TitleMatcher(anime_name, spinoff_penalty=False)
+                score, best = matcher.rank(results, _candidate_titles)[0]
+                if score >= 1.0:
+                    matching.aliases.add(_candidate_titles(best))
                 logger.info(
                     "Jikan best match: '%s' (score=%.2f) for '%s'",
                     best.get('title_english') or best.get('title'), score, anime_name,
@@ -154,14 +184,14 @@ async def _get_from_jikan(session: aiohttp.ClientSession, anime_name: str):
                 status = best.get('status', 'Unknown')
                 image_url = best['images']['jpg']['large_image_url']
                 if title and image_url:
-                    return _build_caption(title, genres, status), image_url, score
+                    return _build_caption(title, genres, status), image_url, score, status
     except Exception as e:
         logger.warning(f"Jikan failed: {e}")
-    return None, None, 0.0
+    return None, None, 0.0, None
 
 
 async def _get_from_anilist(session: aiohttp.ClientSession, anime_name: str):
-    """AniList (GraphQL) — fetches top 5, picks best title match. Returns (caption, image_url, score)."""
+    """AniList (GraphQL) — fetches top 5, picks best title match. Returns (caption, image_url, score, status)."""
     try:
         query = """
         query ($search: String) {
@@ -184,20 +214,17 @@ async def _get_from_anilist(session: aiohttp.ClientSession, anime_name: str):
                 data = await resp.json()
                 results = ((data.get("data") or {}).get("Page") or {}).get("media") or []
                 if not results:
-                    return None, None, 0.0
+                    return None, None, 0.0, None
 
                 def _al_titles(m: dict) -> list[str]:
                     t = m.get("title") or {}
                     return [v for v in [t.get("english"), t.get("romaji"), t.get("native")] if v]
 
-                scored = sorted(
-                    results,
-                    key=lambda m: _best_title_score(anime_name, _al_titles(m)),
-                    reverse=True,
-                )
-                best = scored[0]
+                matcher = matching.TitleMatcher(anime_name, spinoff_penalty=False)
+                score, best = matcher.rank(results, _al_titles)[0]
                 titles = _al_titles(best)
-                score = _best_title_score(anime_name, titles)
+                if score >= 1.0:
+                    matching.aliases.add(titles)
                 logger.info(
                     "AniList best match: '%s' (score=%.2f) for '%s'",
                     titles[0] if titles else "?", score, anime_name,
@@ -208,14 +235,14 @@ async def _get_from_anilist(session: aiohttp.ClientSession, anime_name: str):
                 status = raw_status.replace("_", " ").title()
                 image_url = (best.get("coverImage") or {}).get("extraLarge")
                 if title and image_url:
-                    return _build_caption(title, genres, status), image_url, score
+                    return _build_caption(title, genres, status), image_url, score, status
     except Exception as e:
         logger.warning(f"AniList failed: {e}")
-    return None, None, 0.0
+    return None, None, 0.0, None
 
 
 async def _get_from_kitsu(session: aiohttp.ClientSession, anime_name: str):
-    """Kitsu API — fetches top 5, picks best title match. Returns (caption, image_url, score)."""
+    """Kitsu API — fetches top 5, picks best title match. Returns (caption, image_url, score, status)."""
     try:
         encoded = urllib.parse.quote(anime_name)
         url = f"https://kitsu.io/api/edge/anime?filter[text]={encoded}&page[limit]=5"
@@ -228,7 +255,7 @@ async def _get_from_kitsu(session: aiohttp.ClientSession, anime_name: str):
                 data = await resp.json()
                 items = data.get("data") or []
                 if not items:
-                    return None, None, 0.0
+                    return None, None, 0.0, None
 
                 def _kitsu_titles(item: dict) -> list[str]:
                     attrs = item.get("attributes") or {}
@@ -238,15 +265,12 @@ async def _get_from_kitsu(session: aiohttp.ClientSession, anime_name: str):
                         attrs.get("canonicalTitle"),
                     ] if v]
 
-                scored = sorted(
-                    items,
-                    key=lambda i: _best_title_score(anime_name, _kitsu_titles(i)),
-                    reverse=True,
-                )
-                best = scored[0]
+                matcher = matching.TitleMatcher(anime_name, spinoff_penalty=False)
+                score, best = matcher.rank(items, _kitsu_titles)[0]
                 attrs = best.get("attributes") or {}
                 titles = _kitsu_titles(best)
-                score = _best_title_score(anime_name, titles)
+                if score >= 1.0:
+                    matching.aliases.add(titles)
                 logger.info(
                     "Kitsu best match: '%s' (score=%.2f) for '%s'",
                     titles[0] if titles else "?", score, anime_name,
@@ -257,46 +281,14 @@ async def _get_from_kitsu(session: aiohttp.ClientSession, anime_name: str):
                 status = status_raw.replace("_", " ").title()
                 image_url = (attrs.get("posterImage") or {}).get("large")
                 if title and image_url:
-                    return _build_caption(title, "", status), image_url, score
+                    return _build_caption(title, "", status), image_url, score, status
     except Exception as e:
         logger.warning(f"Kitsu failed: {e}")
-    return None, None, 0.0
+    return None, None, 0.0, None
 
 
-_MAX_PHOTO_SIDE = 2560   # Telegram rejects photos with any side > this
-_MAX_PHOTO_SUM  = 9500   # Telegram rejects when width + height exceeds ~10000
-
-def _resize_for_telegram(raw: bytes) -> io.BytesIO:
-    """
-    Resize an image so it fits Telegram's photo dimension limits:
-      - Neither side exceeds 2560 px
-      - width + height < 9500
-    Always returns a JPEG BytesIO.
-    """
-    img = Image.open(io.BytesIO(raw)).convert("RGB")
-    w, h = img.size
-
-    # Scale down if needed
-    scale = 1.0
-    if w > _MAX_PHOTO_SIDE or h > _MAX_PHOTO_SIDE:
-        scale = min(_MAX_PHOTO_SIDE / w, _MAX_PHOTO_SIDE / h)
-    if (w * scale) + (h * scale) > _MAX_PHOTO_SUM:
-        scale = min(scale, _MAX_PHOTO_SUM / (w + h))
-
-    if scale < 1.0:
-        new_w = max(1, int(w * scale))
-        new_h = max(1, int(h * scale))
-        img = img.resize((new_w, new_h), Image.LANCZOS)
-        logger.info(f"Resized image {w}x{h} → {new_w}x{new_h} for Telegram")
-
-    buf = io.BytesIO()
-    img.save(buf, format="JPEG", quality=92)
-    buf.seek(0)
-    return buf
-
-
-async def _download_image_bytes(session: aiohttp.ClientSession, url: str) -> io.BytesIO | None:
-    """Download an image and return it resized to Telegram-safe dimensions."""
+async def _download_image_bytes(session: aiohttp.ClientSession, url: str) -> bytes | None:
+    """Download an image and return the raw bytes (resizing is the caller's job)."""
     try:
         headers = {
             "User-Agent": (
@@ -307,13 +299,72 @@ async def _download_image_bytes(session: aiohttp.ClientSession, url: str) -> io.
         }
         async with session.get(url, headers=headers, timeout=aiohttp.ClientTimeout(total=20)) as resp:
             if resp.status == 200:
-                raw = await resp.read()
-                return _resize_for_telegram(raw)
+                return await resp.read()
     except Exception as e:
-        logger.warning(f"Image download/resize failed ({url}): {e}")
+        logger.warning(f"Image download failed ({url}): {e}")
     return None
 
 
+async def _send_poster(image_url: str, caption: str):
+    """
+    Post the poster + caption to MAIN_CHANNEL, reusing a Telegram file_id
+    from posters.py whenever we've sent the same artwork before. Falls back
+    to a fresh upload if Telegram rejects a stored file_id.
+    """
+    file_id = posters.lookup_url(image_url)
+    if file_id:
+        try:
+            sent = await app.send_photo(MAIN_CHANNEL, photo=file_id, caption=caption)
+            logger.info(f"Poster reused by file_id for {image_url}")
+            return sent
+        except Exception as e:
+            logger.warning(f"Stored poster file_id rejected ({e}); re-uploading")
+            posters.forget(image_url)
+
+    raw = await _download_image_bytes(httppool.session(), image_url)
+    digest = None
+    if raw:
+        digest = posters.content_hash(raw)
+        file_id = posters.lookup_hash(digest)
+        if file_id:
+            try:
+                sent = await app.send_photo(MAIN_CHANNEL, photo=file_id, caption=caption)
+                posters.remember(image_url, digest, file_id)
+                return sent
+            except Exception as e:
+                logger.warning(f"Stored poster file_id rejected ({e}); re-uploading")
+
+    img_bytes = None
+    if raw:
+        try:
+            img_bytes = await images.resize_for_telegram(raw)
+        except Exception as e:
+            logger.warning(f"Image resize failed ({image_url}): {e}")
+    if img_bytes:
+        sent = await app.send_photo(MAIN_CHANNEL, photo=img_bytes, caption=caption)
+    else:
+        # Fallback: let Telegram try the URL directly
+        sent = await app.send_photo(MAIN_CHANNEL, photo=image_url, caption=caption)
+    if sent and sent.photo:
+        posters.remember(image_url, digest, sent.photo.file_id)
+    return sent
+
+
+
+
+# Wallhaven search tiers, highest priority first (see _get_wallhaven_image).
+_WALLHAVEN_TIERS = [
+    # 1. Best match: relevance sort, strict 16:9
+    ({"ratios": "16x9", "sorting": "relevance", "order": "desc"}, "relevance/16x9"),
+    # 2. Relevance sort, any landscape ratio
+    ({"ratios": "landscape", "sorting": "relevance", "order": "desc"}, "relevance/landscape"),
+    # 3. Relevance sort, ANY ratio — accepts portrait/square fanart too.
+    # This ensures we always get a relevant image and never fall back to
+    # the plain MAL poster (which Jikan/AniList already supplies as a fallback).
+    ({"sorting": "relevance", "order": "desc"}, "relevance/any-ratio"),
+    # 4. Last resort: favorites sort, any ratio
+    ({"sorting": "favorites", "order": "desc"}, "favorites/any-ratio"),
+]
 
 
 async def _get_wallhaven_image(session: aiohttp.ClientSession, anime_name: str) -> str | None:
@@ -326,7 +377,19 @@ async def _get_wallhaven_image(session: aiohttp.ClientSession, anime_name: str)
          instead of generic "anime girls" wallpapers that just happen to be popular)
       2. fall back to landscape ratio if no 16:9 hits
       3. fall back to sorting=favorites only as a last resort
+
+    All tiers are queried at once; the highest-priority tier that finds
+    something wins and the lower ones still in flight are cancelled. The
+    search uses _image_search_name(anime_name) and its result (hit or miss)
+    is cached per cleaned title.
     """
+    search_name = _image_search_name(anime_name)
+    cache_key = matching.normalize(search_name)
+    cached = _wallhaven_cache.get(cache_key)
+    if cached is not None:
+        logger.info(f"Wallhaven cache hit for '{search_name}'")
+        return cached or None
+
     # Skip generic-looking results (compilations, waifu collages, etc.) since
     # they often outrank the actual show on raw popularity.
     _GENERIC_TAG_BLOCKLIST = {
@@ -340,14 +403,22 @@ async def _get_wallhaven_image(session: aiohttp.ClientSession, anime_name: str)
         path = (wp.get("url") or wp.get("path") or "").lower()
         return any(t in path for t in _GENERIC_TAG_BLOCKLIST)
 
+    # Tiers that errored (vs. genuinely found nothing); a miss is only
+    # cached when every tier actually answered.
+    failed_tiers = []
+
     base_params = {
-        "q": anime_name,                 # raw title; categories already restrict to anime
+        "q": search_name,                # categories already restrict to anime
         "categories": "010",
         "purity": "100",
         "page": "1",
     }
 
     async def _try(extra: dict, label: str) -> str | None:
+        with metrics.timer("wallhaven_seconds", tier=label):
+            return await _query(extra, label)
+
+    async def _query(extra: dict, label: str) -> str | None:
         params = {**base_params, **extra}
         try:
             async with session.get(
@@ -357,6 +428,7 @@ async def _get_wallhaven_image(session: aiohttp.ClientSession, anime_name: str)
             ) as resp:
                 if resp.status != 200:
                     logger.warning(f"Wallhaven {label} returned HTTP {resp.status}")
+                    failed_tiers.append(label)
                     return None
                 data = await resp.json(content_type=None)
                 results = data.get("data") or []
@@ -369,7 +441,7 @@ async def _get_wallhaven_image(session: aiohttp.ClientSession, anime_name: str)
                         url = wp.get("path")
                         if url:
                             logger.info(
-                                f"Wallhaven [{label}] picked '{anime_name}' "
+                                f"Wallhaven [{label}] picked '{search_name}' "
                                 f"(favs={wp.get('favorites', '?')})"
                             )
                             return url
@@ -377,36 +449,45 @@ async def _get_wallhaven_image(session: aiohttp.ClientSession, anime_name: str)
                 if first:
                     logger.info(
                         f"Wallhaven [{label}] only generic-looking results for "
-                        f"'{anime_name}', using top hit anyway"
+                        f"'{search_name}', using top hit anyway"
                     )
                 return first
         except Exception as e:
             logger.warning(f"Wallhaven {label} failed: {e}")
+            metrics.error("wallhaven")
+            failed_tiers.append(label)
         return None
 
-    # 1. Best match: relevance sort, strict 16:9
-    img = await _try({"ratios": "16x9", "sorting": "relevance", "order": "desc"}, "relevance/16x9")
-    if img:
-        return img
-
-    # 2. Relevance sort, any landscape ratio
-    img = await _try({"ratios": "landscape", "sorting": "relevance", "order": "desc"}, "relevance/landscape")
-    if img:
-        return img
+    tasks = [asyncio.create_task(_try(extra, label)) for extra, label in _WALLHAVEN_TIERS]
+    img = None
+    try:
+        for task in tasks:
+            img = await task
+            if img:
+                break
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
 
-    # 3. Relevance sort, ANY ratio — accepts portrait/square fanart too.
-    # This ensures we always get a relevant image and never fall back to
-    # the plain MAL poster (which Jikan/AniList already supplies as a fallback).
-    img = await _try({"sorting": "relevance", "order": "desc"}, "relevance/any-ratio")
     if img:
+        _wallhaven_cache.set(cache_key, img, ttl=WALLHAVEN_CACHE_TTL)
         return img
+    logger.info(f"Wallhaven: no image found for '{search_name}'")
+    if not failed_tiers:
+        _wallhaven_cache.set(cache_key, "", ttl=WALLHAVEN_MISS_TTL)
+    return None
 
-    # 4. Last resort: favorites sort, any ratio
-    img = await _try({"sorting": "favorites", "order": "desc"}, "favorites/any-ratio")
-    if img:
-        return img
 
-    logger.info(f"Wallhaven: no image found for '{anime_name}'")
+async def _await_banner(task: asyncio.Task, deadline: float) -> str | None:
+    """Result of a Wallhaven banner search, or None if it misses `deadline`."""
+    timeout = max(0.0, deadline - asyncio.get_running_loop().time())
+    try:
+        return await asyncio.wait_for(task, timeout)
+    except asyncio.TimeoutError:
+        logger.info(f"Wallhaven banner missed its {BANNER_BUDGET:g}s budget; using the poster")
+    except Exception as e:
+        logger.warning(f"Wallhaven banner failed: {e}")
     return None
 
 
@@ -425,119 +506,245 @@ def _image_search_name(anime_name: str) -> str:
     return cleaned or anime_name
 
 
+# Status strings (after our title-casing) that mean the show is done.
+_FINISHED_STATUSES = {"finished airing", "finished", "cancelled"}
+
+
+def _info_cache_ttl(status: str | None) -> int:
+    """Long TTL for finished shows; airing/upcoming/unknown refresh sooner."""
+    if status and status.strip().lower() in _FINISHED_STATUSES:
+        return INFO_CACHE_TTL_FINISHED
+    return INFO_CACHE_TTL_AIRING
+
+
+class _SourceTimeouts:
+    """
+    Per-source timeout derived from an EWMA of observed latency, so one slow
+    metadata API stops holding every post up for the full hard cap. A call
+    that times out counts as taking the whole timeout, which pushes the
+    next timeout back up if the source really has become slower.
+    """
+
+    def __init__(self, alpha: float = 0.3):
+        self.alpha = alpha
+        self.ewma: dict[str, float] = {}
+
+    def timeout(self, source: str) -> float:
+        avg = self.ewma.get(source)
+        if avg is None:
+            return METADATA_SOURCE_TIMEOUT
+        return min(METADATA_SOURCE_TIMEOUT, max(METADATA_SOURCE_TIMEOUT_MIN, 3 * avg))
+
+    def record(self, source: str, seconds: float):
+        prev = self.ewma.get(source)
+        self.ewma[source] = seconds if prev is None else prev + self.alpha * (seconds - prev)
+
+
+_source_timeouts = _SourceTimeouts()
+
+
+async def _timed_source(source: str, coro):
+    """
+    Run one metadata source under its adaptive timeout. Records latency, and
+    a stage error if it found nothing.
+    """
+    timeout = _source_timeouts.timeout(source)
+    start = time.perf_counter()
+    try:
+        with metrics.timer("metadata_seconds", source=source):
+            result = await asyncio.wait_for(coro, timeout)
+    except asyncio.TimeoutError:
+        _source_timeouts.record(source, timeout)
+        logger.warning(f"{source} timed out after {timeout:.1f}s")
+        raise
+    _source_timeouts.record(source, time.perf_counter() - start)
+    if not result[0]:
+        metrics.error(f"metadata.{source}")
+    return result
+
+
 async def get_anime_info(anime_name: str):
     """
     Query Jikan (MAL), AniList, and Kitsu in parallel.
     Pick whichever source returns the highest title-match score.
     If scores are tied, prefer Jikan → AniList → Kitsu in that order.
+
+    Results are taken as they arrive: once one scores METADATA_GOOD_SCORE
+    (an exact title match, which nothing can beat) the other requests are
+    cancelled, and after METADATA_BUDGET seconds the best result so far is
+    used. Results are cached per normalized title (see _info_cache).
     Returns (caption, image_url).
     """
-    async with aiohttp.ClientSession() as session:
-        results = await asyncio.gather(
-            _get_from_jikan(session, anime_name),
-            _get_from_anilist(session, anime_name),
-            _get_from_kitsu(session, anime_name),
-            return_exceptions=True,
+    cache_key = matching.normalize(anime_name)
+    cached = _info_cache.get(cache_key)
+    if cached:
+        logger.info(
+            "Info cache hit for '%s' (source=%s, score=%.2f)",
+            anime_name, cached.get("source"), cached.get("score", 0.0),
         )
+        return cached["caption"], cached["image_url"]
 
+    session = httppool.session()
     source_names = ["Jikan", "AniList", "Kitsu"]
+    tasks = {
+        asyncio.create_task(_timed_source("jikan", _get_from_jikan(session, anime_name))): "Jikan",
+        asyncio.create_task(_timed_source("anilist", _get_from_anilist(session, anime_name))): "AniList",
+        asyncio.create_task(_timed_source("kitsu", _get_from_kitsu(session, anime_name))): "Kitsu",
+    }
+    results = {}
+    pending = set(tasks)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + METADATA_BUDGET
+
     best_caption = None
     best_image = None
     best_score = -1.0
     best_source = None
+    best_status = None
 
-    for name, result in zip(source_names, results):
-        if isinstance(result, Exception):
-            logger.warning(f"{name} raised exception: {result}")
-            continue
-        caption, image_url, score = result
-        if caption and image_url and score > best_score:
-            best_caption = caption
-            best_image = image_url
-            best_score = score
-            best_source = name
+    try:
+        while pending:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            done, pending = await asyncio.wait(
+                pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED,
+            )
+            for task in done:
+                name = tasks[task]
+                if task.exception() is not None:
+                    logger.warning(f"{name} raised exception: {task.exception()!r}")
+                    continue
+                results[name] = task.result()
+
+            best_score = -1.0
+            for name in source_names:
+                if name not in results:
+                    continue
+                caption, image_url, score, status = results[name]
+                if caption and image_url and score > best_score:
+                    best_caption = caption
+                    best_image = image_url
+                    best_score = score
+                    best_source = name
+                    best_status = status
+            if best_score >= METADATA_GOOD_SCORE:
+                break
+    finally:
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
 
     if not best_caption:
         logger.error(f"All info sources failed for '{anime_name}'")
         return None, None
 
+    skipped = [tasks[t] for t in pending]
     logger.info(
-        "Selected '%s' as best source (score=%.2f) for '%s'",
+        "Selected '%s' as best source (score=%.2f) for '%s'%s",
         best_source, best_score, anime_name,
+        f" — didn't wait for {', '.join(skipped)}" if skipped else "",
     )
+    ttl = _info_cache_ttl(best_status)
+    if skipped and best_score < METADATA_GOOD_SCORE:
+        # Best-so-far after the budget ran out; a slower source might have
+        # matched better, so don't pin this answer for weeks.
+        ttl = min(ttl, INFO_CACHE_TTL_AIRING)
+    if cache_key:
+        _info_cache.set(
+            cache_key,
+            {
+                "caption": best_caption,
+                "image_url": best_image,
+                "score": best_score,
+                "source": best_source,
+                "status": best_status,
+            },
+            ttl=ttl,
+        )
     return best_caption, best_image
 
 
+async def _hls_download(
+    url: str, out_file: str, headers: dict, limiter: hls.Limiter | None = None,
+    timeout: float | None = None, tracker: progress.Tracker | None = None,
+) -> str:
+    """hls.download, retried up to HLS_ATTEMPTS times while there's a partial file to resume."""
+    for attempt in range(1, HLS_ATTEMPTS + 1):
+        try:
+            return await asyncio.wait_for(
+                hls.download(
+                    url, out_file, headers=headers, limiter=limiter,
+                    progress=tracker.hls if tracker else None,
+                ),
+                timeout=timeout,
+            )
+        except (hls.HLSError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if attempt == HLS_ATTEMPTS or not hls.resumable(out_file):
+                raise
+            logger.warning(
+                "HLS download of %s failed (%s); resuming, attempt %d/%d",
+                os.path.basename(out_file), e or type(e).__name__, attempt + 1, HLS_ATTEMPTS,
+            )
+
+
+async def _pahe_search(anime_name: str) -> animepahe.AnimeResult | None:
+    """Best-matching AnimePahe search result for `anime_name`, or None."""
+    results = await animepahe.search(anime_name)
+    if not results:
+        logger.info("AnimePahe: no search results for '%s'", anime_name)
+        return None
+
+    # Pick the best match by title similarity
+    matcher = matching.TitleMatcher(anime_name, aliases=matching.aliases)
+    _, best = matcher.rank(results, lambda x: [x.title])[0]
+    logger.info("AnimePahe: matched '%s' (slug=%s) for '%s'", best.title, best.session, anime_name)
+    return best
+
+
+async def _pahe_series(anime_name: str) -> str | None:
+    """
+    AnimePahe slug for `anime_name`, cached per normalized title, so every
+    run of a job (each episode / resolution) skips the series search.
+    """
+    key = matching.normalize(anime_name)
+    slug = _pahe_series_cache.get(key)
+    if slug:
+        return slug
+    try:
+        best = await _pahe_search(anime_name)
+    except Exception as exc:
+        logger.warning("AnimePahe series lookup failed: %s", exc)
+        return None
+    if not best:
+        return None
+    _pahe_series_cache.set(key, best.session, ttl=PAHE_SERIES_TTL)
+    return best.session
+
+
 async def _get_pahe_first_ep(anime_name: str) -> int | None:
     """
-    Query the AnimePahe search API and return the first (lowest) episode number
-    for the best-matching anime.
+    Return the first (lowest) AnimePahe episode number of the best-matching
+    anime.
 
     AnimePahe numbers episodes *globally* across seasons: MHA Season 2 starts
     at episode 14 because Season 1 had 13 episodes.  Calling this before
-    animepahe-dl.sh lets us compute the correct episode number to request.
+    downloading lets us compute the correct episode number to request.
 
     Returns the first episode number (int) or None if the lookup fails.
     """
-    PAHE_HOST = "https://animepahe.pw"
-    UA = (
-        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-        "AppleWebKit/537.36 (KHTML, like Gecko) "
-        "Chrome/120.0.0.0 Safari/537.36"
-    )
-    headers = {"User-Agent": UA, "cookie": "__ddg2_=replitbot"}
-
     try:
-        async with aiohttp.ClientSession(headers=headers) as s:
-            # 1. Search for the anime
-            q = anime_name.replace(" ", "%20")
-            async with s.get(
-                f"{PAHE_HOST}/api?m=search&q={q}", timeout=aiohttp.ClientTimeout(total=15)
-            ) as r:
-                if r.status != 200:
-                    logger.warning("AnimePahe search HTTP %s for '%s'", r.status, anime_name)
-                    return None
-                data = await r.json(content_type=None)
-
-            results = data.get("data") or []
-            if not results:
-                logger.info("AnimePahe: no search results for '%s'", anime_name)
-                return None
-
-            # Pick the best match by title similarity
-            scored = sorted(
-                results,
-                key=lambda x: _title_score(anime_name, x.get("title", "")),
-                reverse=True,
-            )
-            best = scored[0]
-            slug = best.get("session") or best.get("slug")
-            if not slug:
-                return None
-            logger.info(
-                "AnimePahe: matched '%s' (slug=%s) for '%s'",
-                best.get("title"), slug, anime_name,
-            )
-
-            # 2. Get the first page of episodes (sorted ascending)
-            async with s.get(
-                f"{PAHE_HOST}/api?m=release&id={slug}&sort=episode_asc&page=1",
-                timeout=aiohttp.ClientTimeout(total=15),
-            ) as r2:
-                if r2.status != 200:
-                    return None
-                ep_data = await r2.json(content_type=None)
+        slug = await _pahe_series(anime_name)
+        if not slug:
+            return None
+        episodes = await animepahe.list_episodes(slug)
+        if not episodes:
+            return None
 
-            episodes = ep_data.get("data") or []
-            if not episodes:
-                return None
-
-            # The very first entry has the lowest episode number
-            first_ep_num = int(float(episodes[0].get("episode", 1)))
-            logger.info(
-                "AnimePahe: '%s' first episode on Pahe is %d", best.get("title"), first_ep_num
-            )
-            return first_ep_num
+        # Episodes come back sorted, the first has the lowest number
+        first_ep_num = int(float(episodes[0].number))
+        logger.info("AnimePahe: '%s' first episode on Pahe is %d", anime_name, first_ep_num)
+        return first_ep_num
 
     except Exception as exc:
         logger.warning("AnimePahe episode-offset lookup failed: %s", exc)
@@ -545,45 +752,49 @@ async def _get_pahe_first_ep(anime_name: str) -> int | None:
 
 
 async def _download_via_animekai(
-    anime_name: str, episode: str, resolution: str
+    anime_name: str, episode: str, resolution: str,
+    kai: animekai.ResolveContext | None = None, out_dir: str = ".",
+    tracker: progress.Tracker | None = None,
 ) -> str | None:
     """
     Fallback downloader that uses AnimeKAI stream links + ffmpeg when
-    animepahe-dl.sh cannot retrieve a file.
+    AnimePahe cannot provide a file.
 
     Flow:
       1. Search AnimeKAI with the same title-scoring logic used for stream links
       2. Find the episode in the matched series
       3. Pick the sub stream variant closest to the requested resolution
          (falls back to best-available quality)
-      4. Run ffmpeg to download the m3u8 playlist into an mp4 file
-      5. Return the local file path, or None on any failure
+      4. Download the m3u8 playlist into an mp4 file (hls.py, or ffmpeg
+         when NATIVE_HLS is off)
+      5. Return the local file path (in `out_dir`), or None on any failure
+
+    Pass the job's `kai` context so search / episodes / variants already
+    resolved for the caption links are reused instead of fetched again.
     """
+    kai = kai or animekai.ResolveContext()
     try:
-        results = await animekai.search(anime_name, limit=10, timeout=30.0)
+        results = await kai.search(anime_name, limit=10, timeout=30.0)
         if not results:
             logger.info("AnimeKAI fallback: no results for '%s'", anime_name)
             return None
 
-        scored = sorted(
-            results,
-            key=lambda r: _title_score(anime_name, r.title),
-            reverse=True,
-        )
+        matcher = matching.TitleMatcher(anime_name, aliases=matching.aliases)
+        ranked = matcher.rank(results, lambda r: [r.title])
 
         # Only use the single best-matching candidate — never fall through to a
         # different anime just because it happens to have the right episode count.
-        best_candidate = scored[0]
+        _, best_candidate = ranked[0]
         chosen = None
         ep = None
         try:
-            episodes = await animekai.list_episodes(best_candidate.path, timeout=45.0)
+            episodes = await kai.episode_index(best_candidate.path, episode, timeout=45.0)
         except Exception as e:
             logger.warning("AnimeKAI fallback: list_episodes failed for '%s': %s", best_candidate.title, e)
-            episodes = []
+            episodes = None
 
         if episodes:
-            match = next((e for e in episodes if str(e.number) == str(episode)), None)
+            match = episodes.get(episode)
             if match:
                 chosen = best_candidate
                 ep = match
@@ -601,7 +812,7 @@ async def _download_via_animekai(
         variants: list = []
         for stype in ("sub", "dub", "softsub"):
             try:
-                variants = await animekai.list_variants(chosen.path, ep.token, stype, timeout=180.0)
+                variants = await kai.list_variants(chosen.path, ep.token, stype, timeout=180.0)
             except Exception:
                 pass
             if variants:
@@ -635,7 +846,23 @@ async def _download_via_animekai(
             )
 
         safe_name = anime_name.replace(" ", "_").replace(":", "").replace("/", "")
-        out_file = f"Ep_{episode}_{safe_name}_{resolution}p_kai.mp4"
+        out_file = os.path.join(out_dir, f"Ep_{episode}_{safe_name}_{resolution}p_kai.mp4")
+
+        if NATIVE_HLS:
+            logger.info(
+                "AnimeKAI fallback: HLS → %s (%s)", out_file, chosen_variant.quality
+            )
+            try:
+                path = await _hls_download(
+                    chosen_variant.playlist_url, out_file, KAI_HLS_HEADERS, timeout=600.0,
+                    tracker=tracker,
+                )
+            except Exception as e:
+                logger.warning("AnimeKAI fallback: HLS download failed: %s", e)
+                return None
+            size_mb = os.path.getsize(path) / 1_048_576
+            logger.info("AnimeKAI fallback: downloaded %.1f MB → %s", size_mb, path)
+            return path
 
         # ffmpeg download: -c copy keeps the original stream (fast, no re-encode)
         ffmpeg_cmd = [
@@ -644,6 +871,7 @@ async def _download_via_animekai(
             "-i", chosen_variant.playlist_url,
             "-c", "copy",
             "-bsf:a", "aac_adtstoasc",
+            "-progress", "pipe:1", "-nostats",
             out_file,
         ]
         logger.info(
@@ -655,7 +883,12 @@ async def _download_via_animekai(
             stderr=asyncio.subprocess.PIPE,
         )
         try:
-            _, stderr_bytes = await asyncio.wait_for(proc.communicate(), timeout=600.0)
+            with metrics.timer("ffmpeg_seconds", op="hls_download"):
+                _, stderr_bytes = await asyncio.wait_for(asyncio.gather(
+                    progress.follow_ffmpeg(proc.stdout, tracker),
+                    proc.stderr.read(),
+                ), timeout=600.0)
+                await proc.wait()
         except asyncio.TimeoutError:
             proc.kill()
             logger.warning("AnimeKAI fallback: ffmpeg timed out")
@@ -677,54 +910,121 @@ async def _download_via_animekai(
         return None
 
 
-def _normalize_title(s: str) -> str:
-    """Lowercase + strip non-alphanumerics for fuzzy title comparison."""
-    return re.sub(r"[^a-z0-9]+", " ", s.lower()).strip()
+def _res_order(res: str) -> int:
+    """Sort key for resolution labels: leading digits ("720p" → 720), else 0."""
+    m = re.match(r"\d+", res)
+    return int(m.group()) if m else 0
 
 
-def _title_score(query: str, candidate: str) -> float:
+async def _pahe_links(
+    anime_name: str, episode: str, slug: str | None = None,
+    resolutions: list[str] | None = None,
+) -> dict[str, str] | None:
     """
-    Score how well `candidate` matches `query`. Higher = better.
-    Penalizes spin-off / arc / movie / OVA matches so we prefer the main series.
+    Resolve an episode's AnimePahe streams in-process (animepahe.py):
+    {resolution: m3u8 url, or "skip" when the file is over the size limit},
+    for `resolutions` (default: every resolution on the play page). A
+    resolution AnimePahe doesn't have is left out. None if the lookup failed.
     """
-    q = _normalize_title(query)
-    c = _normalize_title(candidate)
-    if not q or not c:
-        return 0.0
-
-    q_tokens = set(q.split())
-    c_tokens = set(c.split())
-    if not q_tokens:
-        return 0.0
-
-    overlap = len(q_tokens & c_tokens) / len(q_tokens)
-    score = overlap
-
-    # Big bonus for exact match
-    if q == c:
-        score += 1.0
-    # Bonus when candidate starts with the query (e.g. "demon slayer" → "demon slayer kimetsu...")
-    elif c.startswith(q):
-        score += 0.5
-
-    # Penalize obvious spin-offs / side content the user almost certainly didn't ask for
-    spinoff_markers = (
-        "arc", "movie", "ova", "ona", "special", "specials",
-        "recap", "side story", "the movie",
-    )
-    extra_tokens = c_tokens - q_tokens
-    for marker in spinoff_markers:
-        if marker in c and marker not in q:
-            score -= 0.4
-            break
+    try:
+        slug = slug or await _pahe_series(anime_name)
+        if not slug:
+            return None
+        ep = animepahe.find_episode(await animepahe.list_episodes(slug, want=episode), episode)
+        if not ep:
+            logger.info("AnimePahe: episode %s not found for '%s'", episode, anime_name)
+            return {}
+        by_res = animepahe.pick_by_resolution(await animepahe.list_variants(slug, ep.session))
+        wanted = [r for r in (resolutions or by_res) if r in by_res]
+        skipped = [r for r in wanted if by_res[r].over_size_limit]
+        for res in skipped:
+            logger.info("AnimePahe ep %s: %sp is %.0f MB, over the size limit", episode, res, by_res[res].size_mb)
+        fetch = [r for r in wanted if r not in skipped]
+        urls = await asyncio.gather(*(animepahe.playlist_url(by_res[r].kwik_url) for r in fetch))
+    except Exception as exc:
+        logger.warning("AnimePahe link lookup failed for '%s' ep %s: %s", anime_name, episode, exc)
+        return None
+    links = {res: "skip" for res in skipped}
+    links.update({res: url for res, url in zip(fetch, urls) if url})
+    logger.info(f"AnimePahe ep {episode}: resolutions {sorted(links, key=_res_order)}")
+    return links
+
 
-    # Slight penalty proportional to how much extra fluff the candidate has
-    score -= 0.05 * max(0, len(extra_tokens) - 2)
+async def _download_via_animepahe(
+    anime_name: str, episode: str, resolution: str, slug: str | None = None,
+    link: str | None = None, limiter: hls.Limiter | None = None, out_dir: str = ".",
+    tracker: progress.Tracker | None = None,
+) -> tuple[int, str | None]:
+    """
+    Download one episode/resolution from AnimePahe.
 
-    return score
+    With NATIVE_HLS (default) the m3u8 link is resolved by _pahe_links
+    (animepahe.py) and the segments are fetched in-process by hls.py.
+    Otherwise animepahe-dl.sh downloads the file itself to the path we give
+    it (-O). Either way the file lands in `out_dir`.
 
+    `slug` (from _pahe_series) skips the series search.
+    `link` is an m3u8 already listed by _pahe_links ("skip" = over the
+    size limit, "" = no such resolution); it isn't resolved again then.
 
-async def get_stream_links(anime_name: str, episode_number: str) -> str:
+    Returns (returncode, local_file_or_None), with the script's meaning:
+    0 = ok / nothing to download, 2 = skipped for being over the size limit,
+    anything else = failed.
+    """
+    safe_name = anime_name.replace(" ", "_").replace(":", "").replace("/", "")
+
+    if link is None and NATIVE_HLS:
+        links = await _pahe_links(anime_name, episode, slug, [resolution])
+        if links is None:
+            return 1, None
+        link = links.get(resolution, "")
+
+    if link is not None:
+        if link == "skip":
+            return 2, None
+        if not link:
+            return 0, None
+        out_file = os.path.join(out_dir, f"Ep_{episode}_{safe_name}_{resolution}p.mp4")
+        try:
+            path = await _hls_download(link, out_file, PAHE_HLS_HEADERS, limiter=limiter, tracker=tracker)
+        except Exception as e:
+            logger.warning("AnimePahe HLS download failed for %sp: %s", resolution, e)
+            return 1, None
+        return 0, path
+
+    out_path = os.path.join(out_dir, f"Ep_{episode}_{safe_name}_{resolution}p.mp4")
+    series = f"-a '{anime_name}'" + (f" -s '{slug}'" if slug else "")
+    cmd = f"./animepahe-dl.sh -d -t 1 {series} -e {episode} -r {resolution} -O '{out_path}'"
+    logger.info(f"Executing: {cmd}")
+
+    # ANIMEPAHE_DL_PROGRESS: ffmpeg progress (and the script's log lines) on stderr
+    process = await asyncio.create_subprocess_shell(
+        cmd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        env={**os.environ, "ANIMEPAHE_DL_PROGRESS": "1"},
+    )
+    stdout, _ = await asyncio.gather(
+        process.stdout.read(),
+        progress.follow_ffmpeg(process.stderr, tracker),
+    )
+    await process.wait()
+    if process.returncode != 0:
+        return process.returncode, None
+
+    # The script prints the path it wrote; exit 0 without one means
+    # AnimePahe had no file at this resolution.
+    reported = stdout.decode(errors="replace").strip().splitlines()
+    if not reported or not os.path.exists(out_path):
+        return 0, None
+    if os.path.abspath(reported[-1]) != os.path.abspath(out_path):
+        logger.warning("animepahe-dl.sh reported %s, expected %s", reported[-1], out_path)
+    return 0, out_path
+
+
+async def get_stream_links(
+    anime_name: str, episode_number: str, kai: animekai.ResolveContext | None = None,
+) -> str:
     """
     Searches AnimeKAI for the anime and episode, then returns a formatted
     string of stream links (Sub and Dub if available) to append to the caption.
@@ -735,46 +1035,44 @@ async def get_stream_links(anime_name: str, episode_number: str) -> str:
       2. Whether the episode list actually contains the requested episode
     Walks through multiple candidates if the top one doesn't have the episode,
     so we never return "random" links from the wrong series.
+
+    Lookups go through `kai` (a per-job animekai.ResolveContext) so the
+    download fallback can reuse them.
     """
+    kai = kai or animekai.ResolveContext()
     try:
-        results = await animekai.search(anime_name, limit=10, timeout=30.0)
+        results = await kai.search(anime_name, limit=10, timeout=30.0)
         if not results:
             logger.info(f"AnimeKAI: no results for '{anime_name}'")
             return ""
 
         # Rank candidates by title similarity
-        scored = sorted(
-            results,
-            key=lambda r: _title_score(anime_name, r.title),
-            reverse=True,
-        )
+        matcher = matching.TitleMatcher(anime_name, aliases=matching.aliases)
+        ranked = matcher.rank(results, lambda r: [r.title])
         logger.info(
             "AnimeKAI ranked candidates for '%s': %s",
             anime_name,
-            [(r.title, round(_title_score(anime_name, r.title), 2)) for r in scored[:5]],
+            [(r.title, round(score, 2)) for score, r in ranked[:5]],
         )
 
         # Only use the single best-matching candidate.
         # If that anime does not have the episode yet, we stop — we never
         # fall through to a different (wrong) anime just because it happens
         # to have enough episodes.
-        best_candidate = scored[0]
+        _, best_candidate = ranked[0]
         chosen = None
         ep = None
         try:
-            episodes = await animekai.list_episodes(best_candidate.path, timeout=45.0)
+            episodes = await kai.episode_index(best_candidate.path, episode_number, timeout=45.0)
         except Exception as e:
             logger.warning(
                 "AnimeKAI: list_episodes failed for '%s' (%s): %s",
                 best_candidate.title, best_candidate.path, e,
             )
-            episodes = []
+            episodes = None
 
         if episodes:
-            match = next(
-                (e for e in episodes if str(e.number) == str(episode_number)),
-                None,
-            )
+            match = episodes.get(episode_number)
             if match:
                 chosen = best_candidate
                 ep = match
@@ -797,14 +1095,14 @@ async def get_stream_links(anime_name: str, episode_number: str) -> str:
             )
             return ""
 
-        stream_types = await animekai.list_stream_types(chosen.path, ep.token, timeout=30.0)
+        stream_types = await kai.list_stream_types(chosen.path, ep.token, timeout=30.0)
         if not stream_types:
             logger.info("AnimeKAI: no stream types available")
             return ""
 
         sections = []
         for stype in stream_types:
-            variants = await animekai.list_variants(
+            variants = await kai.list_variants(
                 chosen.path, ep.token, stype, timeout=180.0
             )
             if not variants:
@@ -849,10 +1147,31 @@ async def get_stream_links(anime_name: str, episode_number: str) -> str:
         return ""
 
 
+def _collect_gauges():
+    """Snapshot point-in-time state into gauges right before a /metrics scrape."""
+    for key, value in httppool.stats().items():
+        metrics.set_gauge("http_pool", value, stat=key)
+    counts = job_queue.store.counts()
+    for state in (jobs.QUEUED, jobs.RUNNING, jobs.DONE, jobs.FAILED):
+        metrics.set_gauge("jobs", counts.get(state, 0), state=state)
+    for name, h in animekai.health.snapshot().items():
+        metrics.set_gauge("animekai_server_success_rate", h["success_rate"], server=name)
+        metrics.set_gauge("animekai_server_latency_seconds", h["latency"], server=name)
+    for source in ("jikan", "anilist", "kitsu"):
+        metrics.set_gauge("metadata_timeout_seconds", _source_timeouts.timeout(source), source=source)
+    progress.collect_gauges()
+
+
 async def web_server():
     async def handle(request): return web.Response(text="Bot is running!")
+    async def handle_http_stats(request): return web.json_response(httppool.stats())
+    async def handle_metrics(request):
+        _collect_gauges()
+        return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8")
     server = web.Application()
     server.router.add_get("/", handle)
+    server.router.add_get("/stats/http", handle_http_stats)
+    server.router.add_get("/metrics", handle_metrics)
     runner = web.AppRunner(server)
     await runner.setup()
     site = web.TCPSite(runner, "0.0.0.0", PORT)
@@ -894,6 +1213,37 @@ async def start(client, message):
 
 
 
+class _JobChat:
+    """
+    Status-message and reply helpers for a running job. Messages are
+    addressed by chat/message id so they keep working for jobs that were
+    requeued after a restart.
+    """
+
+    def __init__(self, job: jobs.Job):
+        self.job = job
+        # Download progress, edited into the status message (throttled)
+        self.progress = progress.Reporter(self.status, title=f"Job #{job.id}")
+
+    async def status(self, text: str):
+        if not self.job.chat_id or not self.job.status_message_id:
+            return
+        try:
+            await app.edit_message_text(self.job.chat_id, self.job.status_message_id, text)
+        except Exception as e:
+            logger.warning(f"Job #{self.job.id}: status edit failed: {e}")
+
+    async def reply(self, text: str):
+        if not self.job.chat_id:
+            return
+        try:
+            await app.send_message(
+                self.job.chat_id, text, reply_to_message_id=self.job.reply_to_message_id
+            )
+        except Exception as e:
+            logger.warning(f"Job #{self.job.id}: reply failed: {e}")
+
+
 @app.on_message(filters.command("anime"))
 async def anime_download(client, message: Message):
     if not await is_admin(message): return
@@ -913,32 +1263,82 @@ async def anime_download(client, message: Message):
     episode = rest[0].strip()
     resolution_arg = rest[1].strip()
 
+    if episodespec.parse(episode) == []:
+        await message.reply_text(
+            "⚠️ Episode must look like 5, 1-12, 1,3,5-7 or * "
+            f"(at most {episodespec.MAX_EPISODES} episodes)."
+        )
+        return
+
+    status_msg = await message.reply_text(f"🕒 Queued **{anime_name}** Ep **{episode}**...")
+    job = job_queue.submit(
+        "anime",
+        {"anime_name": anime_name, "episode": episode, "resolution": resolution_arg},
+        chat_id=message.chat.id,
+        status_message_id=status_msg.id,
+        reply_to_message_id=message.id,
+    )
+    logger.info(f"Queued job #{job.id}: {anime_name} ep {episode} res {resolution_arg}")
+
+
+async def _run_anime_job(job: jobs.Job):
+    """
+    Worker side of /anime: post info, then download + upload each
+    resolution, for one episode or a batch ("1-12", "1,3,5-7", "*").
+
+    A batch fetches metadata and the AnimePahe series once, resolves
+    episode N+1's stream links while episode N downloads, and posts
+    everything (poster + links, then files) in episode order.
+
+    Each post and upload is recorded on the job when it's done, so a job
+    requeued after a restart doesn't post it to MAIN_CHANNEL again.
+    """
+    anime_name = job.params["anime_name"]
+    episode_spec = job.params["episode"]
+    resolution_arg = job.params["resolution"]
+    chat = _JobChat(job)
+    kai = animekai.ResolveContext()
+
     resolutions = ["360", "720", "1080"] if resolution_arg.lower() == "all" else [resolution_arg]
-    status_msg = await message.reply_text(f"🔍 Processing **{anime_name}**...")
+    await chat.status(f"🔍 Processing **{anime_name}**... (job #{job.id})")
 
-    caption, image_url = await get_anime_info(anime_name)
-    if caption and image_url:
-        # Fetch stream links from AnimeKAI and append to caption
-        await status_msg.edit_text(f"🔗 Fetching stream links for Ep **{episode}**...")
-        stream_links = await get_stream_links(anime_name, episode)
-        if stream_links:
-            caption = f"{caption}\n\n{stream_links}"
+    banner = None
+    if WALLHAVEN_BANNER:
+        banner_deadline = asyncio.get_running_loop().time() + BANNER_BUDGET
+        banner = asyncio.create_task(_get_wallhaven_image(httppool.session(), anime_name))
 
-        try:
-            async with aiohttp.ClientSession() as dl_session:
-                img_bytes = await _download_image_bytes(dl_session, image_url)
-            if img_bytes:
-                sent = await app.send_photo(MAIN_CHANNEL, photo=img_bytes, caption=caption)
-            else:
-                # Fallback: let Telegram try the URL directly
-                sent = await app.send_photo(MAIN_CHANNEL, photo=image_url, caption=caption)
-            await _mirror_to_db(sent)
-            await status_msg.edit_text(f"✅ Info Found. Starting Downloads for Ep **{episode}**...")
-        except Exception as e:
-            logger.error(f"Post failed: {e}")
-            await status_msg.edit_text(f"⚠️ Info found but post failed: {e}")
+    job_queue.set_stage(job, "metadata")
+    try:
+        async with jobs.stage("metadata"):
+            caption, image_url = await get_anime_info(anime_name)
+    except BaseException:
+        if banner:
+            banner.cancel()
+        raise
+    if banner and not (caption and image_url):
+        banner.cancel()
+    if caption and image_url:
+        if banner:
+            image_url = await _await_banner(banner, banner_deadline) or image_url
     else:
-        await status_msg.edit_text(f"⚠️ Info not found, starting downloads...")
+        await chat.status("⚠️ Info not found, starting downloads...")
+
+    job_queue.set_stage(job, "resolve")
+    async with jobs.stage("resolve"):
+        episodes = await _expand_episodes(anime_name, episode_spec, kai)
+        pahe_slug = await _pahe_series(anime_name)
+    if not episodes:
+        await chat.status(f"❌ No episodes found for **{anime_name}** ({episode_spec}).")
+        raise jobs.JobFailed(f"no episodes match {episode_spec!r}")
+    if len(episodes) > episodespec.MAX_EPISODES:
+        # "*" on a long-running series.
+        await chat.status(
+            f"❌ **{anime_name}** has {len(episodes)} episodes; one job takes at most "
+            f"{episodespec.MAX_EPISODES}. Use a range like 1-{episodespec.MAX_EPISODES}."
+        )
+        raise jobs.JobFailed(f"{len(episodes)} episodes is over the limit of {episodespec.MAX_EPISODES}")
+    if len(episodes) > 1:
+        logger.info(f"Job #{job.id}: batch of {len(episodes)} episodes ({episodes[0]}-{episodes[-1]})")
 
     # Fix script permissions
     script_path = "./animepahe-dl.sh"
@@ -947,110 +1347,608 @@ async def anime_download(client, message: Message):
     success_count = 0
     skipped_count = 0
 
-    for res in resolutions:
-        cmd = f"./animepahe-dl.sh -d -t 1 -a '{anime_name}' -e {episode} -r {res}"
-        logger.info(f"Executing: {cmd}")
-        
-        process = await asyncio.create_subprocess_shell(
-            cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.STDOUT 
-        )
+    # Downloads and uploads run as a two-stage pipeline: while one
+    # resolution uploads, the next one is already downloading. Posters and
+    # finished files wait in `ready` (in order) and _disk_budget caps how
+    # many bytes of files may sit on disk across all jobs.
+    ready: asyncio.Queue = asyncio.Queue()
+    space = scratch.Scratch(job.id)
+    keep_space = False
 
-        while True:
-            line = await process.stdout.readline()
-            if not line: break
-            pass 
-
-        await process.wait()
-        
-        # --- HANDLE EXIT CODES ---
-        if process.returncode == 2:
-            await message.reply_text(f"⚠️ Skipped {res}p: File too large (>350MB).")
-            skipped_count += 1
-            continue
+    async def _check_space():
+        try:
+            space.check_space()
+        except scratch.ScratchFull as e:
+            await chat.status(f"❌ Not enough disk space to download **{anime_name}**: {e}")
+            raise jobs.JobFailed(str(e)) from e
 
-        # AnimePahe failed — try AnimeKAI as a fallback source
-        if process.returncode != 0:
-            await status_msg.edit_text(
-                f"⚠️ AnimePahe failed for {res}p — trying AnimeKAI fallback..."
-            )
-            kai_file = await _download_via_animekai(anime_name, episode, res)
-            if not kai_file:
-                await message.reply_text(
-                    f"❌ Both sources failed for **{res}p** (AnimePahe + AnimeKAI)."
-                )
+    def _start_links(ep: str) -> asyncio.Task | None:
+        if not (caption and image_url) or job.is_done(f"post {ep}"):
+            return None
+
+        async def _links():
+            async with jobs.stage("resolve"):
+                return await get_stream_links(anime_name, ep, kai)
+
+        return asyncio.create_task(_links())
+
+    link_tasks: list[asyncio.Task | None] = []
+    staged: dict[str, asyncio.Task] = {}
+
+    async def _produce():
+        nonlocal success_count
+        links = _start_links(episodes[0])
+        link_tasks.append(links)
+        for i, episode in enumerate(episodes):
+            # Resolve the next episode's stream links while this one downloads.
+            next_links = _start_links(episodes[i + 1]) if i + 1 < len(episodes) else None
+            link_tasks.append(next_links)
+            if links:
+                await chat.status(f"🔗 Fetching stream links for Ep **{episode}**...")
+                job_queue.set_stage(job, f"resolve ep {episode}")
+                stream_links = await links
+                post = f"{caption}\n\n{stream_links}" if stream_links else caption
+                await ready.put(("post", episode, post))
+            links = next_links
+
+            todo = []
+            for res in resolutions:
+                if job.is_done(f"upload {episode} {res}"):
+                    # Posted by an earlier attempt of this job.
+                    success_count += 1
+                    continue
+                if upload_index.lookup(*_upload_key(anime_name, episode), res):
+                    # Already uploaded once: repost it, in order after anything
+                    # still waiting to upload.
+                    await ready.join()
+                    job_queue.set_stage(job, f"repost ep {episode} {res}p")
+                    if await _repost_uploaded(anime_name, episode, res):
+                        job_queue.mark_done(job, f"upload {episode} {res}")
+                        success_count += 1
+                        continue
+                todo.append(res)
+            if not todo:
                 continue
-            final_filename = kai_file
-        else:
-            # AnimePahe exited 0 — find the downloaded file (mp4 or mkv)
-            files = glob.glob("**/*.mp4", recursive=True) + glob.glob("**/*.mkv", recursive=True)
-            # Exclude our own already-renamed output files to avoid false matches
-            files = [f for f in files if not f.startswith("Ep_")]
-            if not files:
-                # Exit-0 but no file = AnimePahe had no file at this resolution.
-                # Treat it the same as a failure and try AnimeKAI.
-                await status_msg.edit_text(
-                    f"⚠️ AnimePahe had no file for {res}p — trying AnimeKAI fallback..."
+
+            if len(todo) > 1 and NATIVE_HLS:
+                # "-r all": one link lookup, every variant downloading at once.
+                await _disk_budget.wait_for_room()
+                await _check_space()
+                job_queue.set_stage(job, f"download ep {episode} {'/'.join(todo)}p")
+                async with contextlib.aclosing(_download_all_resolutions(
+                    chat, kai, space, anime_name, episode, todo, pahe_slug,
+                )) as results:
+                    async for res, outcome, final_filename, source in results:
+                        await _hand_off(episode, res, outcome, final_filename, source)
+                continue
+
+            for res in todo:
+                await _disk_budget.wait_for_room()
+                await _check_space()
+                job_queue.set_stage(job, f"download ep {episode} {res}p")
+                outcome, final_filename, source = await _download_resolution(
+                    chat, kai, space, anime_name, episode, res, pahe_slug,
                 )
-                kai_file = await _download_via_animekai(anime_name, episode, res)
-                if not kai_file:
-                    await message.reply_text(
-                        f"❌ Both sources failed for **{res}p** (AnimePahe + AnimeKAI)."
-                    )
+                await _hand_off(episode, res, outcome, final_filename, source)
+
+    async def _hand_off(episode, res, outcome, final_filename, source) -> bool:
+        """Queue a finished download for upload; False if there's no file."""
+        nonlocal skipped_count
+        if outcome == "skipped":
+            skipped_count += 1
+        if not final_filename:
+            return False
+        size = os.path.getsize(final_filename)
+        _disk_budget.add(size)
+        # Helper sessions (if any) start uploading right away; the post to
+        # MAIN_CHANNEL still happens in order, from the consumer.
+        task = uploadpool.pool.submit(final_filename, os.path.basename(final_filename), size)
+        if task:
+            staged[final_filename] = task
+        await ready.put(("file", episode, res, final_filename, size, source))
+        if not PIPELINE_UPLOADS:
+            await ready.join()
+        return True
+
+    async def _consume():
+        nonlocal success_count
+        uploaded = False
+        while True:
+            item = await ready.get()
+            try:
+                if item[0] == "post":
+                    _, episode, post = item
+                    await _post_info(chat, image_url, post, episode)
+                    job_queue.mark_done(job, f"post {episode}")
                     continue
-                final_filename = kai_file
-            else:
-                latest_file = max(files, key=os.path.getctime)
-                safe_name = anime_name.replace(" ", "_").replace(":", "").replace("/", "")
-                ext = os.path.splitext(latest_file)[1] or ".mp4"
-                final_filename = f"Ep_{episode}_{safe_name}_{res}p{ext}"
-                os.rename(latest_file, final_filename)
+                _, episode, res, final_filename, size, source = item
+                try:
+                    if UPLOAD_DELAY and uploaded:
+                        await asyncio.sleep(UPLOAD_DELAY)
+                    uploaded = True
+                    job_queue.set_stage(job, f"upload ep {episode} {res}p")
+                    if await _upload_resolution(
+                        chat, res, final_filename, anime_name, episode, source,
+                        staged=staged.pop(final_filename, None),
+                    ):
+                        job_queue.mark_done(job, f"upload {episode} {res}")
+                        success_count += 1
+                finally:
+                    if os.path.exists(final_filename):
+                        os.remove(final_filename)
+                    await _disk_budget.release(size)
+            finally:
+                ready.task_done()
+
+    consumer = asyncio.create_task(_consume())
+    try:
+        await _produce()
+        await ready.join()
+    except asyncio.CancelledError:
+        # Shutdown: the job is requeued on the next start, so keep partial
+        # downloads (and their HLS checkpoints) to resume from.
+        keep_space = True
+        raise
+    finally:
+        consumer.cancel()
+        link_tasks = [t for t in link_tasks if t]
+        for t in link_tasks:
+            t.cancel()
+        for t in staged.values():
+            t.cancel()
+        await asyncio.gather(consumer, *link_tasks, *staged.values(), return_exceptions=True)
+        # Pool uploads that finished but were never posted.
+        for t in staged.values():
+            if not t.cancelled() and t.exception() is None and t.result() is not None:
+                await _drop_pool_message(t.result())
+        # Anything downloaded but never uploaded (job aborted) is removed.
+        while not ready.empty():
+            item = ready.get_nowait()
+            if item[0] != "file":
+                continue
+            _, _, _, leftover, size, _ = item
+            uploadpool.pool.release(leftover)
+            if os.path.exists(leftover):
+                os.remove(leftover)
+            await _disk_budget.release(size)
+        if not keep_space:
+            space.cleanup()
+        await chat.progress.stop()
 
-        try:
-            sent_doc = await app.send_document(
-                MAIN_CHANNEL,
-                document=final_filename,
-                caption=final_filename,
-                force_document=True,
+    # --- SPECIFIC COMPLETION MESSAGE (CRITICAL FOR CONTROLLER) ---
+    if success_count > 0 or skipped_count > 0:
+        await chat.status(f"✅ **{anime_name} - Ep {episode_spec} Uploaded!**")
+    else:
+        await chat.status("❌ Task finished, but errors occurred.")
+        raise jobs.JobFailed("no resolution uploaded")
+
+
+async def _post_info(chat: _JobChat, image_url: str, caption: str, episode: str):
+    """Post the poster + caption (with stream links) for one episode."""
+    try:
+        sent = await _send_poster(image_url, caption)
+        await _mirror_to_db(sent)
+        await chat.status(f"✅ Info Found. Starting Downloads for Ep **{episode}**...")
+    except Exception as e:
+        logger.error(f"Post failed: {e}")
+        await chat.status(f"⚠️ Info found but post failed: {e}")
+
+
+async def _expand_episodes(
+    anime_name: str, spec: str, kai: animekai.ResolveContext,
+) -> list[str]:
+    """Episode numbers for `spec`; "*" means every episode AnimeKAI lists."""
+    episodes = episodespec.parse(spec)
+    if episodes is not None:
+        return episodes
+    try:
+        results = await kai.search(anime_name, limit=10, timeout=30.0)
+        if not results:
+            return []
+        matcher = matching.TitleMatcher(anime_name, aliases=matching.aliases)
+        _, best = matcher.rank(results, lambda r: [r.title])[0]
+        index = await kai.episode_index(best.path, timeout=45.0)
+    except Exception as e:
+        logger.warning(f"Episode list for '{anime_name}' failed: {e}")
+        return []
+    numbers: set[str] = set()
+    for e in index.episodes:
+        numbers.update(episodespec.parse(str(e.number)) or [])
+    return sorted(numbers, key=float)
+
+
+async def _download_resolution(
+    chat: _JobChat, kai: animekai.ResolveContext, space: scratch.Scratch,
+    anime_name: str, episode: str, res: str, pahe_slug: str | None = None,
+) -> tuple[str, str | None, str | None]:
+    """
+    Download one resolution (AnimePahe, then AnimeKAI as fallback) into the
+    job's scratch space.
+    Returns ("ok", path, source), ("skipped", None, source) for over-size
+    files, or ("failed", None, None); failures are already reported to the
+    chat.
+    """
+    async with jobs.stage("download"):
+        return await _fetch_resolution(chat, kai, space, anime_name, episode, res, pahe_slug)
+
+
+async def _fetch_resolution(
+    chat: _JobChat, kai: animekai.ResolveContext, space: scratch.Scratch,
+    anime_name: str, episode: str, res: str, pahe_slug: str | None = None,
+    pahe_link: str | None = None, limiter: hls.Limiter | None = None,
+) -> tuple[str, str | None, str | None]:
+    """_download_resolution without the stage slot (see _download_all_resolutions)."""
+    out_dir = space.dir_for(episode, res)
+    tracker = chat.progress.track(f"Ep {episode} {res}p", source="animepahe")
+    try:
+        with metrics.timer("download_seconds", source="animepahe"):
+            returncode, final_filename = await _download_via_animepahe(
+                anime_name, episode, res, pahe_slug, link=pahe_link, limiter=limiter,
+                out_dir=out_dir, tracker=tracker,
             )
-            await _mirror_to_db(sent_doc)
-            if "1080" in res:
-                sent_sticker = await app.send_sticker(MAIN_CHANNEL, STICKER_ID)
-                await _mirror_to_db(sent_sticker)
-            success_count += 1
-        except Exception as e:
-            await message.reply_text(f"⚠️ Upload Error: {e}")
+    finally:
+        tracker.close()
+    if not final_filename and returncode != 2:
+        metrics.error("download.animepahe")
+
+    # --- HANDLE EXIT CODES ---
+    if returncode == 2:
+        await chat.reply(f"⚠️ Skipped {res}p: File too large (>350MB).")
+        return "skipped", None, "animepahe"
+
+    # AnimePahe failed (or exited 0 without a file) — try AnimeKAI
+    if not final_filename:
+        reason = "failed" if returncode != 0 else "had no file"
+        await chat.status(
+            f"⚠️ AnimePahe {reason} for {res}p — trying AnimeKAI fallback..."
+        )
+        tracker = chat.progress.track(f"Ep {episode} {res}p (AnimeKAI)", source="animekai")
+        try:
+            with metrics.timer("download_seconds", source="animekai"):
+                kai_file = await _download_via_animekai(anime_name, episode, res, kai, out_dir, tracker)
         finally:
-            if os.path.exists(final_filename):
-                os.remove(final_filename)
+            tracker.close()
+        if not kai_file:
+            metrics.error("download.animekai")
+            await chat.reply(
+                f"❌ Both sources failed for **{res}p** (AnimePahe + AnimeKAI)."
+            )
+            return "failed", None, None
+        return "ok", kai_file, "animekai"
+    return "ok", final_filename, "animepahe"
 
+
+async def _download_all_resolutions(
+    chat: _JobChat, kai: animekai.ResolveContext, space: scratch.Scratch,
+    anime_name: str, episode: str, resolutions: list[str], pahe_slug: str | None = None,
+):
+    """
+    "-r all" in one pass: _pahe_links resolves the play page once and
+    every resolution's m3u8, then all variants download at the same
+    time under one hls.Limiter (shared connection / bandwidth cap) and a
+    single "download" stage slot.
+
+    Yields (res, outcome, path, source) in `resolutions` order, each as soon
+    as it and every resolution before it are done, so uploads can start
+    while the larger variants are still downloading.
+    """
+    async with jobs.stage("download"):
+        links = await _pahe_links(anime_name, episode, pahe_slug, resolutions)
+        limiter = hls.Limiter()
+        tasks = {
+            res: asyncio.create_task(_fetch_resolution(
+                chat, kai, space, anime_name, episode, res, pahe_slug,
+                # "" = AnimePahe has no such resolution → straight to AnimeKAI
+                pahe_link=(links.get(res, "") if links is not None else None),
+                limiter=limiter,
+            ))
+            for res in resolutions
+        }
+        handed_out = set()
         try:
-            # Clean up any leftover directory from AnimePahe's download structure.
-            # latest_file is only set in the AnimePahe-success branch.
-            if process.returncode == 0:
-                parent = os.path.dirname(locals().get("latest_file", ""))
-                if parent and os.path.isdir(parent):
-                    os.rmdir(parent)
-        except Exception:
-            pass
+            for res in resolutions:
+                outcome, final_filename, source = await tasks[res]
+                handed_out.add(res)
+                yield res, outcome, final_filename, source
+        finally:
+            for res, task in tasks.items():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            # Files finished but never handed to the caller (job aborted).
+            for res, task in tasks.items():
+                if res in handed_out or task.cancelled() or task.exception():
+                    continue
+                leftover = task.result()[1]
+                if leftover and os.path.exists(leftover):
+                    os.remove(leftover)
 
-        if res != resolutions[-1]: await asyncio.sleep(30)
 
-    # --- SPECIFIC COMPLETION MESSAGE (CRITICAL FOR CONTROLLER) ---
-    if success_count > 0 or skipped_count > 0:
-        await status_msg.edit_text(f"✅ **{anime_name} - Ep {episode} Uploaded!**")
-    else:
-        await status_msg.edit_text(f"❌ Task finished, but errors occurred.")
+async def _upload_resolution(
+    chat: _JobChat, res: str, final_filename: str,
+    anime_name: str, episode: str, source: str, staged: asyncio.Task | None = None,
+) -> bool:
+    """
+    Upload one finished file to MAIN_CHANNEL (+ DB mirror) and record it in
+    the upload index. Returns success.
+
+    `staged` is an upload already handed to the pool (uploadpool.submit);
+    its DB_CHANNEL message is reposted by file_id and serves as the mirror.
+    If that fails, the file is uploaded here, to MAIN_CHANNEL only when the
+    pool's message can still be the mirror.
+    """
+    caption = os.path.basename(final_filename)
+    try:
+        size = os.path.getsize(final_filename)
+        sent_doc = db_copy = None
+        if staged is not None:
+            # Already uploaded by the pool; reposting by file_id needs no upload slot.
+            sent_doc, db_copy = await _post_staged(staged, caption)
+        if sent_doc is None:
+            async with jobs.stage("upload"):
+                with uploadpool.pool.main_upload(final_filename, size), \
+                        metrics.timer("upload_seconds", stage="upload"):
+                    sent_doc = await app.send_document(
+                        MAIN_CHANNEL,
+                        document=final_filename,
+                        caption=caption,
+                        force_document=True,
+                    )
+                metrics.inc("upload_bytes_total", size)
+                if db_copy is None:
+                    db_copy = await _mirror_to_db(sent_doc)
+        series, ep = _upload_key(anime_name, episode)
+        upload_index.record(uploads.Upload(
+            series=series, episode=ep, resolution=res, source=source,
+            main_message_id=sent_doc.id,
+            db_message_id=db_copy.id if db_copy else None,
+            file_id=sent_doc.document.file_id if sent_doc.document else None,
+            file_name=caption, size=size, created=time.time(),
+        ))
+        await _send_resolution_sticker(res)
+        return True
+    except Exception as e:
+        await chat.reply(f"⚠️ Upload Error: {e}")
+        return False
+
+
+async def _post_staged(staged: asyncio.Task, caption: str):
+    """
+    Post a pool upload to MAIN_CHANNEL: fetch the helper's DB_CHANNEL message
+    with our own client (file_ids are per client) and send it by file_id.
+    Returns (main message, DB message). With no main message the caller
+    uploads directly; a DB message is then still the mirror, and without
+    one the helper's message has been deleted (so it isn't left orphaned).
+    """
+    db_msg = await staged
+    if db_msg is None:
+        return None, None
+    own = None
+    try:
+        own = await app.get_messages(DB_CHANNEL, db_msg.id)
+        if not own or not own.document:
+            own = None
+            raise ValueError("pool upload has no document")
+        sent = await app.send_document(
+            MAIN_CHANNEL, document=own.document.file_id, caption=caption, force_document=True,
+        )
+        return sent, own
+    except Exception as e:
+        logger.warning(f"Posting pool upload {db_msg.id} failed, uploading directly: {e}")
+    if own is None:
+        await _drop_pool_message(db_msg)
+    return None, own
+
+
+async def _drop_pool_message(db_msg) -> None:
+    """Delete a helper's DB_CHANNEL upload that won't be used (best effort)."""
+    try:
+        await db_msg.delete()
+    except Exception as e:
+        logger.warning(f"Could not delete unused pool upload {db_msg.id}: {e}")
+
+
+async def _send_resolution_sticker(res: str):
+    if "1080" in res:
+        sent_sticker = await app.send_sticker(MAIN_CHANNEL, STICKER_ID)
+        await _mirror_to_db(sent_sticker)
+
+
+def _upload_key(anime_name: str, episode: str) -> tuple[str, str]:
+    """(series, episode) as stored in the upload index."""
+    ep = episode.strip()
+    if ep.isdigit():
+        ep = ep.lstrip("0") or "0"
+    return matching.normalize(anime_name), ep
+
+
+async def _repost_uploaded(anime_name: str, episode: str, res: str) -> bool:
+    """
+    Post an episode we've uploaded before without downloading it again:
+    copy the DB_CHANNEL (or MAIN_CHANNEL) message, else send the stored
+    file_id. The index then points at the new MAIN_CHANNEL message. A stale
+    entry (message deleted, file_id rejected) is dropped and False is
+    returned so the caller downloads as usual.
+    """
+    entry = upload_index.lookup(*_upload_key(anime_name, episode), res)
+    if not entry:
+        return False
+    attempts = []
+    if entry.db_message_id and DB_CHANNEL:
+        attempts.append(("copy from DB_CHANNEL", lambda: app.copy_message(
+            MAIN_CHANNEL, DB_CHANNEL, entry.db_message_id)))
+    if entry.main_message_id:
+        attempts.append(("copy from MAIN_CHANNEL", lambda: app.copy_message(
+            MAIN_CHANNEL, MAIN_CHANNEL, entry.main_message_id)))
+    if entry.file_id:
+        attempts.append(("file_id", lambda: app.send_document(
+            MAIN_CHANNEL, entry.file_id, caption=entry.file_name)))
+
+    async with jobs.stage("upload"):
+        for label, send in attempts:
+            try:
+                sent = await send()
+            except Exception as e:
+                logger.warning(f"Repost of {entry.file_name} via {label} failed: {e}")
+                continue
+            if not sent:
+                continue
+            logger.info(f"♻️ Reposted {entry.file_name} ({res}p) via {label}")
+            metrics.inc("upload_reused_total", resolution=res)
+            db_message_id = entry.db_message_id
+            if label != "copy from DB_CHANNEL":
+                # DB_CHANNEL doesn't have it (any more): mirror the repost.
+                db_copy = await _mirror_to_db(sent)
+                if db_copy:
+                    db_message_id = db_copy.id
+            document = getattr(sent, "document", None)
+            upload_index.record(uploads.Upload(
+                series=entry.series, episode=entry.episode, resolution=entry.resolution,
+                source=entry.source, main_message_id=sent.id, db_message_id=db_message_id,
+                file_id=document.file_id if document else entry.file_id,
+                file_name=entry.file_name, size=entry.size, created=time.time(),
+            ))
+            try:
+                await _send_resolution_sticker(res)
+            except Exception as e:
+                logger.warning(f"Sticker after repost failed: {e}")
+            return True
+    upload_index.delete(entry)
+    return False
+
+
+class _DiskBudget:
+    """
+    Caps the bytes of downloaded-but-not-yet-uploaded files across all jobs.
+    A download only starts while usage is under the limit, so the real
+    ceiling is the limit plus one file (we can't know a size up front).
+    """
+
+    def __init__(self, limit_bytes: int):
+        self.limit = limit_bytes
+        self.used = 0
+        self._changed = asyncio.Condition()
+
+    async def wait_for_room(self):
+        async with self._changed:
+            await self._changed.wait_for(lambda: self.used < self.limit)
+
+    def add(self, nbytes: int):
+        self.used += nbytes
+
+    async def release(self, nbytes: int):
+        async with self._changed:
+            self.used = max(0, self.used - nbytes)
+            self._changed.notify_all()
+
+
+_disk_budget = _DiskBudget(PIPELINE_DISK_BUDGET_MB * 1_048_576)
+
+
+def _format_job(job: jobs.Job) -> str:
+    p = job.params
+    line = f"#{job.id} [{job.state}] {p.get('anime_name')} Ep {p.get('episode')} ({p.get('resolution')})"
+    if job.state == jobs.RUNNING and job.stage:
+        line += f" — {job.stage}"
+    if job.error:
+        line += f" — {job.error}"
+    return line
+
+
+@app.on_message(filters.command("jobs"))
+async def list_jobs(client, message: Message):
+    if not await is_admin(message): return
+    counts = job_queue.store.counts()
+    summary = ", ".join(f"{k}: {v}" for k, v in sorted(counts.items())) or "no jobs yet"
+    recent = job_queue.store.recent(10)
+    body = "\n".join(_format_job(j) for j in recent)
+    await message.reply_text(f"**Jobs** ({summary})\n\n{body}".strip())
+
+
+@app.on_message(filters.command("job"))
+async def show_job(client, message: Message):
+    if not await is_admin(message): return
+    parts = message.text.split()
+    if len(parts) < 2 or not parts[1].lstrip("#").isdigit():
+        await message.reply_text("Usage: /job <id>")
+        return
+    job = job_queue.store.get(int(parts[1].lstrip("#")))
+    if not job:
+        await message.reply_text("Job not found.")
+        return
+    await message.reply_text(f"{_format_job(job)}\nAttempts: {job.attempts}")
+
+
+@app.on_message(filters.command("forget"))
+async def forget_uploads(client, message: Message):
+    """/forget <name> [-e <ep>] [-r <res>] — drop upload-index entries."""
+    if not await is_admin(message): return
+    command_text = message.text.split(" ", 1)
+    if len(command_text) < 2:
+        await message.reply_text("Usage: /forget <name> [-e <ep>] [-r <res>]")
+        return
+
+    # -e / -r only count as whole tokens, so titles like "Re-Zero" stay intact.
+    usage = "Usage: /forget <name> [-e <ep>] [-r <res>]"
+    try:
+        tokens = shlex.split(command_text[1])
+    except ValueError:
+        # Unbalanced quote, e.g. an apostrophe in "JoJo's ...".
+        tokens = command_text[1].split()
+    flags = {"-e": None, "-r": None}
+    name_parts = []
+    it = iter(tokens)
+    for token in it:
+        if token in flags:
+            value = next(it, None)
+            if value is None:
+                await message.reply_text(usage)
+                return
+            flags[token] = value
+        else:
+            name_parts.append(token)
+    anime_name = " ".join(name_parts)
+    episode, resolution = flags["-e"], flags["-r"]
+    if not anime_name:
+        await message.reply_text(usage)
+        return
+
+    series, ep = _upload_key(anime_name, episode or "")
+    removed = upload_index.invalidate(series, ep if episode else None, resolution or None)
+    scope = "".join([f" Ep {episode}" if episode else "", f" {resolution}p" if resolution else ""])
+    await message.reply_text(f"🗑 Forgot {removed} upload(s) of **{anime_name}**{scope}.")
+
 
 async def main():
+    images.start()
+    await httppool.start()
+    await kwik.start()
     await app.start()
     await check_channels()
+    if DB_CHANNEL and DB_CHANNEL != MAIN_CHANNEL:
+        await uploadpool.pool.start(API_ID, API_HASH, DB_CHANNEL)
     await web_server()
+    job_queue.register("anime", _run_anime_job)
+    interrupted = await job_queue.start()
+    scratch.sweep(keep=[job.id for job in interrupted if job.state == jobs.QUEUED])
+    hls.gc_checkpoints(scratch.SCRATCH_DIR)
+    for job in interrupted:
+        if job.state == jobs.QUEUED:
+            await _JobChat(job).status(f"♻️ Bot restarted — job #{job.id} requeued.")
+        else:
+            await _JobChat(job).status(f"❌ Job #{job.id} was interrupted too many times, giving up.")
 
     print("Bot is fully running...")
 
-    await idle()
+    try:
+        await idle()
+    finally:
+        await job_queue.stop()
+        animekai.health.save()
+        images.shutdown()
+        await kwik.shutdown()
+        await uploadpool.pool.stop()
+        await app.stop()
+        await httppool.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,135 @@
+"""Small persistent TTL + LRU cache backed by SQLite.
+
+Used for anything we look up over the network that doesn't change between
+posts (anime metadata, search results, ...). The database lives under
+DATA_DIR so it survives container restarts when that path is a volume.
+
+Each TTLCache is a namespace inside one shared database file:
+  * values are stored as JSON,
+  * every entry carries its own expiry (so callers can pick a TTL per entry,
+    e.g. shorter for airing shows),
+  * reads bump an access timestamp and the least recently used entries are
+    evicted once a namespace grows past max_entries.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Optional
+
+log = logging.getLogger(__name__)
+
+DATA_DIR = os.getenv("DATA_DIR", "data")
+DEFAULT_DB = os.path.join(DATA_DIR, "cache.sqlite3")
+
+# Connections are shared per database file; sqlite3 connections are safe to
+# use across threads as long as access is serialized, hence the lock.
+_connections: dict = {}
+_connections_lock = threading.Lock()
+
+
+def _connect(path: str) -> tuple:
+    with _connections_lock:
+        entry = _connections.get(path)
+        if entry is None:
+            parent = os.path.dirname(path)
+            if parent:
+                os.makedirs(parent, exist_ok=True)
+            db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                " ns TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,"
+                " expires REAL NOT NULL, accessed REAL NOT NULL,"
+                " PRIMARY KEY (ns, key))"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS cache_lru ON cache (ns, accessed)")
+            entry = (db, threading.Lock())
+            _connections[path] = entry
+    return entry
+
+
+class TTLCache:
+    """A namespaced key → JSON value store with per-entry TTL and LRU eviction."""
+
+    def __init__(self, namespace: str, max_entries: int = 2000, path: Optional[str] = None):
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.path = path or DEFAULT_DB
+        self._db, self._lock = _connect(self.path)
+        self._writes = 0
+
+    def get(self, key: str, default: Any = None) -> Any:
+        now = time.time()
+        try:
+            with self._lock:
+                row = self._db.execute(
+                    "SELECT value, expires FROM cache WHERE ns = ? AND key = ?",
+                    (self.namespace, key),
+                ).fetchone()
+                if row is None:
+                    return default
+                value, expires = row
+                if expires <= now:
+                    self._db.execute(
+                        "DELETE FROM cache WHERE ns = ? AND key = ?", (self.namespace, key)
+                    )
+                    return default
+                self._db.execute(
+                    "UPDATE cache SET accessed = ? WHERE ns = ? AND key = ?",
+                    (now, self.namespace, key),
+                )
+            return json.loads(value)
+        except Exception as e:
+            log.warning("Cache %s read failed for %r: %s", self.namespace, key, e)
+            return default
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        now = time.time()
+        try:
+            payload = json.dumps(value)
+            with self._lock:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO cache (ns, key, value, expires, accessed)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    (self.namespace, key, payload, now + ttl, now),
+                )
+                self._writes += 1
+                # Eviction is a range delete, so only do it every few writes.
+                if self._writes % 20 == 0:
+                    self._evict(now)
+        except Exception as e:
+            log.warning("Cache %s write failed for %r: %s", self.namespace, key, e)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM cache WHERE ns = ? AND key = ?", (self.namespace, key)
+            )
+
+    def clear(self) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM cache WHERE ns = ?", (self.namespace,))
+
+    def __len__(self) -> int:
+        with self._lock:
+            (n,) = self._db.execute(
+                "SELECT COUNT(*) FROM cache WHERE ns = ?", (self.namespace,)
+            ).fetchone()
+        return n
+
+    def _evict(self, now: float) -> None:
+        """Drop expired entries, then the least recently used ones over the cap."""
+        self._db.execute(
+            "DELETE FROM cache WHERE ns = ? AND expires <= ?", (self.namespace, now)
+        )
+        self._db.execute(
+            "DELETE FROM cache WHERE ns = ? AND key IN ("
+            " SELECT key FROM cache WHERE ns = ? ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+            (self.namespace, self.namespace, self.max_entries),
+        )
@@ -0,0 +1,47 @@
+"""Episode specs as /anime (and animepahe-dl.sh's -e) take them.
+
+    episodespec.parse("1,3,7-9")    # ["1", "3", "7", "8", "9"]
+    episodespec.parse("*")          # None: every episode, needs the list
+    episodespec.parse("1-100000")   # []: malformed (over MAX_EPISODES)
+
+Episode numbers are plain decimals ("12", "12.5"); ranges are whole
+numbers. A spec naming more than MAX_EPISODES episodes is rejected, so a
+typo can't expand into millions of entries on the event loop.
+"""
+from __future__ import annotations
+
+import re
+from typing import List, Optional, Set
+
+# Largest spec (/anime -e) accepted for one job.
+MAX_EPISODES = 500
+
+_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+
+
+def parse(spec: str) -> Optional[List[str]]:
+    """
+    Sorted, de-duplicated episode numbers of `spec`, [] if it is malformed,
+    or None if it contains "*" (all episodes).
+    """
+    spec = spec.strip()
+    if "*" in spec:
+        return None
+    numbers: Set[float] = set()
+    for part in (p.strip() for p in spec.split(",")):
+        if not part:
+            continue
+        if "-" in part:
+            lo, _, hi = part.partition("-")
+            if not (lo.strip().isdigit() and hi.strip().isdigit()):
+                return []
+            if int(hi) - int(lo) >= MAX_EPISODES:
+                return []
+            numbers.update(range(int(lo), int(hi) + 1))
+        elif _NUMBER.fullmatch(part):
+            numbers.add(float(part))
+        else:
+            return []
+        if len(numbers) > MAX_EPISODES:
+            return []
+    return [str(int(n)) if float(n).is_integer() else str(n) for n in sorted(numbers)]
@@ -0,0 +1,509 @@
+"""In-process asyncio HLS downloader.
+
+Replaces the curl/xargs/openssl pipeline from animepahe-dl.sh (one bash +
+curl + openssl process per segment, every segment written to disk three
+times) with a single coroutine that:
+  * parses the m3u8 (following a master playlist to the chosen variant),
+  * fetches segments over the shared HTTP pool with bounded concurrency,
+    resuming a broken segment transfer with a Range request,
+  * decrypts AES-128 segments in memory,
+  * appends segments to one output file strictly in playlist order.
+
+The result is an MPEG-TS (or fMP4) stream; download() remuxes it to mp4
+with a single `ffmpeg -c copy` pass unless told not to.
+
+Several downloads running at once (e.g. every resolution of an episode)
+can share a Limiter, which caps their combined open segment requests and,
+optionally, their combined bandwidth.
+
+Downloads are resumable. Next to the partial output, a checkpoint file
+(`<out>.ckpt.json`) records how many segments, and how many bytes, are
+safely written. The checkpoint is updated at most every
+HLS_CHECKPOINT_INTERVAL seconds and once more when a download fails or is
+cancelled. A later download of the same stream to the same path truncates
+the file back to the checkpoint and carries on from the next segment.
+gc_checkpoints() removes checkpoints (and their partial files) older than
+HLS_CHECKPOINT_TTL.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import urljoin
+
+import aiohttp
+from cryptography.hazmat.primitives import padding
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+import httppool
+import metrics
+
+log = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = max(1, int(os.getenv("HLS_CONCURRENCY", "8") or 8))
+# Limiter defaults: segment requests in flight across a group of downloads,
+# and their combined bandwidth in MB/s (0 = unlimited).
+GROUP_CONNECTIONS = max(1, int(os.getenv("HLS_GROUP_CONNECTIONS", "16") or 16))
+GROUP_BANDWIDTH_MBPS = float(os.getenv("HLS_GROUP_BANDWIDTH_MBPS", "0") or 0)
+SEGMENT_RETRIES = 5
+CHECKPOINT_INTERVAL = float(os.getenv("HLS_CHECKPOINT_INTERVAL", "5") or 5)
+CHECKPOINT_TTL = int(os.getenv("HLS_CHECKPOINT_TTL", "86400") or 86400)
+CHECKPOINT_SUFFIX = ".ckpt.json"
+_SEGMENT_TIMEOUT = aiohttp.ClientTimeout(total=120, sock_read=30)
+_USER_AGENT = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+    "AppleWebKit/537.36 (KHTML, like Gecko) "
+    "Chrome/120.0.0.0 Safari/537.36"
+)
+
+# progress(segments_done, segments_total, bytes_written)
+ProgressCallback = Callable[[int, int, int], None]
+
+_ATTR_RE = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+
+class HLSError(Exception):
+    pass
+
+
+class Limiter:
+    """Connection and bandwidth cap shared by concurrent downloads."""
+
+    def __init__(self, connections: int = GROUP_CONNECTIONS, mbps: float = GROUP_BANDWIDTH_MBPS):
+        self.connections = asyncio.Semaphore(max(1, connections))
+        self.rate = mbps * 1_048_576
+        self._free_at = 0.0   # loop time when the bandwidth reserved so far is used up
+
+    async def throttle(self, nbytes: int) -> None:
+        """Wait until `nbytes` more fit in the bandwidth cap."""
+        if self.rate <= 0:
+            return
+        now = asyncio.get_running_loop().time()
+        self._free_at = max(self._free_at, now) + nbytes / self.rate
+        delay = self._free_at - now
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+@dataclass
+class Key:
+    method: str                  # NONE / AES-128
+    uri: Optional[str] = None
+    iv: Optional[bytes] = None
+
+
+@dataclass
+class Segment:
+    uri: str
+    sequence: int
+    duration: float = 0.0
+    key: Optional[Key] = None
+
+
+@dataclass
+class Variant:
+    uri: str
+    bandwidth: int = 0
+    height: int = 0
+
+
+@dataclass
+class Playlist:
+    segments: List[Segment] = field(default_factory=list)
+    variants: List[Variant] = field(default_factory=list)
+    init_uri: Optional[str] = None   # EXT-X-MAP (fMP4 streams)
+
+    @property
+    def is_master(self) -> bool:
+        return bool(self.variants) and not self.segments
+
+
+def _attrs(line: str) -> Dict[str, str]:
+    _, _, rest = line.partition(":")
+    return {k: v.strip('"') for k, v in _ATTR_RE.findall(rest)}
+
+
+def parse_m3u8(text: str, base_url: str) -> Playlist:
+    """Parse a master or media playlist. Relative URIs are resolved against base_url."""
+    lines = [l.strip() for l in text.splitlines() if l.strip()]
+    if not lines or not lines[0].startswith("#EXTM3U"):
+        raise HLSError("not an m3u8 playlist")
+
+    pl = Playlist()
+    sequence = 0
+    key: Optional[Key] = None
+    duration = 0.0
+    pending_variant: Optional[Variant] = None
+
+    for line in lines[1:]:
+        if line.startswith("#EXT-X-MEDIA-SEQUENCE:"):
+            sequence = int(line.split(":", 1)[1])
+        elif line.startswith("#EXT-X-KEY:"):
+            a = _attrs(line)
+            method = a.get("METHOD", "NONE").upper()
+            if method == "NONE":
+                key = None
+            elif method != "AES-128":
+                raise HLSError(f"unsupported encryption {method}")
+            else:
+                iv = a.get("IV")
+                key = Key(
+                    method=method,
+                    uri=urljoin(base_url, a["URI"]),
+                    iv=bytes.fromhex(iv[2:]) if iv else None,
+                )
+        elif line.startswith("#EXT-X-MAP:"):
+            pl.init_uri = urljoin(base_url, _attrs(line)["URI"])
+        elif line.startswith("#EXTINF:"):
+            try:
+                duration = float(line.split(":", 1)[1].split(",", 1)[0])
+            except ValueError:
+                duration = 0.0
+        elif line.startswith("#EXT-X-STREAM-INF:"):
+            a = _attrs(line)
+            res = a.get("RESOLUTION", "")
+            height = int(res.split("x")[1]) if "x" in res else 0
+            pending_variant = Variant(uri="", bandwidth=int(a.get("BANDWIDTH", 0) or 0), height=height)
+        elif line.startswith("#"):
+            continue
+        elif pending_variant is not None:
+            pending_variant.uri = urljoin(base_url, line)
+            pl.variants.append(pending_variant)
+            pending_variant = None
+        else:
+            pl.segments.append(Segment(
+                uri=urljoin(base_url, line), sequence=sequence,
+                duration=duration, key=key,
+            ))
+            sequence += 1
+            duration = 0.0
+    return pl
+
+
+def _pick_variant(variants: List[Variant], height: Optional[int]) -> Variant:
+    if height:
+        return min(variants, key=lambda v: (abs(v.height - height), -v.bandwidth))
+    return max(variants, key=lambda v: (v.height, v.bandwidth))
+
+
+async def _get_bytes(
+    session: aiohttp.ClientSession, url: str, headers: Dict[str, str],
+    limiter: Optional[Limiter] = None,
+) -> bytes:
+    """GET a URL fully, resuming a truncated body with a Range request."""
+    buf = bytearray()
+    last_error: Optional[Exception] = None
+    for attempt in range(1, SEGMENT_RETRIES + 1):
+        req_headers = dict(headers)
+        if buf:
+            req_headers["Range"] = f"bytes={len(buf)}-"
+        try:
+            if limiter is not None:
+                await limiter.connections.acquire()
+            try:
+                async with session.get(url, headers=req_headers, timeout=_SEGMENT_TIMEOUT) as resp:
+                    if resp.status == 200 and buf:
+                        # Server ignored the Range header — start over.
+                        buf.clear()
+                    elif resp.status not in (200, 206):
+                        raise HLSError(f"HTTP {resp.status} for {url}")
+                    async for chunk in resp.content.iter_chunked(1 << 16):
+                        buf.extend(chunk)
+                        if limiter is not None:
+                            await limiter.throttle(len(chunk))
+                    expected = resp.content_length
+                    if expected is not None and resp.status == 200 and len(buf) < expected:
+                        raise HLSError("short read")
+                    return bytes(buf)
+            finally:
+                if limiter is not None:
+                    limiter.connections.release()
+        except (aiohttp.ClientError, asyncio.TimeoutError, HLSError) as e:
+            last_error = e
+            log.debug("HLS fetch %s failed (attempt %d/%d): %s", url, attempt, SEGMENT_RETRIES, e)
+            await asyncio.sleep(min(0.5 * attempt, 3.0))
+    raise HLSError(f"giving up on {url}: {last_error}")
+
+
+def _decrypt(data: bytes, key: bytes, iv: bytes) -> bytes:
+    decryptor = Cipher(algorithms.AES(key), modes.CBC(iv)).decryptor()
+    plain = decryptor.update(data) + decryptor.finalize()
+    unpadder = padding.PKCS7(128).unpadder()
+    try:
+        return unpadder.update(plain) + unpadder.finalize()
+    except ValueError:
+        # Some packagers don't pad the last block properly; keep the bytes.
+        return plain
+
+
+def checkpoint_path(out_path: str) -> str:
+    return out_path + CHECKPOINT_SUFFIX
+
+
+def has_checkpoint(out_path: str) -> bool:
+    return os.path.exists(checkpoint_path(out_path))
+
+
+def _fingerprint(pl: Playlist) -> str:
+    # Segment URLs often carry per-request tokens, so identify the stream by
+    # its shape instead: segment count, total duration, init segment.
+    duration = sum(seg.duration for seg in pl.segments)
+    return f"{len(pl.segments)}:{duration:.3f}:{int(bool(pl.init_uri))}"
+
+
+def _load_checkpoint(out_path: str, fingerprint: str) -> Tuple[int, int]:
+    """(segments written, bytes) of a usable checkpoint, else (0, 0)."""
+    try:
+        with open(checkpoint_path(out_path)) as fh:
+            ckpt = json.load(fh)
+        segments, nbytes = int(ckpt["segments"]), int(ckpt["bytes"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return 0, 0
+    if ckpt.get("fingerprint") != fingerprint:
+        log.info("HLS: checkpoint for %s is for a different stream, starting over", out_path)
+        return 0, 0
+    if not os.path.exists(out_path) or os.path.getsize(out_path) < nbytes:
+        return 0, 0
+    return segments, nbytes
+
+
+def _save_checkpoint(out_path: str, fingerprint: str, segments: int, nbytes: int) -> None:
+    path = checkpoint_path(out_path)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as fh:
+        json.dump({
+            "fingerprint": fingerprint, "segments": segments,
+            "bytes": nbytes, "updated": time.time(),
+        }, fh)
+    os.replace(tmp, path)
+
+
+def gc_checkpoints(root: str, max_age: float = CHECKPOINT_TTL) -> int:
+    """Remove checkpoints under `root` older than `max_age` seconds, with their partial files."""
+    removed = 0
+    cutoff = time.time() - max_age
+    for dirpath, _, files in os.walk(root):
+        for name in files:
+            if not name.endswith(CHECKPOINT_SUFFIX):
+                continue
+            path = os.path.join(dirpath, name)
+            try:
+                if os.path.getmtime(path) >= cutoff:
+                    continue
+                partial = path[: -len(CHECKPOINT_SUFFIX)]
+                if os.path.exists(partial):
+                    os.remove(partial)
+                os.remove(path)
+                removed += 1
+            except OSError:
+                continue
+    if removed:
+        log.info("HLS: removed %d stale checkpoint(s) under %s", removed, root)
+    return removed
+
+
+async def load_playlist(
+    url: str, headers: Optional[Dict[str, str]] = None,
+    height: Optional[int] = None, session: Optional[aiohttp.ClientSession] = None,
+) -> Playlist:
+    """Fetch a playlist, following a master playlist to one media playlist."""
+    session = session or httppool.session()
+    headers = {"User-Agent": _USER_AGENT, **(headers or {})}
+    for _ in range(3):  # master → media, guard against loops
+        text = (await _get_bytes(session, url, headers)).decode("utf-8", errors="replace")
+        pl = parse_m3u8(text, url)
+        if not pl.is_master:
+            return pl
+        url = _pick_variant(pl.variants, height).uri
+    raise HLSError("playlist nesting too deep")
+
+
+async def download_to_ts(
+    url: str, out_path: str, headers: Optional[Dict[str, str]] = None,
+    concurrency: int = DEFAULT_CONCURRENCY, height: Optional[int] = None,
+    session: Optional[aiohttp.ClientSession] = None, limiter: Optional[Limiter] = None,
+    progress: Optional[ProgressCallback] = None,
+) -> str:
+    """
+    Download every segment of `url` into `out_path` (raw TS / fMP4),
+    resuming from its checkpoint if there is one. On failure the partial
+    file and checkpoint are left in place for the next attempt.
+
+    `progress(segments_done, segments_total, bytes_written)` is called after
+    every segment written.
+    """
+    session = session or httppool.session()
+    headers = {"User-Agent": _USER_AGENT, **(headers or {})}
+    pl = await load_playlist(url, headers, height, session)
+    if not pl.segments:
+        raise HLSError("playlist has no segments")
+    fingerprint = _fingerprint(pl)
+    resume_at, resume_bytes = _load_checkpoint(out_path, fingerprint)
+
+    keys: Dict[str, bytes] = {}
+    key_lock = asyncio.Lock()
+
+    async def _key_bytes(uri: str) -> bytes:
+        async with key_lock:
+            if uri not in keys:
+                keys[uri] = await _get_bytes(session, uri, headers)
+            return keys[uri]
+
+    segments = pl.segments
+    total = len(segments)
+    # Cap how far fetching may run ahead of writing so memory stays bounded.
+    window = max(2, concurrency * 2)
+    done: Dict[int, bytes] = {}
+    next_write = resume_at
+    cond = asyncio.Condition()
+    queue: asyncio.Queue = asyncio.Queue()
+    for i in range(resume_at, total):
+        queue.put_nowait(i)
+
+    async def _worker() -> None:
+        while True:
+            try:
+                i = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            async with cond:
+                await cond.wait_for(lambda: i < next_write + window)
+            seg = segments[i]
+            data = await _get_bytes(session, seg.uri, headers, limiter)
+            if seg.key is not None:
+                iv = seg.key.iv or seg.sequence.to_bytes(16, "big")
+                data = _decrypt(data, await _key_bytes(seg.key.uri), iv)
+            async with cond:
+                done[i] = data
+                cond.notify_all()
+
+    def _checkpoint(fh) -> None:
+        # flush (no fsync): enough to survive the process or container
+        # going away, without blocking the loop on the disk.
+        fh.flush()
+        _save_checkpoint(out_path, fingerprint, next_write, fh.tell())
+
+    async def _writer(fh) -> None:
+        nonlocal next_write
+        saved_at = time.monotonic()
+        while next_write < total:
+            async with cond:
+                await cond.wait_for(lambda: next_write in done)
+                data = done.pop(next_write)
+            # Write and count the segment without yielding in between, so a
+            # cancellation never leaves the file and next_write out of step.
+            fh.write(data)
+            next_write += 1
+            if time.monotonic() - saved_at >= CHECKPOINT_INTERVAL:
+                _checkpoint(fh)
+                saved_at = time.monotonic()
+            if progress is not None:
+                progress(next_write, total, fh.tell())
+            async with cond:
+                cond.notify_all()
+
+    if resume_at:
+        fh = open(out_path, "r+b")
+        fh.truncate(resume_bytes)
+        fh.seek(resume_bytes)
+        metrics.inc("hls_resumed_bytes_total", resume_bytes)
+        log.info("HLS: resuming %s at segment %d/%d (%.1f MB kept)",
+                 out_path, resume_at, total, resume_bytes / 1_048_576)
+    else:
+        fh = open(out_path, "wb")
+    with fh:
+        if pl.init_uri and not resume_at:
+            fh.write(await _get_bytes(session, pl.init_uri, headers))
+        _checkpoint(fh)
+        if progress is not None:
+            progress(next_write, total, fh.tell())
+        workers = [asyncio.create_task(_worker()) for _ in range(max(1, concurrency))]
+        writer = asyncio.create_task(_writer(fh))
+        tasks = workers + [writer]
+        try:
+            # A worker or writer failure aborts the whole download. Waiting on
+            # all of them at once matters: with the writer gone, workers would
+            # wait on the window forever.
+            finished, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for t in finished:
+                t.result()
+        except BaseException:
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            try:
+                _checkpoint(fh)
+            except OSError as e:
+                log.warning("HLS: could not save checkpoint for %s: %s", out_path, e)
+            raise
+
+    os.remove(checkpoint_path(out_path))
+    log.info("HLS: wrote %d segments (%.1f MB) → %s", total, os.path.getsize(out_path) / 1_048_576, out_path)
+    return out_path
+
+
+async def remux(src: str, dst: str, timeout: float = 300.0) -> bool:
+    """Stream-copy a TS file into an mp4 container with one ffmpeg run."""
+    proc = await asyncio.create_subprocess_exec(
+        "ffmpeg", "-y", "-v", "error", "-i", src,
+        "-c", "copy", "-bsf:a", "aac_adtstoasc", dst,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    try:
+        with metrics.timer("ffmpeg_seconds", op="remux"):
+            _, err = await asyncio.wait_for(proc.communicate(), timeout=timeout)
+    except asyncio.TimeoutError:
+        proc.kill()
+        log.warning("HLS: remux timed out for %s", src)
+        return False
+    if proc.returncode != 0:
+        metrics.error("ffmpeg.remux")
+        log.warning("HLS: remux rc=%d — %s", proc.returncode, err.decode(errors="replace")[-400:])
+        return False
+    return True
+
+
+async def download(
+    url: str, out_path: str, headers: Optional[Dict[str, str]] = None,
+    concurrency: int = DEFAULT_CONCURRENCY, height: Optional[int] = None,
+    remux_to_mp4: bool = True, limiter: Optional[Limiter] = None,
+    progress: Optional[ProgressCallback] = None,
+) -> str:
+    """Download an HLS stream to `out_path` and return the path actually written.
+
+    With remux_to_mp4 the segments land in `<out_path>.ts` first and are then
+    stream-copied into `out_path`; if the remux fails, the .ts path is
+    returned instead so the caller still has a playable file.
+
+    If the download fails or is cancelled, the partial file stays behind
+    with its checkpoint; calling download() again with the same out_path
+    resumes it (see resumable()).
+    """
+    if not remux_to_mp4:
+        return await download_to_ts(url, out_path, headers, concurrency, height, limiter=limiter, progress=progress)
+
+    ts_path = out_path + ".ts"
+    try:
+        await download_to_ts(url, ts_path, headers, concurrency, height, limiter=limiter, progress=progress)
+    except BaseException:
+        if os.path.exists(ts_path) and not has_checkpoint(ts_path):
+            os.remove(ts_path)
+        raise
+    if await remux(ts_path, out_path):
+        os.remove(ts_path)
+        return out_path
+    if os.path.exists(out_path):
+        os.remove(out_path)
+    return ts_path
+
+
+def resumable(out_path: str, remux_to_mp4: bool = True) -> bool:
+    """True if an earlier download() to `out_path` left a checkpoint behind."""
+    return has_checkpoint(out_path + ".ts" if remux_to_mp4 else out_path)
@@ -0,0 +1,123 @@
+"""App-lifetime pooled HTTP client.
+
+Every outbound HTTP call in the bot (metadata APIs, posters, Wallhaven,
+AnimePahe) goes through one aiohttp.ClientSession so we get:
+  * keep-alive connection reuse instead of a fresh TCP + TLS handshake,
+  * a DNS cache,
+  * a global connection cap plus a per-host cap (which doubles as a per-host
+    concurrency limit, since a request holds its connection while running).
+
+start() is called from main() and close() on shutdown. session() lazily
+starts the pool too, so helpers still work when called outside the bot
+(scripts, REPL).
+
+stats() returns counters collected through aiohttp tracing, mainly to check
+that connections are actually being reused.
+"""
+from __future__ import annotations
+
+import logging
+import os
+from typing import Dict, Optional
+
+import aiohttp
+
+log = logging.getLogger(__name__)
+
+
+def _env_int(name: str, default: int) -> int:
+    val = os.getenv(name)
+    if val and val.strip().isdigit():
+        return int(val)
+    return default
+
+
+POOL_LIMIT = _env_int("HTTP_POOL_LIMIT", 100)
+POOL_LIMIT_PER_HOST = _env_int("HTTP_POOL_LIMIT_PER_HOST", 8)
+DNS_CACHE_TTL = _env_int("HTTP_DNS_CACHE_TTL", 300)
+KEEPALIVE_TIMEOUT = _env_int("HTTP_KEEPALIVE_TIMEOUT", 60)
+
+_session: Optional[aiohttp.ClientSession] = None
+
+_stats: Dict[str, int] = {
+    "requests": 0,
+    "request_errors": 0,
+    "connections_created": 0,
+    "connections_reused": 0,
+    "connection_queued": 0,
+    "dns_cache_hits": 0,
+    "dns_cache_misses": 0,
+}
+
+
+def _trace_config() -> aiohttp.TraceConfig:
+    tc = aiohttp.TraceConfig()
+
+    def _count(key: str):
+        async def _hook(session, ctx, params):
+            _stats[key] += 1
+        return _hook
+
+    tc.on_request_start.append(_count("requests"))
+    tc.on_request_exception.append(_count("request_errors"))
+    tc.on_connection_create_end.append(_count("connections_created"))
+    tc.on_connection_reuseconn.append(_count("connections_reused"))
+    tc.on_connection_queued_start.append(_count("connection_queued"))
+    tc.on_dns_cache_hit.append(_count("dns_cache_hits"))
+    tc.on_dns_cache_miss.append(_count("dns_cache_misses"))
+    return tc
+
+
+def _new_session() -> aiohttp.ClientSession:
+    connector = aiohttp.TCPConnector(
+        limit=POOL_LIMIT,
+        limit_per_host=POOL_LIMIT_PER_HOST,
+        ttl_dns_cache=DNS_CACHE_TTL,
+        keepalive_timeout=KEEPALIVE_TIMEOUT,
+        enable_cleanup_closed=True,
+    )
+    return aiohttp.ClientSession(
+        connector=connector,
+        # Never share cookies between unrelated hosts; callers that need a
+        # cookie (AnimePahe's DDoS-Guard one) pass it as a header.
+        cookie_jar=aiohttp.DummyCookieJar(),
+        trace_configs=[_trace_config()],
+    )
+
+
+def session() -> aiohttp.ClientSession:
+    """Return the shared session. Must be called from inside the event loop."""
+    global _session
+    if _session is None or _session.closed:
+        _session = _new_session()
+    return _session
+
+
+async def start() -> aiohttp.ClientSession:
+    """Create the shared session up front (idempotent)."""
+    s = session()
+    log.info(
+        "HTTP pool started (limit=%d, per_host=%d, dns_ttl=%ds)",
+        POOL_LIMIT, POOL_LIMIT_PER_HOST, DNS_CACHE_TTL,
+    )
+    return s
+
+
+async def close() -> None:
+    global _session
+    if _session is not None and not _session.closed:
+        log.info("HTTP pool closing: %s", stats())
+        await _session.close()
+    _session = None
+
+
+def stats() -> Dict[str, float]:
+    """Counters since startup, plus the derived connection reuse ratio."""
+    out: Dict[str, float] = dict(_stats)
+    opened = _stats["connections_created"] + _stats["connections_reused"]
+    out["connection_reuse_ratio"] = (
+        round(_stats["connections_reused"] / opened, 3) if opened else 0.0
+    )
+    out["limit"] = POOL_LIMIT
+    out["limit_per_host"] = POOL_LIMIT_PER_HOST
+    return out
@@ -0,0 +1,147 @@
+"""Poster / fanart preparation for Telegram, off the event loop.
+
+Decoding a 4K fanart, LANCZOS-resizing it and re-encoding a JPEG takes
+hundreds of milliseconds of pure CPU, which used to block every other
+handler. prepare() does that work and runs in a small process pool via
+resize_for_telegram(). It also does less work where it can:
+  * images that already fit Telegram's limits (JPEG, dimensions, byte
+    budget) are passed through untouched, with no decode/re-encode;
+  * big JPEGs are decoded with Pillow's draft mode, which lets libjpeg
+    scale by 1/2, 1/4 or 1/8 while decoding, so we never hold the full
+    4K bitmap when the target is much smaller;
+  * the output is kept under a byte budget by lowering JPEG quality, then
+    the size, if needed.
+"""
+from __future__ import annotations
+
+import asyncio
+import io
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional, Tuple
+
+from PIL import Image
+
+log = logging.getLogger(__name__)
+
+MAX_PHOTO_SIDE = 2560   # Telegram rejects photos with any side > this
+MAX_PHOTO_SUM = 9500    # Telegram rejects when width + height exceeds ~10000
+MAX_PHOTO_BYTES = int(os.getenv("IMAGE_MAX_BYTES", str(5 * 1_048_576)) or 5 * 1_048_576)
+WORKERS = max(1, int(os.getenv("IMAGE_WORKERS", "1") or 1))
+
+_QUALITY_STEPS = (92, 85, 78, 70, 60)
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _target_scale(w: int, h: int) -> float:
+    scale = 1.0
+    if w > MAX_PHOTO_SIDE or h > MAX_PHOTO_SIDE:
+        scale = min(MAX_PHOTO_SIDE / w, MAX_PHOTO_SIDE / h)
+    if (w * scale) + (h * scale) > MAX_PHOTO_SUM:
+        scale = min(scale, MAX_PHOTO_SUM / (w + h))
+    return scale
+
+
+def _encode(img: Image.Image, max_bytes: int) -> bytes:
+    """JPEG-encode, stepping quality (then size) down until under max_bytes."""
+    while True:
+        for quality in _QUALITY_STEPS:
+            buf = io.BytesIO()
+            img.save(buf, format="JPEG", quality=quality, optimize=quality < 92)
+            if buf.tell() <= max_bytes:
+                return buf.getvalue()
+        w, h = img.size
+        if w < 64 or h < 64:
+            return buf.getvalue()
+        img = img.resize((max(1, int(w * 0.75)), max(1, int(h * 0.75))), Image.LANCZOS)
+
+
+def prepare(raw: bytes, max_bytes: int = MAX_PHOTO_BYTES) -> Tuple[bytes, Tuple[int, int], Tuple[int, int], bool]:
+    """
+    Make `raw` acceptable as a Telegram photo:
+      - neither side exceeds 2560 px
+      - width + height < 9500
+      - at most `max_bytes` bytes
+    Returns (jpeg_bytes, original_size, new_size, reencoded). Runs in a worker
+    process, so it must stay a plain top-level function.
+    """
+    img = Image.open(io.BytesIO(raw))
+    w, h = img.size
+    scale = _target_scale(w, h)
+
+    if scale >= 1.0 and img.format == "JPEG" and img.mode in ("RGB", "L") and len(raw) <= max_bytes:
+        return raw, (w, h), (w, h), False
+
+    new_w, new_h = max(1, int(w * scale)), max(1, int(h * scale))
+    if img.format == "JPEG" and scale < 1.0:
+        # libjpeg picks the largest 1/n scale that is still >= the request.
+        img.draft("RGB", (new_w, new_h))
+    img = img.convert("RGB")
+    if img.size != (new_w, new_h) and scale < 1.0:
+        img = img.resize((new_w, new_h), Image.LANCZOS)
+    return _encode(img, max_bytes), (w, h), img.size, True
+
+
+def _noop() -> None:
+    return None
+
+
+def _mp_context():
+    # Never fork the bot itself: by the time a broken pool is rebuilt it has
+    # threads (to_thread calls, the AnimeKAI race executor), and forking a
+    # threaded process can deadlock the child. forkserver forks workers from
+    # a clean single-threaded server; spawn where that isn't available.
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return multiprocessing.get_context(method)
+
+
+def _executor() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=WORKERS, mp_context=_mp_context())
+    return _pool
+
+
+def _discard(pool: ProcessPoolExecutor) -> None:
+    """Shut a broken pool down; the next _executor() call builds a new one."""
+    global _pool
+    if _pool is pool:
+        _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def start() -> None:
+    """Start the worker processes now (call first thing in main())."""
+    _executor().submit(_noop).result()
+
+
+async def resize_for_telegram(raw: bytes) -> io.BytesIO:
+    """Run prepare() in the process pool and return a ready-to-send BytesIO."""
+    loop = asyncio.get_running_loop()
+    pool = _executor()
+    try:
+        result = await loop.run_in_executor(pool, prepare, raw, MAX_PHOTO_BYTES)
+    except BrokenProcessPool:
+        # A worker died (OOM on a huge image, ...); rebuild the pool once.
+        log.warning("Image worker pool broke; restarting it")
+        _discard(pool)
+        result = await loop.run_in_executor(_executor(), prepare, raw, MAX_PHOTO_BYTES)
+    data, (w, h), (new_w, new_h), reencoded = result
+    if not reencoded:
+        log.info("Image %dx%d already Telegram-safe, sending as-is", w, h)
+    elif (w, h) != (new_w, new_h):
+        log.info("Resized image %dx%d → %dx%d for Telegram (%d KB)", w, h, new_w, new_h, len(data) // 1024)
+    buf = io.BytesIO(data)
+    buf.name = "poster.jpg"
+    return buf
+
+
+def shutdown() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
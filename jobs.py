@@ -0,0 +1,307 @@
+"""Durable job queue and worker pool for long-running bot commands.
+
+/anime used to run its whole pipeline inside the Telegram handler, so
+nothing survived a restart and there was no cap on parallel work. Now the
+handler only enqueues a Job; a fixed number of worker coroutines pull jobs
+from a SQLite-backed queue (under DATA_DIR) and run them.
+
+  * Job state (queued → running → done / failed) is persisted, so admins
+    can query it and jobs that were running when the process died are put
+    back on the queue at startup (up to JOB_MAX_ATTEMPTS runs in all).
+  * Handlers record finished steps with JobQueue.mark_done(), so a
+    requeued job can skip work it already did (Job.is_done()).
+  * stage(name) is a per-stage concurrency limit shared by all workers
+    (metadata, resolve, download, upload), so e.g. three workers can fetch
+    metadata while only one uploads.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional
+
+log = logging.getLogger(__name__)
+
+DATA_DIR = os.getenv("DATA_DIR", "data")
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+_DEFAULT_STAGE_LIMITS = {"metadata": 4, "resolve": 2, "download": 2, "upload": 1}
+
+
+def _parse_stage_limits(raw: Optional[str]) -> Dict[str, int]:
+    """JOB_STAGE_LIMITS looks like "metadata=4,resolve=2,download=2,upload=1"."""
+    limits = dict(_DEFAULT_STAGE_LIMITS)
+    for part in (raw or "").split(","):
+        name, _, value = part.partition("=")
+        if name.strip() and value.strip().isdigit() and int(value) > 0:
+            limits[name.strip()] = int(value)
+    return limits
+
+
+STAGE_LIMITS = _parse_stage_limits(os.getenv("JOB_STAGE_LIMITS"))
+# A job interrupted this many times (crash, restart) is failed, not requeued.
+MAX_ATTEMPTS = max(1, int(os.getenv("JOB_MAX_ATTEMPTS", "3") or 3))
+_stage_semaphores: Dict[str, asyncio.Semaphore] = {}
+
+
+@asynccontextmanager
+async def stage(name: str):
+    """Hold one slot of the named stage's concurrency limit."""
+    sem = _stage_semaphores.get(name)
+    if sem is None:
+        sem = _stage_semaphores[name] = asyncio.Semaphore(STAGE_LIMITS.get(name, 1))
+    async with sem:
+        yield
+
+
+class JobFailed(Exception):
+    """Raised by a handler that already reported its failure to the user."""
+
+
+@dataclass
+class Job:
+    id: int
+    kind: str
+    params: dict
+    state: str = QUEUED
+    stage: str = ""
+    chat_id: Optional[int] = None
+    status_message_id: Optional[int] = None
+    reply_to_message_id: Optional[int] = None
+    error: str = ""
+    attempts: int = 0
+    created: float = field(default_factory=time.time)
+    updated: float = field(default_factory=time.time)
+
+    def is_done(self, step: str) -> bool:
+        """Whether an earlier attempt already finished `step` (see mark_done)."""
+        return step in self.params.get("done", ())
+
+
+class JobStore:
+    """SQLite persistence for jobs. All methods are quick, synchronous calls."""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.path.join(DATA_DIR, "jobs.sqlite3")
+        parent = os.path.dirname(self.path)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " kind TEXT NOT NULL, params TEXT NOT NULL,"
+            " state TEXT NOT NULL, stage TEXT NOT NULL DEFAULT '',"
+            " chat_id INTEGER, status_message_id INTEGER, reply_to_message_id INTEGER,"
+            " error TEXT NOT NULL DEFAULT '', attempts INTEGER NOT NULL DEFAULT 0,"
+            " created REAL NOT NULL, updated REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id)")
+
+    _COLUMNS = (
+        "id, kind, params, state, stage, chat_id, status_message_id,"
+        " reply_to_message_id, error, attempts, created, updated"
+    )
+
+    @staticmethod
+    def _row_to_job(row) -> Job:
+        return Job(
+            id=row[0], kind=row[1], params=json.loads(row[2]), state=row[3],
+            stage=row[4], chat_id=row[5], status_message_id=row[6],
+            reply_to_message_id=row[7], error=row[8], attempts=row[9],
+            created=row[10], updated=row[11],
+        )
+
+    def add(
+        self, kind: str, params: dict, chat_id: Optional[int] = None,
+        status_message_id: Optional[int] = None,
+        reply_to_message_id: Optional[int] = None,
+    ) -> Job:
+        now = time.time()
+        with self._lock:
+            cur = self._db.execute(
+                "INSERT INTO jobs (kind, params, state, chat_id, status_message_id,"
+                " reply_to_message_id, created, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (kind, json.dumps(params), QUEUED, chat_id, status_message_id,
+                 reply_to_message_id, now, now),
+            )
+            job_id = cur.lastrowid
+        return self.get(job_id)
+
+    def get(self, job_id: int) -> Optional[Job]:
+        with self._lock:
+            row = self._db.execute(
+                f"SELECT {self._COLUMNS} FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def claim_next(self) -> Optional[Job]:
+        """Atomically move the oldest queued job to running and return it."""
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                f"SELECT {self._COLUMNS} FROM jobs WHERE state = ? ORDER BY id LIMIT 1",
+                (QUEUED,),
+            ).fetchone()
+            if row is None:
+                return None
+            self._db.execute(
+                "UPDATE jobs SET state = ?, attempts = attempts + 1, updated = ? WHERE id = ?",
+                (RUNNING, now, row[0]),
+            )
+        job = self._row_to_job(row)
+        job.state = RUNNING
+        job.attempts += 1
+        return job
+
+    def update(self, job_id: int, **fields) -> None:
+        allowed = {"state", "stage", "error", "params", "status_message_id"}
+        sets = {k: v for k, v in fields.items() if k in allowed}
+        if "params" in sets:
+            sets["params"] = json.dumps(sets["params"])
+        if not sets:
+            return
+        sets["updated"] = time.time()
+        cols = ", ".join(f"{k} = ?" for k in sets)
+        with self._lock:
+            self._db.execute(
+                f"UPDATE jobs SET {cols} WHERE id = ?", (*sets.values(), job_id)
+            )
+
+    def requeue_running(self, max_attempts: int = MAX_ATTEMPTS) -> List[Job]:
+        """
+        Put jobs that were running when we last stopped back on the queue.
+        Jobs that have already been started `max_attempts` times are failed
+        instead. Returns all of them, with their new state.
+        """
+        now = time.time()
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT {self._COLUMNS} FROM jobs WHERE state = ?", (RUNNING,)
+            ).fetchall()
+            self._db.execute(
+                "UPDATE jobs SET state = ?, stage = '', updated = ? WHERE state = ? AND attempts < ?",
+                (QUEUED, now, RUNNING, max_attempts),
+            )
+            self._db.execute(
+                "UPDATE jobs SET state = ?, error = ?, updated = ? WHERE state = ?",
+                (FAILED, "interrupted too many times", now, RUNNING),
+            )
+        jobs = [self._row_to_job(r) for r in rows]
+        for job in jobs:
+            if job.attempts < max_attempts:
+                job.state, job.stage = QUEUED, ""
+            else:
+                job.state, job.error = FAILED, "interrupted too many times"
+        return jobs
+
+    def recent(self, limit: int = 10) -> List[Job]:
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT {self._COLUMNS} FROM jobs ORDER BY id DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [self._row_to_job(r) for r in rows]
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT state, COUNT(*) FROM jobs GROUP BY state"
+            ).fetchall()
+        return dict(rows)
+
+
+JobHandler = Callable[[Job], Awaitable[None]]
+
+
+class JobQueue:
+    """A JobStore plus N worker coroutines that run jobs through handlers."""
+
+    def __init__(self, store: JobStore, workers: int = 2):
+        self.store = store
+        self.workers = max(1, workers)
+        self._handlers: Dict[str, JobHandler] = {}
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+
+    def register(self, kind: str, handler: JobHandler) -> None:
+        self._handlers[kind] = handler
+
+    def submit(self, kind: str, params: dict, **kwargs) -> Job:
+        job = self.store.add(kind, params, **kwargs)
+        self._wakeup.set()
+        return job
+
+    def set_stage(self, job: Job, name: str) -> None:
+        job.stage = name
+        self.store.update(job.id, stage=name)
+
+    def mark_done(self, job: Job, step: str) -> None:
+        """Persist that `step` of `job` is finished, for a requeued attempt to skip."""
+        done = job.params.setdefault("done", [])
+        if step not in done:
+            done.append(step)
+            self.store.update(job.id, params=job.params)
+
+    async def start(self) -> List[Job]:
+        """
+        Requeue interrupted jobs and start the workers. Returns the
+        interrupted jobs: QUEUED if requeued, FAILED if out of attempts.
+        """
+        interrupted = self.store.requeue_running()
+        requeued = [j.id for j in interrupted if j.state == QUEUED]
+        given_up = [j.id for j in interrupted if j.state == FAILED]
+        if requeued:
+            log.info("Requeued %d interrupted job(s): %s", len(requeued), requeued)
+        if given_up:
+            log.warning("Failed %d job(s) interrupted too many times: %s", len(given_up), given_up)
+        for i in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(i)))
+        self._wakeup.set()
+        log.info("Job queue started with %d worker(s), stage limits %s", self.workers, STAGE_LIMITS)
+        return interrupted
+
+    async def stop(self) -> None:
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    async def _worker(self, n: int) -> None:
+        while True:
+            job = self.store.claim_next()
+            if job is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            # Other idle workers may be able to pick up the next job too.
+            self._wakeup.set()
+            handler = self._handlers.get(job.kind)
+            if handler is None:
+                self.store.update(job.id, state=FAILED, error=f"no handler for {job.kind!r}")
+                continue
+            log.info("Worker %d running job #%d (%s)", n, job.id, job.kind)
+            try:
+                await handler(job)
+            except asyncio.CancelledError:
+                # Shutdown: leave it as running so the next start requeues it.
+                raise
+            except JobFailed as e:
+                self.store.update(job.id, state=FAILED, error=str(e)[:500])
+            except Exception as e:
+                log.exception("Job #%d failed", job.id)
+                self.store.update(job.id, state=FAILED, error=str(e)[:500])
+            else:
+                self.store.update(job.id, state=DONE, stage="")
@@ -0,0 +1,177 @@
+"""Persistent Node sidecar for unpacking kwik embed scripts.
+
+The m3u8 behind a kwik embed is only revealed by evaluating the page's
+packed JavaScript. One long-lived worker (kwik_worker.js) does that for
+the whole bot; scripts are fed to it over a JSON-lines protocol on
+stdin / stdout:
+
+    out = await kwik.unpack(script)
+
+Requests are matched to replies by id, so several callers can have scripts
+in flight at once. If the worker exits or stops answering, pending calls
+fail with KwikError and the next call starts a new worker (restarts are
+counted in kwik_restarts_total).
+
+start() is called from main() and shutdown() on exit; unpack() lazily
+starts the worker too, so it also works outside the bot.
+"""
+from __future__ import annotations
+
+import asyncio
+import itertools
+import json
+import logging
+import os
+from typing import Dict, Optional
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+NODE = os.getenv("ANIMEPAHE_DL_NODE") or "node"
+WORKER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "kwik_worker.js")
+# Don't respawn a crash-looping worker more often than this (seconds).
+_RESTART_BACKOFF = 1.0
+
+
+class KwikError(Exception):
+    pass
+
+
+class Sidecar:
+    def __init__(self, node: str = NODE, worker: str = WORKER):
+        self.node = node
+        self.worker = worker
+        self._proc: Optional[asyncio.subprocess.Process] = None
+        self._reader: Optional[asyncio.Task] = None
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._ids = itertools.count(1)
+        self._lock = asyncio.Lock()
+        self._started_at = 0.0
+        self._starts = 0
+
+    @property
+    def running(self) -> bool:
+        return self._proc is not None and self._proc.returncode is None
+
+    async def start(self) -> None:
+        async with self._lock:
+            await self._ensure()
+
+    async def _ensure(self) -> asyncio.subprocess.Process:
+        if self.running:
+            return self._proc
+        loop = asyncio.get_running_loop()
+        wait = self._started_at + _RESTART_BACKOFF - loop.time()
+        if self._starts and wait > 0:
+            await asyncio.sleep(wait)
+        self._proc = await asyncio.create_subprocess_exec(
+            self.node, self.worker,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        if self._starts:
+            metrics.inc("kwik_restarts_total")
+            log.warning("kwik worker restarted (pid %s)", self._proc.pid)
+        else:
+            log.info("kwik worker started (pid %s)", self._proc.pid)
+        self._starts += 1
+        self._started_at = loop.time()
+        self._reader = asyncio.create_task(self._read(self._proc))
+        return self._proc
+
+    async def _read(self, proc: asyncio.subprocess.Process) -> None:
+        try:
+            while True:
+                line = await proc.stdout.readline()
+                if not line:
+                    break
+                try:
+                    reply = json.loads(line)
+                except ValueError:
+                    log.warning("kwik worker: bad reply %r", line[:200])
+                    continue
+                fut = self._pending.pop(reply.get("id"), None)
+                if fut is None or fut.done():
+                    continue
+                if "error" in reply:
+                    fut.set_exception(KwikError(reply["error"]))
+                else:
+                    fut.set_result(reply.get("out") or "")
+        finally:
+            if proc.returncode is None:
+                proc.kill()
+            await proc.wait()
+            if self._proc is proc:
+                log.warning("kwik worker exited (rc=%s)", proc.returncode)
+            self._fail_pending(KwikError("kwik worker exited"))
+
+    def _fail_pending(self, exc: Exception) -> None:
+        pending, self._pending = self._pending, {}
+        for fut in pending.values():
+            if not fut.done():
+                fut.set_exception(exc)
+
+    async def unpack(self, script: str, timeout: float = 10.0) -> str:
+        """Run one unpacker script in the worker and return what it logged."""
+        req_id = next(self._ids)
+        fut = asyncio.get_running_loop().create_future()
+        async with self._lock:
+            proc = await self._ensure()
+            self._pending[req_id] = fut
+            try:
+                proc.stdin.write(json.dumps({"id": req_id, "script": script}).encode() + b"\n")
+                await proc.stdin.drain()
+            except (BrokenPipeError, ConnectionResetError) as e:
+                self._pending.pop(req_id, None)
+                raise KwikError(f"kwik worker unavailable: {e}") from e
+        try:
+            return await asyncio.wait_for(fut, timeout=timeout)
+        except asyncio.TimeoutError:
+            # A worker that doesn't answer is replaced rather than trusted.
+            self._pending.pop(req_id, None)
+            if self._proc is proc and proc.returncode is None:
+                proc.kill()
+            raise KwikError("kwik worker timed out") from None
+
+    async def close(self) -> None:
+        proc, self._proc = self._proc, None
+        if proc is not None and proc.returncode is None:
+            proc.stdin.close()
+            try:
+                await asyncio.wait_for(proc.wait(), timeout=5.0)
+            except asyncio.TimeoutError:
+                proc.kill()
+        if self._reader is not None:
+            await asyncio.gather(self._reader, return_exceptions=True)
+            self._reader = None
+
+
+_sidecar: Optional[Sidecar] = None
+
+
+def _get() -> Sidecar:
+    global _sidecar
+    if _sidecar is None:
+        _sidecar = Sidecar()
+    return _sidecar
+
+
+async def start() -> None:
+    try:
+        await _get().start()
+    except OSError as e:
+        # No node here: animepahe falls back to AnimeKAI per episode.
+        log.warning("kwik worker not started: %s", e)
+
+
+async def unpack(script: str, timeout: float = 10.0) -> str:
+    return await _get().unpack(script, timeout)
+
+
+async def shutdown() -> None:
+    global _sidecar
+    if _sidecar is not None:
+        await _sidecar.close()
+        _sidecar = None
@@ -0,0 +1,45 @@
+// Long-lived kwik unpacker for kwik.py.
+//
+// Reads one JSON request per line on stdin:   {"id": 1, "script": "..."}
+// and answers with one JSON line on stdout:   {"id": 1, "out": "..."}
+//                                         or  {"id": 1, "error": "..."}
+//
+// `script` is the kwik page's packed script with eval( rewritten to
+// console.log( (see animepahe._unpacker_script); whatever it logs is
+// returned as `out`. Each script runs in a fresh vm context with a time
+// limit, so a bad page can't hang or pollute the worker.
+"use strict";
+
+const readline = require("readline");
+const vm = require("vm");
+
+const TIMEOUT_MS = parseInt(process.env.KWIK_SCRIPT_TIMEOUT_MS || "2000", 10);
+
+function run(script) {
+  const out = [];
+  const log = (...args) => out.push(args.map(String).join(" "));
+  const sandbox = {
+    console: { log, info: log, warn: () => {}, error: () => {} },
+    process: { exit: () => {} },
+  };
+  vm.runInNewContext(script, sandbox, { timeout: TIMEOUT_MS });
+  return out.join("\n");
+}
+
+const rl = readline.createInterface({ input: process.stdin, terminal: false });
+
+rl.on("line", (line) => {
+  if (!line.trim()) return;
+  let id = null;
+  let reply;
+  try {
+    const req = JSON.parse(line);
+    id = req.id;
+    reply = { id, out: run(String(req.script || "")) };
+  } catch (e) {
+    reply = { id, error: String((e && e.message) || e) };
+  }
+  process.stdout.write(JSON.stringify(reply) + "\n");
+});
+
+rl.on("close", () => process.exit(0));
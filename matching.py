@@ -0,0 +1,138 @@
+"""Title matching shared by the metadata sources and the stream resolvers.
+
+bot.py used to carry two copies of the same scorer (_title_score for
+AnimeKAI / AnimePahe results, _best_title_score for Jikan / AniList /
+Kitsu), and both re-ran the regex normalization and re-tokenized the query
+for every candidate title and every sort key. TitleMatcher does that once:
+
+    m = TitleMatcher("demon slayer", aliases=aliases)
+    ranked = m.rank(results, titles=lambda r: [r.title])
+    best_score, best = ranked[0]
+
+  * the query (plus any known aliases of it) is normalized and tokenized
+    when the matcher is built;
+  * candidate titles are normalized through an LRU cache shared by all
+    matchers, so the same AnimeKAI / Jikan titles seen across requests
+    are only tokenized once;
+  * rank() scores each item exactly once instead of once per sort
+    comparison key plus once more for the winner.
+
+AliasIndex remembers which titles name the same show (English, romaji,
+synonyms, ... as reported by the metadata sources), so a query like
+"Kimetsu no Yaiba" can still match an AnimeKAI result titled "Demon
+Slayer". It is persisted in the shared TTL cache.
+"""
+from __future__ import annotations
+
+import functools
+import re
+from typing import Callable, FrozenSet, Iterable, List, Optional, Sequence, Tuple, TypeVar
+
+import cache
+
+T = TypeVar("T")
+
+ALIAS_TTL = 30 * 24 * 3600
+
+_NON_ALNUM = re.compile(r"[^a-z0-9]+")
+
+# Obvious spin-off / side content markers the user almost certainly didn't ask for
+SPINOFF_MARKERS = (
+    "arc", "movie", "ova", "ona", "special", "specials",
+    "recap", "side story", "the movie",
+)
+
+
+def normalize(s: str) -> str:
+    """Lowercase + strip non-alphanumerics for fuzzy title comparison."""
+    return _NON_ALNUM.sub(" ", s.lower()).strip()
+
+
+@functools.lru_cache(maxsize=8192)
+def _prepare(title: str) -> Tuple[str, FrozenSet[str]]:
+    norm = normalize(title)
+    return norm, frozenset(norm.split())
+
+
+class AliasIndex:
+    """Groups of titles known to name the same show, keyed by normalized title."""
+
+    def __init__(self, store: Optional[cache.TTLCache] = None):
+        self._store = store if store is not None else cache.TTLCache("title-aliases", max_entries=5000)
+
+    def add(self, titles: Iterable[str]) -> None:
+        """Record that all of `titles` refer to the same show."""
+        group = {_prepare(t)[0] for t in titles if t}
+        group.discard("")
+        if len(group) < 2:
+            return
+        for norm in group:
+            known = set(self._store.get(norm) or [])
+            if not group - {norm} <= known:
+                self._store.set(norm, sorted(known | (group - {norm})), ttl=ALIAS_TTL)
+
+    def get(self, title: str) -> List[str]:
+        """Normalized aliases of `title` (not including itself)."""
+        norm = _prepare(title)[0]
+        return list(self._store.get(norm) or []) if norm else []
+
+
+class TitleMatcher:
+    """
+    Scores candidate titles against one query. Higher = better:
+      - token overlap (fraction of query tokens present),
+      - +1.0 for an exact match, +0.5 when the candidate starts with the query,
+      - -0.4 for spin-off markers the query doesn't mention (if spinoff_penalty),
+      - -0.05 per extra candidate token beyond two.
+    With an AliasIndex, each candidate is scored against the query and every
+    known alias of it, keeping the best.
+    """
+
+    def __init__(self, query: str, spinoff_penalty: bool = True, aliases: Optional[AliasIndex] = None):
+        self.query = query
+        self.spinoff_penalty = spinoff_penalty
+        variants = [_prepare(query)]
+        if aliases is not None:
+            variants += [_prepare(a) for a in aliases.get(query)]
+        self._variants = [(q, qt) for q, qt in variants if q and qt]
+
+    def _score_one(self, q: str, q_tokens: FrozenSet[str], c: str, c_tokens: FrozenSet[str]) -> float:
+        score = len(q_tokens & c_tokens) / len(q_tokens)
+        if q == c:
+            score += 1.0
+        elif c.startswith(q):
+            score += 0.5
+        if self.spinoff_penalty:
+            for marker in SPINOFF_MARKERS:
+                if marker in c and marker not in q:
+                    score -= 0.4
+                    break
+        score -= 0.05 * max(0, len(c_tokens - q_tokens) - 2)
+        return score
+
+    def score(self, candidate: str) -> float:
+        if not candidate:
+            return 0.0
+        c, c_tokens = _prepare(candidate)
+        if not c:
+            return 0.0
+        return max((self._score_one(q, qt, c, c_tokens) for q, qt in self._variants), default=0.0)
+
+    def best_score(self, candidates: Iterable[str]) -> float:
+        """Best score across all title variants of one candidate (0.0 if none)."""
+        return max((self.score(t) for t in candidates if t), default=0.0)
+
+    def score_many(self, candidates: Sequence[str]) -> List[float]:
+        return [self.score(c) for c in candidates]
+
+    def rank(self, items: Iterable[T], titles: Callable[[T], Iterable[str]]) -> List[Tuple[float, T]]:
+        """
+        Score every item once (best over titles(item)) and return
+        (score, item) pairs, best first. Ties keep the input order.
+        """
+        scored = [(self.best_score(titles(item)), item) for item in items]
+        scored.sort(key=lambda pair: pair[0], reverse=True)
+        return scored
+
+
+aliases = AliasIndex()
@@ -0,0 +1,159 @@
+"""Tiny Prometheus-style metrics registry.
+
+No client library: counters, gauges and histograms are kept in plain dicts
+and rendered in the Prometheus text exposition format by render(), which
+bot.py serves at /metrics.
+
+Instrumentation API (safe to call from the event loop or worker threads):
+
+    metrics.inc("upload_bytes_total", size)
+    metrics.observe("metadata_seconds", 0.42, source="jikan")
+    with metrics.timer("animekai_seconds", op="search"):
+        ...
+
+timer() also bumps stage_errors_total{stage=...} if the block raises; code
+that reports failure by return value can call metrics.error(stage) itself.
+Every metric name gets the PREFIX below.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+PREFIX = "animebot_"
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+# Known metrics: name → (type, help, buckets). Unknown names still work and
+# are exported with a generic help line.
+_SPECS: Dict[str, Tuple[str, str, Optional[tuple]]] = {
+    "metadata_seconds": ("histogram", "Metadata lookup latency per source.", DEFAULT_BUCKETS),
+    "wallhaven_seconds": ("histogram", "Wallhaven search latency per tier.", DEFAULT_BUCKETS),
+    "animekai_seconds": ("histogram", "AnimeKAI call latency per operation.", DEFAULT_BUCKETS),
+    "animepahe_seconds": ("histogram", "AnimePahe call latency per operation.", DEFAULT_BUCKETS),
+    "download_seconds": ("histogram", "Episode download time per source.", DEFAULT_BUCKETS),
+    "ffmpeg_seconds": ("histogram", "ffmpeg run time per operation.", DEFAULT_BUCKETS),
+    "upload_seconds": ("histogram", "Telegram upload time.", DEFAULT_BUCKETS),
+    "upload_bytes_total": ("counter", "Bytes uploaded to Telegram.", None),
+    "upload_pool_bytes_total": ("counter", "Bytes uploaded by extra upload sessions, per session.", None),
+    "upload_reused_total": ("counter", "Episodes reposted from the upload index instead of re-uploaded.", None),
+    "hls_resumed_bytes_total": ("counter", "Bytes of partial HLS downloads kept on resume instead of re-fetched.", None),
+    "kwik_restarts_total": ("counter", "Restarts of the kwik unpacker worker.", None),
+    "kwik_memo_hits_total": ("counter", "kwik links answered from the memo instead of decoded.", None),
+    "download_bytes_total": ("counter", "Bytes downloaded, by source, as they arrive.", None),
+    "stage_errors_total": ("counter", "Errors by pipeline stage.", None),
+    "downloads_active": ("gauge", "Downloads in progress.", None),
+    "download_speed_bytes": ("gauge", "Combined speed of the downloads in progress (bytes/s).", None),
+    "http_pool": ("gauge", "Shared HTTP pool counters (see httppool.stats).", None),
+    "jobs": ("gauge", "Jobs by state.", None),
+    "animekai_server_success_rate": ("gauge", "EWMA success rate per AnimeKAI server.", None),
+    "metadata_timeout_seconds": ("gauge", "Current adaptive timeout per metadata source.", None),
+    "animekai_server_latency_seconds": ("gauge", "EWMA time-to-result per AnimeKAI server.", None),
+}
+
+_lock = threading.Lock()
+_counters: Dict[str, Dict[tuple, float]] = {}
+_gauges: Dict[str, Dict[tuple, float]] = {}
+# name → labels → [bucket counts..., sum, count]
+_histograms: Dict[str, Dict[tuple, List[float]]] = {}
+
+
+def _key(labels: Dict[str, object]) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _buckets(name: str) -> tuple:
+    spec = _SPECS.get(name)
+    return (spec[2] if spec and spec[2] else None) or DEFAULT_BUCKETS
+
+
+def inc(name: str, amount: float = 1.0, **labels) -> None:
+    with _lock:
+        series = _counters.setdefault(name, {})
+        k = _key(labels)
+        series[k] = series.get(k, 0.0) + amount
+
+
+def set_gauge(name: str, value: float, **labels) -> None:
+    with _lock:
+        _gauges.setdefault(name, {})[_key(labels)] = float(value)
+
+
+def observe(name: str, value: float, **labels) -> None:
+    buckets = _buckets(name)
+    with _lock:
+        series = _histograms.setdefault(name, {})
+        k = _key(labels)
+        h = series.get(k)
+        if h is None:
+            h = series[k] = [0.0] * (len(buckets) + 2)
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                h[i] += 1
+        h[-2] += value
+        h[-1] += 1
+
+
+def error(stage: str) -> None:
+    inc("stage_errors_total", stage=stage)
+
+
+@contextmanager
+def timer(name: str, stage: Optional[str] = None, **labels):
+    """Observe the block's wall time into histogram `name`.
+
+    On an exception the time is still recorded and stage_errors_total is
+    bumped for `stage` (default: the metric name plus its label values).
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        # Cancellation is not an error (e.g. a losing hedged request).
+        error(stage or ".".join([name.replace("_seconds", "")] + [str(v) for v in labels.values()]))
+        raise
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def _fmt_labels(k: tuple, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(k) + ([extra] if extra else [])
+    if not items:
+        return ""
+    body = ",".join(
+        '{}="{}"'.format(n, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for n, v in items
+    )
+    return "{" + body + "}"
+
+
+def _header(lines: List[str], name: str, kind: str) -> None:
+    spec = _SPECS.get(name)
+    lines.append(f"# HELP {PREFIX}{name} {spec[1] if spec else name}")
+    lines.append(f"# TYPE {PREFIX}{name} {kind}")
+
+
+def render() -> str:
+    """All metrics in Prometheus text format."""
+    lines: List[str] = []
+    with _lock:
+        for name, series in sorted(_counters.items()):
+            _header(lines, name, "counter")
+            for k, v in series.items():
+                lines.append(f"{PREFIX}{name}{_fmt_labels(k)} {v:g}")
+        for name, series in sorted(_gauges.items()):
+            _header(lines, name, "gauge")
+            for k, v in series.items():
+                lines.append(f"{PREFIX}{name}{_fmt_labels(k)} {v:g}")
+        for name, series in sorted(_histograms.items()):
+            _header(lines, name, "histogram")
+            buckets = _buckets(name)
+            for k, h in series.items():
+                for bound, n in zip(buckets, h):
+                    lines.append(f"{PREFIX}{name}_bucket{_fmt_labels(k, ('le', f'{bound:g}'))} {n:g}")
+                lines.append(f"{PREFIX}{name}_bucket{_fmt_labels(k, ('le', '+Inf'))} {h[-1]:g}")
+                lines.append(f"{PREFIX}{name}_sum{_fmt_labels(k)} {h[-2]:.6f}")
+                lines.append(f"{PREFIX}{name}_count{_fmt_labels(k)} {h[-1]:g}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,63 @@
+"""Telegram file_id store for posters.
+
+Posting the same artwork again (weekly episodes, re-posts) used to mean
+downloading the image, resizing it and uploading the bytes every time.
+Once Telegram has the photo, its file_id can be sent instead. We remember
+file_ids in cache.py, content-addressed:
+
+    source URL  → sha256 of the downloaded bytes
+    sha256      → Telegram photo file_id
+
+The URL map lets a repeat post skip even the download. The hash map catches
+the same image served from a different URL (AniList vs Kitsu mirrors, CDN
+query strings, ...). Callers must still handle Telegram rejecting an old
+file_id: forget() it and upload again.
+"""
+from __future__ import annotations
+
+import hashlib
+import logging
+from typing import Optional
+
+import cache
+
+log = logging.getLogger(__name__)
+
+# file_ids don't expire on Telegram's side; the TTL only bounds stale rows.
+TTL = 180 * 24 * 3600
+
+_by_url = cache.TTLCache("poster-url", max_entries=5000)
+_by_hash = cache.TTLCache("poster-hash", max_entries=5000)
+
+
+def content_hash(raw: bytes) -> str:
+    return hashlib.sha256(raw).hexdigest()
+
+
+def lookup_url(url: str) -> Optional[str]:
+    """file_id previously recorded for this source URL, if any."""
+    digest = _by_url.get(url)
+    return _by_hash.get(digest) if digest else None
+
+
+def lookup_hash(digest: str) -> Optional[str]:
+    return _by_hash.get(digest)
+
+
+def remember(url: str, digest: Optional[str], file_id: str) -> None:
+    if not file_id:
+        return
+    if digest is None:
+        # We never had the bytes (Telegram fetched the URL itself); key the
+        # entry by URL only.
+        digest = "url:" + content_hash(url.encode())
+    _by_hash.set(digest, file_id, ttl=TTL)
+    _by_url.set(url, digest, ttl=TTL)
+
+
+def forget(url: str) -> None:
+    """Drop a file_id Telegram refused, so the next post re-uploads."""
+    digest = _by_url.get(url)
+    if digest:
+        _by_hash.delete(digest)
+    _by_url.delete(url)
@@ -0,0 +1,258 @@
+"""Download progress: structured events from hls.py, ffmpeg and the script.
+
+Downloads used to be silent until they finished: hls.py only logged at the
+end, ffmpeg's stderr was buffered and only its tail looked at after exit,
+and the script's output was thrown away. Now every download gets a
+Tracker, which is fed from whichever engine is running:
+
+  * hls.py calls Tracker.hls(segments_done, segments_total, bytes_written)
+    after each segment it writes;
+  * follow_ffmpeg() reads ffmpeg's `-progress` key=value blocks from a
+    stream and takes the bytes written so far (total_size) from each;
+  * the same reader takes the script's `[INFO]` / `[WARNING]` lines as
+    notes (animepahe-dl.sh passes `-progress pipe:2` to ffmpeg when
+    ANIMEPAHE_DL_PROGRESS=1).
+
+A Tracker turns those into a Progress snapshot with bytes, segments, an
+EWMA speed and an ETA. A Reporter collects a job's trackers and renders
+them into the job's status message, edited at most every
+PROGRESS_EDIT_INTERVAL seconds (Telegram rate-limits edits). Active
+trackers are also exported to /metrics (download_bytes_total,
+downloads_active, download_speed_bytes).
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import re
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+EDIT_INTERVAL = float(os.getenv("PROGRESS_EDIT_INTERVAL", "10") or 10)
+_SPEED_ALPHA = 0.3       # weight of the newest sample in the speed EWMA
+_MIN_SAMPLE = 0.5        # seconds between speed samples
+
+_SCRIPT_LINE = re.compile(r"\[(INFO|WARNING|ERROR)\]\s*(.*)")
+_ANSI = re.compile(r"\x1b\[[0-9;]*m")
+
+_active: Dict[int, "Tracker"] = {}
+
+
+@dataclass
+class Progress:
+    label: str
+    source: str = ""
+    bytes_done: int = 0
+    segments_done: int = 0
+    segments_total: Optional[int] = None
+    speed: float = 0.0               # bytes/s (EWMA)
+    eta: Optional[float] = None      # seconds
+    note: str = ""
+    done: bool = False
+
+    @property
+    def fraction(self) -> Optional[float]:
+        if self.segments_total:
+            return min(1.0, self.segments_done / self.segments_total)
+        return None
+
+
+class Tracker:
+    """Progress of one download."""
+
+    def __init__(self, label: str, source: str = "", on_update: Optional[Callable[[], None]] = None):
+        self.progress = Progress(label=label, source=source)
+        self._on_update = on_update
+        self._started = time.monotonic()
+        self._sample_at = self._started
+        self._sample_bytes = 0
+        _active[id(self)] = self
+
+    def update(
+        self, bytes_done: Optional[int] = None, segments_done: Optional[int] = None,
+        segments_total: Optional[int] = None, note: Optional[str] = None,
+    ) -> None:
+        p = self.progress
+        if bytes_done is not None and bytes_done > p.bytes_done:
+            metrics.inc("download_bytes_total", bytes_done - p.bytes_done, source=p.source)
+            p.bytes_done = bytes_done
+            self._sample_speed()
+        if segments_total is not None:
+            p.segments_total = segments_total
+        if segments_done is not None:
+            p.segments_done = segments_done
+        if note is not None:
+            p.note = note
+        p.eta = self._eta()
+        if self._on_update:
+            self._on_update()
+
+    def hls(self, segments_done: int, segments_total: int, bytes_written: int) -> None:
+        """Callback for hls.download(progress=...)."""
+        self.update(bytes_done=bytes_written, segments_done=segments_done, segments_total=segments_total)
+
+    def _sample_speed(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._sample_at
+        if elapsed < _MIN_SAMPLE:
+            return
+        rate = (self.progress.bytes_done - self._sample_bytes) / elapsed
+        speed = self.progress.speed
+        self.progress.speed = rate if not speed else _SPEED_ALPHA * rate + (1 - _SPEED_ALPHA) * speed
+        self._sample_at, self._sample_bytes = now, self.progress.bytes_done
+
+    def _eta(self) -> Optional[float]:
+        p = self.progress
+        if not (p.segments_total and p.segments_done and p.speed > 0):
+            return None
+        left = p.segments_total - p.segments_done
+        return left * (p.bytes_done / p.segments_done) / p.speed
+
+    def close(self) -> None:
+        self.progress.done = True
+        self.progress.eta = 0.0
+        _active.pop(id(self), None)
+        if self._on_update:
+            self._on_update()
+
+
+def active() -> List[Progress]:
+    return [t.progress for t in _active.values()]
+
+
+def collect_gauges() -> None:
+    """Export the active downloads before a /metrics scrape."""
+    running = active()
+    metrics.set_gauge("downloads_active", len(running))
+    metrics.set_gauge("download_speed_bytes", sum(p.speed for p in running))
+
+
+def parse_ffmpeg_block(lines: List[str]) -> Dict[str, str]:
+    """key=value lines of one `-progress` block into a dict."""
+    out: Dict[str, str] = {}
+    for line in lines:
+        key, sep, value = line.strip().partition("=")
+        if sep:
+            out[key] = value
+    return out
+
+
+async def follow_ffmpeg(
+    stream: asyncio.StreamReader, tracker: Optional[Tracker], tail: Optional[List[str]] = None,
+) -> None:
+    """
+    Feed `tracker` from an ffmpeg `-progress` stream (which may also carry
+    the script's log lines) until EOF; with no tracker the stream is just
+    drained. Other lines are kept in `tail` (last 20), so callers can still
+    report why ffmpeg failed.
+    """
+    block: List[str] = []
+    while True:
+        raw = await stream.readline()
+        if not raw:
+            break
+        line = _ANSI.sub("", raw.decode(errors="replace")).strip()
+        m = _SCRIPT_LINE.search(line)
+        if m:
+            if tracker:
+                tracker.update(note=m.group(2))
+            continue
+        if "=" in line and " " not in line:
+            block.append(line)
+            if line.startswith("progress="):
+                fields = parse_ffmpeg_block(block)
+                block = []
+                size = fields.get("total_size", "")
+                if tracker and size.isdigit():
+                    tracker.update(bytes_done=int(size))
+            continue
+        if tail is not None and line:
+            tail.append(line)
+            del tail[:-20]
+
+
+def _fmt_bytes(n: float) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if n < 1024 or unit == "GB":
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.1f} GB"
+
+
+def _fmt_eta(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds}s"
+
+
+def render(p: Progress) -> str:
+    parts = [f"⬇️ {p.label}"]
+    if p.fraction is not None:
+        parts.append(f"{p.fraction * 100:.0f}%")
+    if p.segments_total:
+        parts.append(f"{p.segments_done}/{p.segments_total} seg")
+    parts.append(_fmt_bytes(p.bytes_done))
+    if p.speed:
+        parts.append(f"{_fmt_bytes(p.speed)}/s")
+    if p.eta:
+        parts.append(f"ETA {_fmt_eta(p.eta)}")
+    return " · ".join(parts)
+
+
+class Reporter:
+    """
+    Renders a job's running downloads into its status message, at most once
+    every `interval` seconds. stop() before posting a final status, so a
+    late progress edit can't overwrite it.
+    """
+
+    def __init__(self, send: Callable[[str], Awaitable[None]], title: str = "", interval: float = EDIT_INTERVAL):
+        self._send = send
+        self.title = title
+        self.interval = interval
+        self._trackers: List[Tracker] = []
+        self._last_edit = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self._stopped = False
+
+    def track(self, label: str, source: str = "") -> Tracker:
+        tracker = Tracker(label, source, on_update=self._changed)
+        self._trackers.append(tracker)
+        return tracker
+
+    def _changed(self) -> None:
+        self._trackers = [t for t in self._trackers if not t.progress.done]
+        if self._stopped or not self._trackers or (self._task and not self._task.done()):
+            return
+        delay = self._last_edit + self.interval - time.monotonic()
+        self._task = asyncio.get_running_loop().create_task(self._edit(max(0.0, delay)))
+
+    async def _edit(self, delay: float) -> None:
+        if delay:
+            await asyncio.sleep(delay)
+        running = [t.progress for t in self._trackers if not t.progress.done]
+        if self._stopped or not running:
+            return
+        self._last_edit = time.monotonic()
+        lines = ([self.title] if self.title else []) + [render(p) for p in running]
+        try:
+            await self._send("\n".join(lines))
+        except Exception as e:
+            log.debug("progress edit failed: %s", e)
+
+    async def stop(self) -> None:
+        self._stopped = True
+        if self._task and not self._task.done():
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        for t in self._trackers:
+            _active.pop(id(t), None)
@@ -0,0 +1,76 @@
+"""Per-job scratch directories for downloads.
+
+Downloads used to land in the working directory, and after a legacy
+animepahe-dl.sh run the bot globbed the whole tree for the newest
+*.mp4 / *.mkv. That scan was O(tree), ran on the event loop, and let two
+concurrent jobs pick up each other's files. Now each job writes into its
+own directory:
+
+    <SCRATCH_DIR>/job-<id>/ep<episode>-<res>p/
+
+The download stage asks for an exact output path there. Before each
+download, check_space() makes sure the filesystem keeps
+SCRATCH_MIN_FREE_MB free. cleanup() removes the job's directory when the
+job ends, however it ends, and sweep() at startup clears whatever a crash
+left behind.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import re
+import shutil
+from typing import Iterable
+
+log = logging.getLogger(__name__)
+
+SCRATCH_DIR = os.getenv("SCRATCH_DIR", "scratch")
+MIN_FREE_BYTES = int(os.getenv("SCRATCH_MIN_FREE_MB", "1024") or 1024) * 1_048_576
+
+_UNSAFE = re.compile(r"[^A-Za-z0-9._-]+")
+
+
+class ScratchFull(Exception):
+    pass
+
+
+class Scratch:
+    """Scratch space of one job."""
+
+    def __init__(self, job_id: int, root: str = SCRATCH_DIR):
+        self.root = root
+        self.path = os.path.join(root, f"job-{job_id}")
+
+    def dir_for(self, episode: str, res: str) -> str:
+        """Empty-or-existing directory for one episode/resolution."""
+        path = os.path.join(self.path, f"ep{_UNSAFE.sub('_', episode)}-{_UNSAFE.sub('_', res)}p")
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def check_space(self, need_bytes: int = MIN_FREE_BYTES) -> None:
+        """Raise ScratchFull unless the scratch filesystem has `need_bytes` free."""
+        os.makedirs(self.root, exist_ok=True)
+        free = shutil.disk_usage(self.root).free
+        if free < need_bytes:
+            raise ScratchFull(
+                f"only {free // 1_048_576} MB free in {self.root} "
+                f"(need {need_bytes // 1_048_576} MB)"
+            )
+
+    def cleanup(self) -> None:
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def sweep(keep: Iterable[int] = (), root: str = SCRATCH_DIR) -> int:
+    """Remove job directories other than `keep`; returns how many were removed."""
+    if not os.path.isdir(root):
+        return 0
+    keep_names = {f"job-{job_id}" for job_id in keep}
+    removed = 0
+    for name in os.listdir(root):
+        if name.startswith("job-") and name not in keep_names:
+            shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+            removed += 1
+    if removed:
+        log.info("Removed %d leftover scratch dir(s) from %s", removed, root)
+    return removed
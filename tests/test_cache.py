@@ -0,0 +1,59 @@
+"""cache.TTLCache: per-entry expiry and LRU eviction."""
+from __future__ import annotations
+
+import pytest
+
+import cache
+
+
+class _Clock:
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = _Clock()
+    monkeypatch.setattr(cache.time, "time", c)
+    return c
+
+
+def test_entries_expire(tmp_path, clock):
+    c = cache.TTLCache("t", path=str(tmp_path / "c.sqlite3"))
+    c.set("short", {"v": 1}, ttl=10)
+    c.set("long", [1, 2], ttl=100)
+    assert c.get("short") == {"v": 1}
+    clock.now += 11
+    assert c.get("short") is None
+    assert c.get("short", "missing") == "missing"
+    assert c.get("long") == [1, 2]
+    # Expired entries are dropped on read.
+    assert len(c) == 1
+
+
+def test_least_recently_used_evicted(tmp_path, clock):
+    c = cache.TTLCache("t", max_entries=5, path=str(tmp_path / "c.sqlite3"))
+    for i in range(5):
+        clock.now += 1
+        c.set(f"k{i}", i, ttl=3600)
+    clock.now += 1
+    assert c.get("k0") == 0         # k0 is now the most recently used
+    # Eviction runs every 20 writes; push enough to trigger it.
+    for i in range(5, 20):
+        clock.now += 1
+        c.set(f"k{i}", i, ttl=3600)
+    assert len(c) == 5
+    assert c.get("k19") == 19
+    assert c.get("k1") is None
+
+
+def test_namespaces_are_separate(tmp_path, clock):
+    path = str(tmp_path / "c.sqlite3")
+    a, b = cache.TTLCache("a", path=path), cache.TTLCache("b", path=path)
+    a.set("k", 1, ttl=60)
+    assert b.get("k") is None
+    b.clear()
+    assert a.get("k") == 1
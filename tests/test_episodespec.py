@@ -0,0 +1,34 @@
+"""episodespec.parse."""
+from __future__ import annotations
+
+import pytest
+
+import episodespec
+
+
+@pytest.mark.parametrize("spec, expected", [
+    ("5", ["5"]),
+    (" 05 ", ["5"]),
+    ("12.5", ["12.5"]),
+    ("1-3", ["1", "2", "3"]),
+    ("1,3,7-9", ["1", "3", "7", "8", "9"]),
+    ("3,1-2,2", ["1", "2", "3"]),
+    ("1,,2", ["1", "2"]),
+    ("*", None),
+    ("1-3,*", None),
+])
+def test_valid_specs(spec, expected):
+    assert episodespec.parse(spec) == expected
+
+
+@pytest.mark.parametrize("spec", ["", "abc", "nan", "inf", "1e3", "-1", "1-", "a-3", "1.5-3", "1-2-3"])
+def test_malformed_specs(spec):
+    assert episodespec.parse(spec) == []
+
+
+def test_spec_size_is_capped():
+    limit = episodespec.MAX_EPISODES
+    assert len(episodespec.parse(f"1-{limit}")) == limit
+    assert episodespec.parse(f"1-{limit + 1}") == []
+    assert episodespec.parse("1-100000000") == []
+    assert episodespec.parse(f"1-{limit},{limit + 1}") == []
@@ -0,0 +1,140 @@
+"""hls.download_to_ts against a local m3u8 server."""
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+
+import aiohttp
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from cryptography.hazmat.primitives import padding
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+import hls
+
+SEGMENTS = [bytes([i]) * 1000 for i in range(6)]
+
+
+def _playlist_text(count: int, header: str = "") -> str:
+    return "#EXTM3U\n#EXT-X-TARGETDURATION:4\n" + header + "".join(
+        f"#EXTINF:4.0,\nseg{i}.ts\n" for i in range(count)
+    ) + "#EXT-X-ENDLIST\n"
+
+
+def _app(segments=SEGMENTS, playlist=None, key=None, fetched=None) -> web.Application:
+    playlist = playlist or _playlist_text(len(segments))
+
+    async def _playlist(request: web.Request) -> web.Response:
+        return web.Response(text=playlist, content_type="application/vnd.apple.mpegurl")
+
+    async def _segment(request: web.Request) -> web.Response:
+        n = int(request.match_info["n"])
+        if fetched is not None:
+            fetched.append(n)
+        return web.Response(body=segments[n])
+
+    async def _key(request: web.Request) -> web.Response:
+        return web.Response(body=key)
+
+    app = web.Application()
+    app.router.add_get("/index.m3u8", _playlist)
+    app.router.add_get("/seg{n}.ts", _segment)
+    app.router.add_get("/key.bin", _key)
+    return app
+
+
+def _encrypt(data: bytes, key: bytes, iv: bytes) -> bytes:
+    padder = padding.PKCS7(128).padder()
+    padded = padder.update(data) + padder.finalize()
+    encryptor = Cipher(algorithms.AES(key), modes.CBC(iv)).encryptor()
+    return encryptor.update(padded) + encryptor.finalize()
+
+
+def _write_checkpoint(out: str, fingerprint: str, segments: int, nbytes: int) -> None:
+    with open(hls.checkpoint_path(out), "w") as f:
+        json.dump({"fingerprint": fingerprint, "segments": segments, "bytes": nbytes}, f)
+
+
+async def _download(out_path: str, progress=None, app=None, concurrency: int = 3) -> str:
+    async with TestServer(app or _app()) as server, aiohttp.ClientSession() as session:
+        url = str(server.make_url("/index.m3u8"))
+        return await hls.download_to_ts(url, out_path, concurrency=concurrency, session=session, progress=progress)
+
+
+def test_download_without_progress(tmp_path):
+    out = str(tmp_path / "ep.ts")
+    assert asyncio.run(_download(out)) == out
+    with open(out, "rb") as f:
+        assert f.read() == b"".join(SEGMENTS)
+    assert not os.path.exists(hls.checkpoint_path(out))
+
+
+def test_download_with_progress(tmp_path):
+    out = str(tmp_path / "ep.ts")
+    calls = []
+    asyncio.run(_download(out, progress=lambda *a: calls.append(a)))
+    with open(out, "rb") as f:
+        assert f.read() == b"".join(SEGMENTS)
+    total = len(SEGMENTS)
+    assert calls[0] == (0, total, 0)
+    assert calls[-1] == (total, total, sum(map(len, SEGMENTS)))
+    assert [c[0] for c in calls] == list(range(total + 1))
+
+
+def test_writer_failure_aborts_download(tmp_path):
+    out = str(tmp_path / "ep.ts")
+    segments = [bytes([i % 256]) * 100 for i in range(40)]
+
+    def _progress(done, total, nbytes):
+        if done == 3:
+            raise OSError(28, "No space left on device")
+
+    # Used to hang: workers waited on the write window forever.
+    with pytest.raises(OSError) as exc:
+        asyncio.run(asyncio.wait_for(
+            _download(out, progress=_progress, app=_app(segments)), timeout=10,
+        ))
+    assert exc.value.errno == 28
+    # The partial file keeps a checkpoint to resume from.
+    assert os.path.exists(hls.checkpoint_path(out))
+
+
+def test_resume_from_checkpoint(tmp_path):
+    out = str(tmp_path / "ep.ts")
+    fingerprint = hls._fingerprint(hls.parse_m3u8(_playlist_text(len(SEGMENTS)), "http://x/"))
+    # Two segments written, plus a torn third one past the checkpoint.
+    with open(out, "wb") as f:
+        f.write(SEGMENTS[0] + SEGMENTS[1] + b"torn")
+    _write_checkpoint(out, fingerprint, 2, 2 * len(SEGMENTS[0]))
+    fetched = []
+    asyncio.run(_download(out, app=_app(fetched=fetched)))
+    with open(out, "rb") as f:
+        assert f.read() == b"".join(SEGMENTS)
+    assert sorted(fetched) == list(range(2, len(SEGMENTS)))
+
+
+def test_resume_ignores_checkpoint_for_other_stream(tmp_path):
+    out = str(tmp_path / "ep.ts")
+    with open(out, "wb") as f:
+        f.write(b"x" * 5000)
+    _write_checkpoint(out, "99:396.000:0", 5, 5000)
+    fetched = []
+    asyncio.run(_download(out, app=_app(fetched=fetched)))
+    with open(out, "rb") as f:
+        assert f.read() == b"".join(SEGMENTS)
+    assert sorted(fetched) == list(range(len(SEGMENTS)))
+
+
+def test_decrypt_with_iv_from_media_sequence(tmp_path):
+    out = str(tmp_path / "ep.ts")
+    key = bytes(range(16))
+    first = 7
+    encrypted = [_encrypt(seg, key, (first + i).to_bytes(16, "big")) for i, seg in enumerate(SEGMENTS)]
+    playlist = _playlist_text(
+        len(SEGMENTS), f'#EXT-X-MEDIA-SEQUENCE:{first}\n#EXT-X-KEY:METHOD=AES-128,URI="key.bin"\n',
+    )
+    asyncio.run(_download(out, app=_app(encrypted, playlist=playlist, key=key)))
+    with open(out, "rb") as f:
+        assert f.read() == b"".join(SEGMENTS)
@@ -0,0 +1,53 @@
+"""jobs.JobStore: claiming, requeueing interrupted jobs, resume steps."""
+from __future__ import annotations
+
+import jobs
+
+
+def _store(tmp_path) -> jobs.JobStore:
+    return jobs.JobStore(str(tmp_path / "jobs.sqlite3"))
+
+
+def test_requeue_running(tmp_path):
+    store = _store(tmp_path)
+    running = store.add("anime", {"anime_name": "x"})
+    waiting = store.add("anime", {"anime_name": "y"})
+    finished = store.add("anime", {"anime_name": "z"})
+    assert store.claim_next().id == running.id
+    store.update(finished.id, state=jobs.DONE)
+
+    requeued = store.requeue_running(max_attempts=3)
+    assert [(j.id, j.state) for j in requeued] == [(running.id, jobs.QUEUED)]
+    assert store.get(running.id).state == jobs.QUEUED
+    assert store.get(waiting.id).state == jobs.QUEUED
+    assert store.get(finished.id).state == jobs.DONE
+    # Oldest first again.
+    assert store.claim_next().id == running.id
+
+
+def test_requeue_gives_up_after_max_attempts(tmp_path):
+    store = _store(tmp_path)
+    job = store.add("anime", {})
+    for attempt in range(1, 4):
+        assert store.claim_next().attempts == attempt
+        (interrupted,) = store.requeue_running(max_attempts=3)
+    assert interrupted.state == jobs.FAILED
+    stored = store.get(job.id)
+    assert stored.state == jobs.FAILED
+    assert stored.error == "interrupted too many times"
+    assert store.claim_next() is None
+
+
+def test_mark_done_survives_requeue(tmp_path):
+    store = _store(tmp_path)
+    queue = jobs.JobQueue(store)
+    job = store.add("anime", {"anime_name": "x"})
+    claimed = store.claim_next()
+    queue.mark_done(claimed, "upload 1 720")
+    queue.mark_done(claimed, "upload 1 720")
+    store.requeue_running()
+    again = store.claim_next()
+    assert again.id == job.id
+    assert again.is_done("upload 1 720")
+    assert not again.is_done("upload 1 1080")
+    assert again.params["done"] == ["upload 1 720"]
@@ -0,0 +1,139 @@
+"""Optional pool of extra Telegram sessions for uploading large files.
+
+Every upload used to go through the bot's single pyrogram client, so one
+session's upload bandwidth and flood limits capped the whole bot. With
+UPLOAD_SESSIONS set (comma-separated bot tokens and/or user session
+strings), each extra session is started here. Large files are uploaded by
+those sessions straight into DB_CHANNEL, several at once:
+
+    task = pool.submit(path, caption, size)   # None: main client does it
+    db_msg = await task                       # helper's DB_CHANNEL message
+    ...
+    with pool.main_upload(path, size):        # when the main client does it
+        await app.send_document(...)
+
+file_ids are only valid for the client that received them, so the bot
+then fetches that DB_CHANNEL message with its own client and posts the
+document to MAIN_CHANNEL by its own file_id. That post takes no upload time.
+The helper's message doubles as the DB mirror.
+
+Scheduling is by size: every session, including the main client (see
+main_upload()), carries the bytes assigned to it and not yet uploaded. A
+file goes to the least loaded one. Each helper uploads one file at a time.
+Files under UPLOAD_POOL_MIN_MB are always left to the main client.
+"""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import logging
+import os
+import re
+from typing import Dict, Iterator, List, Optional
+
+from pyrogram import Client
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+SESSIONS = [s.strip() for s in os.getenv("UPLOAD_SESSIONS", "").split(",") if s.strip()]
+MIN_BYTES = int(os.getenv("UPLOAD_POOL_MIN_MB", "20") or 20) * 1_048_576
+
+_BOT_TOKEN = re.compile(r"^\d+:[\w-]{30,}$")
+
+
+class _Session:
+    def __init__(self, name: str, client: Client):
+        self.name = name
+        self.client = client
+        self.lock = asyncio.Lock()
+        self.pending = 0        # bytes assigned and not uploaded yet
+
+
+class UploadPool:
+    def __init__(self) -> None:
+        self.sessions: List[_Session] = []
+        self.chat_id: Optional[int] = None
+        self.main_pending = 0
+        self._main_reserved: Dict[str, int] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.sessions)
+
+    async def start(self, api_id: int, api_hash: str, chat_id: int, specs: List[str] = SESSIONS) -> None:
+        """Start every session in `specs` that can post to `chat_id`; skip the rest."""
+        self.chat_id = chat_id
+        for i, spec in enumerate(specs, 1):
+            name = f"uploader{i}"
+            auth = {"bot_token": spec} if _BOT_TOKEN.match(spec) else {"session_string": spec}
+            client = Client(name, api_id=api_id, api_hash=api_hash, in_memory=True, no_updates=True, **auth)
+            try:
+                await client.start()
+                # Also caches the channel peer, which send_document needs.
+                await client.get_chat(chat_id)
+            except Exception as e:
+                log.warning("Upload session %s not usable: %s", name, e)
+                with contextlib.suppress(Exception):
+                    await client.stop()
+                continue
+            self.sessions.append(_Session(name, client))
+        if self.sessions:
+            log.info("Upload pool: %d extra session(s)", len(self.sessions))
+
+    async def stop(self) -> None:
+        sessions, self.sessions = self.sessions, []
+        for s in sessions:
+            with contextlib.suppress(Exception):
+                await s.client.stop()
+
+    @contextlib.contextmanager
+    def main_upload(self, path: str, size: int) -> Iterator[None]:
+        """Count an upload the main client is doing towards its load."""
+        self.release(path)
+        self.main_pending += size
+        try:
+            yield
+        finally:
+            self.main_pending -= size
+
+    def release(self, path: str) -> None:
+        """Drop the main client's reservation for `path` (see submit)."""
+        self.main_pending -= self._main_reserved.pop(path, 0)
+
+    def submit(self, path: str, caption: str, size: int) -> Optional[asyncio.Task]:
+        """
+        Hand `path` to the least loaded helper session. Returns a task that
+        resolves to the helper's DB_CHANNEL message (None if that upload
+        failed), or None when the main client should upload it itself.
+        """
+        if not self.sessions or size < MIN_BYTES:
+            return None
+        session = min(self.sessions, key=lambda s: s.pending)
+        if self.main_pending < session.pending:
+            # The main client's turn: reserve it until main_upload() / release().
+            self.main_pending += size
+            self._main_reserved[path] = self._main_reserved.get(path, 0) + size
+            return None
+        session.pending += size
+        return asyncio.create_task(self._upload(session, path, caption, size))
+
+    async def _upload(self, session: _Session, path: str, caption: str, size: int):
+        try:
+            async with session.lock:
+                with metrics.timer("upload_seconds", stage="upload_pool"):
+                    msg = await session.client.send_document(
+                        self.chat_id, document=path, caption=caption, force_document=True,
+                    )
+            metrics.inc("upload_bytes_total", size)
+            metrics.inc("upload_pool_bytes_total", size, session=session.name)
+            return msg
+        except Exception as e:
+            log.warning("Upload session %s failed on %s: %s", session.name, os.path.basename(path), e)
+            return None
+        finally:
+            session.pending -= size
+
+
+pool = UploadPool()
@@ -0,0 +1,102 @@
+"""Index of episodes we've already uploaded.
+
+Maps (series, episode, resolution, source) to where the file lives on
+Telegram: the MAIN_CHANNEL message, its DB_CHANNEL mirror and the document
+file_id. A repeat request for the same episode/resolution can then be
+answered with copy_message (or a file_id send) in well under a second,
+instead of downloading and uploading hundreds of MB again.
+
+Stored in SQLite under DATA_DIR, like jobs.py. `series` is whatever key the
+caller normalizes titles to; this module treats it as an opaque string.
+"""
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import List, Optional
+
+DATA_DIR = os.getenv("DATA_DIR", "data")
+
+
+@dataclass
+class Upload:
+    series: str
+    episode: str
+    resolution: str
+    source: str
+    main_message_id: Optional[int]
+    db_message_id: Optional[int]
+    file_id: Optional[str]
+    file_name: str
+    size: int
+    created: float
+
+
+class UploadIndex:
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.path.join(DATA_DIR, "uploads.sqlite3")
+        parent = os.path.dirname(self.path)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS uploads ("
+            " series TEXT NOT NULL, episode TEXT NOT NULL, resolution TEXT NOT NULL,"
+            " source TEXT NOT NULL, main_message_id INTEGER, db_message_id INTEGER,"
+            " file_id TEXT, file_name TEXT NOT NULL DEFAULT '', size INTEGER NOT NULL DEFAULT 0,"
+            " created REAL NOT NULL,"
+            " PRIMARY KEY (series, episode, resolution, source))"
+        )
+
+    _COLUMNS = (
+        "series, episode, resolution, source, main_message_id, db_message_id,"
+        " file_id, file_name, size, created"
+    )
+
+    def record(self, upload: Upload) -> None:
+        with self._lock:
+            self._db.execute(
+                f"INSERT OR REPLACE INTO uploads ({self._COLUMNS})"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (upload.series, upload.episode, upload.resolution, upload.source,
+                 upload.main_message_id, upload.db_message_id, upload.file_id,
+                 upload.file_name, upload.size, upload.created or time.time()),
+            )
+
+    def lookup(self, series: str, episode: str, resolution: str) -> Optional[Upload]:
+        """Most recent upload of this episode/resolution from any source."""
+        with self._lock:
+            row = self._db.execute(
+                f"SELECT {self._COLUMNS} FROM uploads"
+                " WHERE series = ? AND episode = ? AND resolution = ?"
+                " ORDER BY created DESC LIMIT 1",
+                (series, episode, resolution),
+            ).fetchone()
+        return Upload(*row) if row else None
+
+    def invalidate(
+        self, series: str, episode: Optional[str] = None, resolution: Optional[str] = None,
+    ) -> int:
+        """Delete matching entries (all episodes / resolutions when omitted)."""
+        sql = "DELETE FROM uploads WHERE series = ?"
+        args: List[str] = [series]
+        if episode is not None:
+            sql += " AND episode = ?"
+            args.append(episode)
+        if resolution is not None:
+            sql += " AND resolution = ?"
+            args.append(resolution)
+        with self._lock:
+            return self._db.execute(sql, args).rowcount
+
+    def delete(self, upload: Upload) -> None:
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM uploads WHERE series = ? AND episode = ? AND resolution = ? AND source = ?",
+                (upload.series, upload.episode, upload.resolution, upload.source),
+            )